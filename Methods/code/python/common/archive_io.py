@@ -0,0 +1,163 @@
+"""Module containing functions for reading compressed files as text streams.
+
+GBIF and iDigBio downloads are delivered as zip archives, and intermediate
+files are often gzipped.  These functions open a zip member, gzip file, or
+plain file as a text stream so it can be parsed without extracting it to
+disk first.  Decompression can optionally run in a background thread that
+reads ahead of the parser; zlib releases the GIL while decompressing, so the
+two overlap.
+"""
+import gzip
+import io
+import os
+import queue
+import threading
+import zipfile
+
+# Data files looked for in an archive when no member is specified
+DEFAULT_MEMBERS = ('occurrence.txt', 'occurrence.csv', 'occurrence_raw.csv')
+GZIP_EXTENSIONS = ('.gz', '.gzip')
+ZIP_EXTENSIONS = ('.zip',)
+READ_AHEAD_CHUNK_SIZE = 1024 * 1024
+READ_AHEAD_CHUNKS = 8
+
+
+# .............................................................................
+def is_archive(filename):
+    """Is the file a zip or gzip archive, judged by its extension."""
+    return os.path.splitext(filename)[1].lower() in (
+        GZIP_EXTENSIONS + ZIP_EXTENSIONS)
+
+
+# .............................................................................
+def get_archive_member(zip_file, member=None):
+    """Get the name of the data file to read from a zip archive.
+
+    Args:
+        zip_file (zipfile.ZipFile): The open archive.
+        member (str): A specific member name to read.
+
+    Returns:
+        str - The member name.
+
+    Raises:
+        ValueError: Raised if the data file cannot be determined.
+    """
+    names = [name for name in zip_file.namelist() if not name.endswith('/')]
+    if member is not None:
+        if member not in names:
+            raise ValueError(
+                '{} not found in archive, members: {}'.format(member, names))
+        return member
+    for default_member in DEFAULT_MEMBERS:
+        if default_member in names:
+            return default_member
+    if len(names) == 1:
+        return names[0]
+    raise ValueError(
+        'Cannot choose a data file from archive members: {}'.format(names))
+
+
+# .............................................................................
+class ReadAheadReader(io.RawIOBase):
+    """This class reads a binary stream ahead in a background thread."""
+    # ..........................
+    def __init__(self, raw, chunk_size=READ_AHEAD_CHUNK_SIZE,
+                 max_chunks=READ_AHEAD_CHUNKS):
+        """Constructor.
+
+        Args:
+            raw (file-like): The binary stream to read from.
+            chunk_size (int): The number of bytes read at a time.
+            max_chunks (int): The number of chunks to read ahead.
+        """
+        super().__init__()
+        self.raw = raw
+        self.chunk_size = chunk_size
+        self._queue = queue.Queue(max_chunks)
+        self._pending = memoryview(b'')
+        self._eof = False
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._fill, daemon=True)
+        self._thread.start()
+
+    # ..........................
+    def _put(self, item):
+        """Put an item on the queue unless the reader is closed."""
+        while not self._stop.is_set():
+            try:
+                self._queue.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    # ..........................
+    def _fill(self):
+        """Read chunks from the raw stream until it is exhausted."""
+        try:
+            while True:
+                chunk = self.raw.read(self.chunk_size)
+                if not self._put(chunk) or not chunk:
+                    return
+        except Exception as err:
+            self._put(err)
+
+    # ..........................
+    def readable(self):
+        return True
+
+    # ..........................
+    def readinto(self, buffer):
+        """Read bytes into a buffer, returning 0 at the end of the stream."""
+        if not self._pending and not self._eof:
+            chunk = self._queue.get()
+            if isinstance(chunk, Exception):
+                raise chunk
+            if not chunk:
+                self._eof = True
+            self._pending = memoryview(chunk)
+        num_bytes = min(len(buffer), len(self._pending))
+        buffer[:num_bytes] = self._pending[:num_bytes]
+        self._pending = self._pending[num_bytes:]
+        return num_bytes
+
+    # ..........................
+    def close(self):
+        """Stop reading ahead and close the raw stream."""
+        if not self.closed:
+            self._stop.set()
+            self._thread.join()
+            self.raw.close()
+        super().close()
+
+
+# .............................................................................
+def open_text(filename, member=None, encoding='utf-8', newline='',
+              read_ahead=False):
+    """Open a plain, gzip, or zip file as a text stream.
+
+    Args:
+        filename (str): The file location to open.
+        member (str): The member to read from a zip archive.  Defaults to a
+            GBIF or iDigBio occurrence file, or the only file present.
+        encoding (str): The text encoding.
+        newline (str): Newline handling, see io.TextIOWrapper.  The default
+            of '' is what the csv module expects.
+        read_ahead (bool): Decompress in a background thread.
+
+    Returns:
+        io.TextIOBase - The open text stream.
+    """
+    extension = os.path.splitext(filename)[1].lower()
+    if extension in ZIP_EXTENSIONS:
+        # The member stays readable after the archive object is closed
+        with zipfile.ZipFile(filename) as zip_file:
+            binary = zip_file.open(get_archive_member(zip_file, member))
+    elif extension in GZIP_EXTENSIONS:
+        binary = gzip.open(filename, 'rb')
+    else:
+        return open(filename, 'r', encoding=encoding, newline=newline)
+    if read_ahead:
+        binary = io.BufferedReader(ReadAheadReader(binary))
+    return io.TextIOWrapper(binary, encoding=encoding, newline=newline)
@@ -0,0 +1,68 @@
+"""Module containing functions for splitting text files into byte ranges.
+
+Large delimited files are split into ranges that start and end on line
+boundaries so each range can be read and parsed by a separate worker.  A
+range boundary is found by seeking to an approximate offset and skipping to
+the end of that line, so a record containing a newline inside a quoted field
+may be split across two ranges.  Only use ranges for files without quoted
+newlines, such as tab delimited GBIF downloads.
+"""
+import io
+import os
+
+DEFAULT_RANGE_SIZE = 64 * 1024 * 1024
+
+
+# .............................................................................
+def get_byte_ranges(filename, range_size=DEFAULT_RANGE_SIZE,
+                    skip_header=False):
+    """Get newline aligned byte ranges covering a file.
+
+    Args:
+        filename (str): The file location to split.
+        range_size (int): The approximate number of bytes in each range.
+        skip_header (bool): Start the first range after the first line.
+
+    Returns:
+        list of tuple - (start, end) byte offsets, end exclusive.
+    """
+    file_size = os.path.getsize(filename)
+    boundaries = []
+    with open(filename, 'rb') as in_file:
+        if skip_header:
+            in_file.readline()
+        start = in_file.tell()
+        boundaries.append(start)
+        offset = start + range_size
+        while offset < file_size:
+            in_file.seek(offset)
+            in_file.readline()
+            boundary = in_file.tell()
+            if boundary >= file_size:
+                break
+            if boundary > boundaries[-1]:
+                boundaries.append(boundary)
+            offset = boundary + range_size
+    boundaries.append(file_size)
+    return [
+        (boundaries[i], boundaries[i + 1]) for i in range(
+            len(boundaries) - 1) if boundaries[i] < boundaries[i + 1]]
+
+
+# .............................................................................
+def open_byte_range(filename, byte_range, encoding='utf-8'):
+    """Read a byte range of a file as a text stream.
+
+    Args:
+        filename (str): The file location to read.
+        byte_range (tuple): The (start, end) byte offsets to read.
+        encoding (str): The text encoding of the file.
+
+    Returns:
+        io.StringIO - The text of the range, suitable for csv.reader.
+    """
+    start, end = byte_range
+    with open(filename, 'rb') as in_file:
+        in_file.seek(start)
+        data = in_file.read(end - start)
+    return io.StringIO(data.decode(encoding), newline='')
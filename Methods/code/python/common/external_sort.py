@@ -0,0 +1,188 @@
+"""Module containing a bounded memory external merge sort.
+
+Items are read in runs of a fixed size, each run is sorted by a worker and
+spilled to a temporary file, and the sorted runs are merged lazily.  At most
+max_merge_runs run files are merged at once, so if there are more runs than
+that, consecutive groups of runs are first merged into longer runs, in as
+many passes as needed.  Run files are written and read back in blocks sized
+so a whole merge holds about one run of items, so only the runs being sorted
+or merged are in memory at a time.  The sort is stable, like list.sort.
+"""
+import heapq
+import itertools
+import os
+import pickle
+import shutil
+import tempfile
+
+from .parallel import map_in_order
+
+DEFAULT_RUN_SIZE = 1000000
+# The most run files open and merged at once
+DEFAULT_MAX_MERGE_RUNS = 64
+# A rough size of one parsed occurrence point in memory, in bytes
+ESTIMATED_ITEM_SIZE = 600
+
+
+# .............................................................................
+def get_run_size(max_memory, max_workers, item_size=ESTIMATED_ITEM_SIZE):
+    """Get a run size that keeps the runs in memory under a limit.
+
+    Args:
+        max_memory (int): The memory limit for runs, in megabytes.
+        max_workers (int): The number of workers sorting runs.  Up to two runs
+            per worker are in flight plus the run being read.
+        item_size (int): The estimated size of an item, in bytes.
+
+    Returns:
+        int - The number of items per run.
+    """
+    max_runs = 2 * max_workers + 1
+    return max(1, int(max_memory * 1024 * 1024 / (item_size * max_runs)))
+
+
+# .............................................................................
+def _get_runs(items, run_size):
+    """Yield lists of at most run_size items."""
+    run = []
+    for item in items:
+        run.append(item)
+        if len(run) >= run_size:
+            yield run
+            run = []
+    if run:
+        yield run
+
+
+# .............................................................................
+def _write_run_file(items, temp_dir, block_size):
+    """Pickle items to a new temporary run file, block_size at a time."""
+    run_fd, run_filename = tempfile.mkstemp(suffix='.run', dir=temp_dir)
+    with os.fdopen(run_fd, 'wb') as run_file:
+        for block in _get_runs(items, block_size):
+            pickle.dump(block, run_file, protocol=pickle.HIGHEST_PROTOCOL)
+    return run_filename
+
+
+# .............................................................................
+def get_run_sorter(key, temp_dir, block_size):
+    """Get a function that sorts a run and spills it to a temporary file.
+
+    Args:
+        key (function): The sort key function, must be picklable.
+        temp_dir (str): The directory to write run files in.
+        block_size (int): The number of items pickled together.
+
+    Returns:
+        function - A function that takes a run (list of items) and returns
+            the file location of the sorted run.
+    """
+    # .......................
+    def sort_run(run):
+        run.sort(key=key)
+        return _write_run_file(run, temp_dir, block_size)
+    return sort_run
+
+
+# .............................................................................
+def get_run_merger(key, temp_dir, block_size):
+    """Get a function that merges sorted run files into one run file.
+
+    Args:
+        key (function): The sort key function, must be picklable.
+        temp_dir (str): The directory to write run files in.
+        block_size (int): The number of items pickled together.
+
+    Returns:
+        function - A function that takes a list of run file locations,
+            merges them into a new run file, deletes them, and returns the
+            location of the new run file.
+    """
+    # .......................
+    def merge_runs(run_filenames):
+        run_filename = _write_run_file(
+            _merge_run_files(run_filenames, key), temp_dir, block_size)
+        for filename in run_filenames:
+            os.remove(filename)
+        return run_filename
+    return merge_runs
+
+
+# .............................................................................
+def iter_run_file(run_filename):
+    """Iterate over the items in a spilled run file."""
+    with open(run_filename, 'rb') as run_file:
+        while True:
+            try:
+                block = pickle.load(run_file)
+            except EOFError:
+                return
+            for item in block:
+                yield item
+
+
+# .............................................................................
+def _merge_run_files(run_filenames, key):
+    """Merge sorted run files, keeping equal items in run order."""
+    return heapq.merge(*[iter_run_file(fn) for fn in run_filenames], key=key)
+
+
+# .............................................................................
+def external_sort(items, key=None, run_size=DEFAULT_RUN_SIZE, temp_dir=None,
+                  backend='process', max_workers=None,
+                  max_merge_runs=DEFAULT_MAX_MERGE_RUNS):
+    """Sort items that may not fit in memory.
+
+    Args:
+        items (iterable): The items to sort.  With the process backend, items
+            and key must be picklable.
+        key (function): A function returning the sort key for an item.
+        run_size (int): The maximum number of items sorted in memory at once
+            by one worker.
+        temp_dir (str): The directory to create temporary run files in.
+            Defaults to the system temporary directory.
+        backend (str): 'process' or 'thread', see parallel.map_in_order.
+        max_workers (int): The maximum number of workers sorting or merging
+            runs.
+        max_merge_runs (int): The maximum number of run files merged at once.
+
+    Yields:
+        The items in sorted order.
+
+    Raises:
+        ValueError: Raised if max_merge_runs is less than 2.
+    """
+    if max_merge_runs < 2:
+        raise ValueError(
+            'max_merge_runs must be at least 2, not {}'.format(
+                max_merge_runs))
+    runs = _get_runs(items, run_size)
+    first_run = next(runs, [])
+    if len(first_run) < run_size:
+        # Everything fits in one run, no need to spill
+        first_run.sort(key=key)
+        for item in first_run:
+            yield item
+        return
+
+    # A merge reads one block from each of its runs at a time
+    block_size = max(1, run_size // max_merge_runs)
+    run_dir = tempfile.mkdtemp(prefix='external_sort_', dir=temp_dir)
+    try:
+        runs = itertools.chain([first_run], runs)
+        del first_run
+        run_filenames = list(
+            map_in_order(
+                get_run_sorter, (key, run_dir, block_size), runs,
+                backend=backend, max_workers=max_workers))
+        while len(run_filenames) > max_merge_runs:
+            # Merging consecutive runs keeps equal items in input order
+            run_filenames = list(
+                map_in_order(
+                    get_run_merger, (key, run_dir, block_size),
+                    _get_runs(run_filenames, max_merge_runs),
+                    backend=backend, max_workers=max_workers))
+        for item in _merge_run_files(run_filenames, key):
+            yield item
+    finally:
+        shutil.rmtree(run_dir, ignore_errors=True)
@@ -0,0 +1,98 @@
+"""Module containing functions for mapping a function over items in parallel.
+
+The worker function is built by a factory so that expensive setup (filters,
+lookups, open files) happens once per worker instead of once per item.  With
+the process backend the factory runs in each worker process, so the factory
+and its arguments must be picklable, but the function it returns does not
+need to be.
+"""
+from collections import deque
+import os
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+BACKENDS = ('thread', 'process')
+
+_worker_function = None
+
+
+# .............................................................................
+def _init_worker(factory, factory_args, factory_kwargs):
+    """Build the worker function for this process."""
+    global _worker_function
+    _worker_function = factory(*factory_args, **factory_kwargs)
+
+
+# .............................................................................
+def _run_chunk(chunk):
+    """Run the worker function for each item in a chunk."""
+    return [_worker_function(item) for item in chunk]
+
+
+# .............................................................................
+def _get_chunks(items, chunk_size):
+    """Yield lists of at most chunk_size items."""
+    chunk = []
+    for item in items:
+        chunk.append(item)
+        if len(chunk) >= chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+# .............................................................................
+def map_in_order(factory, factory_args, items, factory_kwargs=None,
+                 backend='thread', max_workers=None, chunk_size=1):
+    """Map a worker function over items, yielding results in item order.
+
+    Items are sent to the workers in chunks and only a bounded number of
+    chunks are in flight at once, so results are streamed back as they are
+    consumed rather than accumulating for the whole list.
+
+    Args:
+        factory (function): A function that returns the worker function.
+        factory_args (tuple): Positional arguments for the factory.
+        items (iterable): The items to pass to the worker function.
+        factory_kwargs (dict): Keyword arguments for the factory.
+        backend (str): 'thread' to share one worker function between threads,
+            or 'process' to build one per worker process.
+        max_workers (int): The maximum number of threads or processes.
+        chunk_size (int): The number of items sent to a worker at a time.
+
+    Yields:
+        The worker function result for each item, in the order of items.
+
+    Raises:
+        ValueError: Raised if the backend is not recognized.
+    """
+    if factory_kwargs is None:
+        factory_kwargs = {}
+    if max_workers is None:
+        max_workers = os.cpu_count() or 1
+    if backend == 'thread':
+        worker_function = factory(*factory_args, **factory_kwargs)
+        executor = ThreadPoolExecutor(max_workers=max_workers)
+
+        def run_chunk(chunk):
+            return [worker_function(item) for item in chunk]
+    elif backend == 'process':
+        executor = ProcessPoolExecutor(
+            max_workers=max_workers, initializer=_init_worker,
+            initargs=(factory, factory_args, factory_kwargs))
+        run_chunk = _run_chunk
+    else:
+        raise ValueError(
+            'Unknown backend {}, must be one of {}'.format(backend, BACKENDS))
+
+    max_in_flight = 2 * max_workers
+    with executor:
+        pending = deque()
+        for chunk in _get_chunks(items, chunk_size):
+            pending.append(executor.submit(run_chunk, chunk))
+            if len(pending) >= max_in_flight:
+                for result in pending.popleft().result():
+                    yield result
+        while pending:
+            for result in pending.popleft().result():
+                yield result
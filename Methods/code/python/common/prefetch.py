@@ -0,0 +1,196 @@
+"""Module containing a background prefetcher for per-item input files.
+
+Scripts that process one species at a time spend much of their time waiting
+on opening and reading small files from network storage.  A FilePrefetcher
+reads the files for the next items of a list into memory in a background
+thread while earlier items are processed, bounded both by the number of items
+read ahead and by the number of bytes held.
+
+File sizes are checked before the files are read, so the byte budget is
+reserved before the memory is used.  The bytes of an item stay reserved while
+it is processed: until the next item is requested, or, with manual_release,
+until the consumer calls release() once it has finished with the item.
+"""
+from collections import deque
+import io
+import os
+import queue
+import threading
+
+DEFAULT_DEPTH = 64
+DEFAULT_MAX_BYTES = 256 * 1024 * 1024
+
+_END = object()
+
+
+# .............................................................................
+def open_prefetched(filename, files=None, encoding='utf-8'):
+    """Open a file as text from prefetched contents, or from disk.
+
+    Args:
+        filename (str): The file location.
+        files (dict): Prefetched file contents from a FilePrefetcher, the
+            bytes of each file or None if it does not exist.  Files not in
+            the dictionary are read from disk.
+        encoding (str): The text encoding of the file.
+
+    Returns:
+        file-like - An open text file, or None if the file does not exist.
+    """
+    if files is not None and filename in files:
+        if files[filename] is None:
+            return None
+        return io.StringIO(files[filename].decode(encoding))
+    if not os.path.exists(filename):
+        return None
+    return open(filename, 'r', encoding=encoding)
+
+
+# .............................................................................
+class FilePrefetcher:
+    """This class reads the files of upcoming items in a background thread."""
+    # ..........................
+    def __init__(self, items, get_filenames, depth=DEFAULT_DEPTH,
+                 max_bytes=DEFAULT_MAX_BYTES, manual_release=False):
+        """Constructor.
+
+        Args:
+            items (iterable): The items to read files for, in order.
+            get_filenames (function): A function that takes an item and
+                returns the file locations to read for it.
+            depth (int): The maximum number of items read ahead.
+            max_bytes (int): The maximum number of bytes held for items read
+                ahead or being processed.  An item's files are always read
+                when nothing else is held or when the consumer is waiting for
+                it, so one item larger than this can still be read.
+            manual_release (bool): Hold the bytes of each item until release
+                is called for it, such as when items are processed by
+                workers and finish after later items have been requested.
+                Otherwise they are released when the next item is requested.
+        """
+        self.items = items
+        self.get_filenames = get_filenames
+        self.max_bytes = max_bytes
+        self.manual_release = manual_release
+        self.num_bytes = 0
+        self._queue = queue.Queue(max(1, depth))
+        self._condition = threading.Condition()
+        self._stop = threading.Event()
+        self._thread = None
+        # Sizes of the items yielded and not yet released, oldest first
+        self._held = deque()
+        self._waiting = False
+
+    # ..........................
+    def __enter__(self):
+        return self
+
+    # ..........................
+    def __exit__(self, *args):
+        self.close()
+
+    # ..........................
+    def __iter__(self):
+        """Yield (item, files) pairs, files maps each filename to its bytes.
+
+        Files that do not exist map to None.
+        """
+        self._thread = threading.Thread(target=self._fill, daemon=True)
+        self._thread.start()
+        try:
+            while True:
+                if not self.manual_release:
+                    # The previous item has been processed
+                    self.release()
+                with self._condition:
+                    self._waiting = True
+                    self._condition.notify()
+                entry = self._queue.get()
+                with self._condition:
+                    self._waiting = False
+                if entry is _END:
+                    return
+                if isinstance(entry, Exception):
+                    raise entry
+                item, files, size = entry
+                with self._condition:
+                    self._held.append(size)
+                yield item, files
+        finally:
+            self.close()
+
+    # ..........................
+    def release(self):
+        """Release the bytes of the oldest item not yet released."""
+        with self._condition:
+            if self._held:
+                self.num_bytes -= self._held.popleft()
+                self._condition.notify()
+
+    # ..........................
+    @staticmethod
+    def _get_size(filenames):
+        """Get the total size of the files that exist."""
+        size = 0
+        for filename in filenames:
+            try:
+                size += os.stat(filename).st_size
+            except FileNotFoundError:
+                pass
+        return size
+
+    # ..........................
+    @staticmethod
+    def _read_files(filenames):
+        """Read files into a dictionary of filename to bytes or None."""
+        files = {}
+        for filename in filenames:
+            try:
+                with open(filename, 'rb') as in_file:
+                    files[filename] = in_file.read()
+            except FileNotFoundError:
+                files[filename] = None
+        return files
+
+    # ..........................
+    def _put(self, entry):
+        """Put an entry on the queue unless the prefetcher is closed."""
+        while not self._stop.is_set():
+            try:
+                self._queue.put(entry, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    # ..........................
+    def _fill(self):
+        """Read the files of each item within the depth and byte budget."""
+        try:
+            for item in self.items:
+                filenames = self.get_filenames(item)
+                size = self._get_size(filenames)
+                # Reserve the bytes before reading
+                with self._condition:
+                    self._condition.wait_for(
+                        lambda: self._stop.is_set() or self.num_bytes == 0 or
+                        self.num_bytes + size <= self.max_bytes or
+                        (self._waiting and self._queue.empty()))
+                    if self._stop.is_set():
+                        return
+                    self.num_bytes += size
+                if not self._put((item, self._read_files(filenames), size)):
+                    return
+            self._put(_END)
+        except Exception as err:
+            self._put(err)
+
+    # ..........................
+    def close(self):
+        """Stop reading ahead."""
+        self._stop.set()
+        with self._condition:
+            self._condition.notify_all()
+        if self._thread is not None and \
+                self._thread is not threading.current_thread():
+            self._thread.join()
@@ -0,0 +1,163 @@
+"""Module containing a journal of completed work for resumable runs.
+
+The journal is a file of JSON lines, one per completed species.  Each line
+records the output byte offset after the species was written, so an
+interrupted run can truncate the output back to the last journaled species
+and continue from there.
+
+Records are written at checkpoints.  At each checkpoint the output file is
+synced to disk before the new journal lines are written and synced, so a
+journaled offset never points past output that was lost in a crash.
+Species completed after the last checkpoint are simply run again on resume.
+"""
+import json
+import os
+import time
+
+JOURNAL_EXTENSION = '.journal'
+# Seconds between checkpoints, 0 checkpoints after every record
+DEFAULT_CHECKPOINT_INTERVAL = 10.0
+
+
+# .............................................................................
+def get_journal_filename(out_filename):
+    """Get the journal file location for an output file."""
+    return '{}{}'.format(out_filename, JOURNAL_EXTENSION)
+
+
+# .............................................................................
+class RunJournal:
+    """This class records completed species for a run."""
+    # ..........................
+    def __init__(self, filename,
+                 checkpoint_interval=DEFAULT_CHECKPOINT_INTERVAL):
+        """Constructor.
+
+        Args:
+            filename (str): The file location of the journal.
+            checkpoint_interval (float): The number of seconds between
+                checkpoints, or 0 to checkpoint after every record.
+        """
+        self.filename = filename
+        self.checkpoint_interval = checkpoint_interval
+        self._file = None
+        self._out_file = None
+        self._pending = []
+        self._last_checkpoint = 0.0
+        # The size of the complete, valid records found by load
+        self._valid_size = 0
+
+    # ..........................
+    def __enter__(self):
+        return self
+
+    # ..........................
+    def __exit__(self, *args):
+        self.close()
+
+    # ..........................
+    def load(self, out_filename):
+        """Load the records of completed species.
+
+        A partly written last line is ignored, as are records past the end of
+        the output file in case the journal was saved but the output was not.
+
+        Args:
+            out_filename (str): The output file the journal describes.
+
+        Returns:
+            list of dict - The completed species records, in run order.
+        """
+        records = []
+        self._valid_size = 0
+        if not os.path.exists(self.filename):
+            return records
+        out_size = 0
+        if os.path.exists(out_filename):
+            out_size = os.path.getsize(out_filename)
+        with open(self.filename, 'rb') as journal_in:
+            for line in journal_in:
+                if not line.endswith(b'\n'):
+                    break
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    break
+                if record['offset'] > out_size:
+                    break
+                records.append(record)
+                self._valid_size += len(line)
+        return records
+
+    # ..........................
+    def open(self, out_file=None, resume=False):
+        """Open the journal for appending records.
+
+        Args:
+            out_file (file): The open output file the journal describes, which
+                is synced to disk at each checkpoint before the journal.
+            resume (bool): Keep the records found by load() and drop anything
+                after them, rather than starting an empty journal.
+        """
+        with open(self.filename, 'ab') as journal_out:
+            journal_out.truncate(self._valid_size if resume else 0)
+        self._file = open(self.filename, 'a')
+        self._out_file = out_file
+        self._pending = []
+        self._last_checkpoint = time.monotonic()
+
+    # ..........................
+    def checkpoint(self):
+        """Sync the output and then write and sync the pending records."""
+        if not self._pending:
+            return
+        if self._out_file is not None:
+            self._out_file.flush()
+            os.fsync(self._out_file.fileno())
+        for record in self._pending:
+            self._file.write('{}\n'.format(json.dumps(record)))
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._pending = []
+        self._last_checkpoint = time.monotonic()
+
+    # ..........................
+    def close(self):
+        """Checkpoint and close the journal."""
+        if self._file is not None:
+            self.checkpoint()
+            self._file.close()
+            self._file = None
+            self._out_file = None
+
+    # ..........................
+    def record(self, species, offset, initial_count, removed,
+               limiting_stage=None, rejected=None):
+        """Record a completed species, to be written at the next checkpoint.
+
+        Args:
+            species (str): The species name.
+            offset (int): The output byte offset after the species was written.
+            initial_count (int): The number of points before filtering.
+            removed (dict): The number of points removed by each filter stage.
+            limiting_stage (str): The stage that removed the species, or None
+                if the species was written.
+            rejected (dict): The number of input lines rejected for each
+                reason.
+
+        Returns:
+            dict - The journal record.
+        """
+        record = {
+            'species': species,
+            'offset': offset,
+            'initial_count': initial_count,
+            'removed': dict(removed),
+            'limiting_stage': limiting_stage,
+            'rejected': dict(rejected or {})
+        }
+        self._pending.append(record)
+        if time.monotonic() - self._last_checkpoint >= \
+                self.checkpoint_interval:
+            self.checkpoint()
+        return record
@@ -0,0 +1,169 @@
+"""Module containing a pool of buffered output files with a limit on handles.
+
+Writing to many output files at once (one per species or per name prefix) can
+exceed the open file limit.  The pool keeps text for each output file in an
+in-memory buffer and writes it out in large batches, holding at most
+max_open files open and closing the least recently used one when it needs
+another.  A file is truncated the first time it is opened and appended to
+when it is reopened, so the output is the same as writing with every file
+open at once.
+
+When the buffers together grow too large, the largest buffer is found with a
+heap of buffer sizes rather than by scanning every bucket.  The heap is
+updated lazily: each write pushes the new size of its bucket and entries that
+no longer match their bucket are discarded when they reach the top.  Flushed
+buckets drop their buffers entirely, so memory and heap size follow the
+buckets holding text, not every bucket ever written.
+"""
+from collections import OrderedDict
+import heapq
+import itertools
+
+DEFAULT_MAX_OPEN = 128
+# Buffer sizes are in characters
+DEFAULT_BUFFER_SIZE = 256 * 1024
+DEFAULT_MAX_BUFFERED = 256 * 1024 * 1024
+
+
+# .............................................................................
+class WriterPool:
+    """This class manages buffered writes to many output files."""
+    # ..........................
+    def __init__(self, get_filename, header=None, max_open=DEFAULT_MAX_OPEN,
+                 buffer_size=DEFAULT_BUFFER_SIZE,
+                 max_buffered=DEFAULT_MAX_BUFFERED, sorted_keys=False):
+        """Constructor.
+
+        Args:
+            get_filename (function): A function that takes a bucket key and
+                returns the file location to write that bucket to.  It is
+                called once per key.
+            header (str): Text written at the start of each file.
+            max_open (int): The maximum number of files open at once.
+            buffer_size (int): A bucket is written out when its buffer
+                reaches this many characters.
+            max_buffered (int): The largest buffers are written out when all
+                buffers together reach this many characters.
+            sorted_keys (bool): Writes come grouped by key, such as points
+                sorted by species, so a bucket is written out and its file
+                closed as soon as a write for another key arrives.  A key
+                that comes back later is still appended to correctly.
+        """
+        self.get_filename = get_filename
+        self.header = header
+        self.max_open = max(1, max_open)
+        self.buffer_size = buffer_size
+        self.max_buffered = max_buffered
+        self.sorted_keys = sorted_keys
+        self.total_buffered = 0
+        self.num_opens = 0
+        self._filenames = {}
+        # Only buckets holding text have buffers
+        self._buffers = {}
+        self._buffer_sizes = {}
+        # (-size, sequence, key) entries, the sequence keeps keys from being
+        #    compared
+        self._size_heap = []
+        self._sequence = itertools.count()
+        self._started = set()
+        self._handles = OrderedDict()
+        self._last_key = None
+
+    # ..........................
+    def __enter__(self):
+        return self
+
+    # ..........................
+    def __exit__(self, *args):
+        self.close()
+
+    # ..........................
+    def create(self, key):
+        """Register a bucket so its file is written even if it gets no data."""
+        if key not in self._filenames:
+            self._filenames[key] = self.get_filename(key)
+            if self.header:
+                self._buffer(key, self.header)
+
+    # ..........................
+    def _buffer(self, key, text):
+        """Add text to the buffer for a bucket."""
+        self._buffers.setdefault(key, []).append(text)
+        size = self._buffer_sizes.get(key, 0) + len(text)
+        self._buffer_sizes[key] = size
+        self.total_buffered += len(text)
+        heapq.heappush(self._size_heap, (-size, next(self._sequence), key))
+        if len(self._size_heap) > 2 * len(self._buffer_sizes) + 1024:
+            # Drop the stale entries
+            self._size_heap = [
+                (-size, next(self._sequence), key)
+                for key, size in self._buffer_sizes.items()]
+            heapq.heapify(self._size_heap)
+
+    # ..........................
+    def _pop_largest(self):
+        """Get the bucket with the largest buffer."""
+        while True:
+            neg_size, _, key = heapq.heappop(self._size_heap)
+            if self._buffer_sizes.get(key) == -neg_size:
+                return key
+
+    # ..........................
+    def write(self, key, text):
+        """Write text to the file for a bucket.
+
+        Args:
+            key: The bucket key.
+            text (str): The text to write.
+        """
+        if self.sorted_keys and key != self._last_key:
+            if self._last_key is not None:
+                self.flush(self._last_key)
+                handle = self._handles.pop(self._last_key, None)
+                if handle is not None:
+                    handle.close()
+            self._last_key = key
+        self.create(key)
+        self._buffer(key, text)
+        if self._buffer_sizes[key] >= self.buffer_size:
+            self.flush(key)
+        while self.total_buffered > self.max_buffered:
+            self.flush(self._pop_largest())
+
+    # ..........................
+    def _get_handle(self, key):
+        """Get an open file for a bucket, closing the least recently used."""
+        if key in self._handles:
+            self._handles.move_to_end(key)
+            return self._handles[key]
+        while len(self._handles) >= self.max_open:
+            _, old_handle = self._handles.popitem(last=False)
+            old_handle.close()
+        mode = 'a' if key in self._started else 'w'
+        handle = open(self._filenames[key], mode)
+        self._started.add(key)
+        self._handles[key] = handle
+        self.num_opens += 1
+        return handle
+
+    # ..........................
+    def flush(self, key):
+        """Write out the buffered text for a bucket."""
+        if key in self._buffers or key not in self._started:
+            self._get_handle(key).write(''.join(self._buffers.pop(key, [])))
+            self.total_buffered -= self._buffer_sizes.pop(key, 0)
+
+    # ..........................
+    def flush_all(self):
+        """Write out every buffer, creating files for buckets without data."""
+        for key in list(self._filenames.keys()):
+            self.flush(key)
+        self._size_heap = []
+
+    # ..........................
+    def close(self):
+        """Write out every buffer and close all files."""
+        self.flush_all()
+        for handle in self._handles.values():
+            handle.close()
+        self._handles.clear()
@@ -1,14 +1,13 @@
 """Create a csv file"""
-from collections import namedtuple
-import csv
-import json
-import os
-import time
+import argparse
 
-from tools.data_preparation.filters import (
-    get_bounding_box_filter, get_data_flag_filter, get_tdwg_locality_filter,
-    get_unique_localities_filter)
-from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from tools.common.parallel import BACKENDS
+from tools.common.prefetch import DEFAULT_DEPTH, DEFAULT_MAX_BYTES
+from tools.data_preparation.filter_cache import DEFAULT_MAX_SIZE
+from tools.data_preparation.filters import WGSRPD_BASE_DIR
+from tools.data_preparation.occurrence_pipeline import (
+    GBIF_FILTER_FLAGS, IDIGBIO_FILTER_FLAGS, SPECIES_CHUNK_SIZE,
+    create_species_csv)
 
 MAX_WORKERS = 7
 #   1 - 0.148563078
@@ -21,6 +20,18 @@ MAX_WORKERS = 7
 #  60 - 0.008074534 percent per second
 # 100 - 0.003186275 percent per second
 
+BASE_DIR = '/DATA/biotaphy/out3/'
+ACCEPTED_TAXA_FILENAME = '/DATA/biotaphy/seed_plants/accepted_species.csv'
+MIN_POINTS = 12
+# (min_x, min_y, max_x, max_y) bounding boxes of the study regions
+REGION_BBOXES = {
+    'africa': (0.0, -40.0, 60.0, 0.0),
+    'australia': (112.0, -44.0, 154.0, -10.0),
+    'china': (73.66, 18.21, 135.05, 53.47),
+    'montane': (-180.0, -56.0, -34.0, 90.0),
+    'south_america': (-82.0, -32.0, 0.0, 33.0)
+}
+
 # .............................................................................
 """
 Get species list
@@ -34,330 +45,123 @@ For each species
     If enough points
         Write points to csv
 """
-# .............................................................................
-Point = namedtuple('Point', 'species_name, x, y, flags')
-GBIF_FILTER_FLAGS = [
-    'TAXON_MATCH_FUZZY', 'TAXON_MATCH_HIGHERRANK', 'TAXON_MATCH_NONE']
-IDIGBIO_FILTER_FLAGS = [
-    'geopoint_datum_missing', 'geopoint_bounds', 'geopoint_datum_error',
-    'geopoint_similar_coord', 'rev_geocode_mismatch', 'rev_geocode_failure',
-    'geopoint_0_coord', 'taxon_match_failed', 'dwc_kingdom_suspect',
-    'dwc_taxonrank_invalid', 'dwc_taxonrank_removed']
-
-
-# .............................................................................
-def get_points_from_csv(csv_filename):
-    """Load points from a csv"""
-    with open(csv_filename, 'r') as in_file:
-        reader = csv.reader(in_file)
-        points = [Point(row[0], row[1], row[2], json.loads(row[3])) for row in reader]
-        reader.close()
-    return points
-
-# .............................................................................
-def get_species_list_from_file(filename):
-    species_names = []
-    with open(filename) as in_file:
-        for line in in_file:
-            try:
-                parts = line.split(',')
-                species_names.append(parts[1].strip().strip('"'))
-            except Exception as err:
-                print(err)
-    return species_names
-
-# .............................................................................
-def filter_points(points_in, flt):
-    out_points = []
-    num_removed = 0
-    for point in points_in:
-        if flt(point):
-            out_points.append(point)
-        else:
-            num_removed += 1
-    return (out_points, num_removed)
-
-# .............................................................................
-def _get_filename(base_dir, species, service_suffix):
-    genus = species.split(' ')[0]
-    return os.path.join(base_dir, genus, '{}{}'.format(species, service_suffix))
-
-# .............................................................................
-def get_gbif_points(base_dir, species):
-    fn = _get_filename(base_dir, species, '_gbif.csv')
-    if os.path.exists(fn):
-        points = []
-        with open(fn, 'r') as in_file:
-            for line in in_file:
-                try:
-                    row = line.strip().split(', ')
-                    points.append(Point(row[0], float(row[1]), float(row[2]), json.loads(row[3].replace(',', '').replace(';', ','))))
-                except Exception as err:
-                    print(err)
-        return points
-    return []
-
-# .............................................................................
-def get_process_species_function(base_dir, idigbio_flags, gbif_flags, bbox):
-    idigbio_flag_filter = get_data_flag_filter(idigbio_flags)
-    gbif_flag_filter = get_data_flag_filter(gbif_flags)
-    bbox_filter = get_bounding_box_filter(*bbox)
-    unique_filter = get_unique_localities_filter()
-
-    def process_species(species):
-        # Initialize
-        species_points = []
-        base_dir = '/DATA/biotaphy/data2/genera/'
-    
-        # Idigbio
-        idigbio_points = get_idigbio_points(base_dir, species)
-        filtered_points, idigbio_filtered = filter_points(
-            idigbio_points, idigbio_flag_filter)
-        species_points.extend(filtered_points)
-    
-        # GBIF
-        gbif_points = get_gbif_points(base_dir, species)
-        filtered_points, gbif_filtered = filter_points(
-            gbif_points, gbif_flag_filter)
-    
-        # Bounding box
-        species_points, bbox_filtered = filter_points(
-            species_points, bbox_filter)
-    
-        # Duplicates
-        species_points, dup_filtered = filter_points(
-            species_points, unique_filter)
-    
-        # Locality
-        loc_filtered = 0
-        locality_filter = get_kew_filter(base_dir, species)
-        if locality_filter is not None:
-            species_points, loc_filtered = filter_points(
-                species_points, locality_filter)
-        return (species, species_points, idigbio_filtered, gbif_filtered, bbox_filtered, dup_filtered, loc_filtered)
-    def process_species_2(species):
-        # Initialize
-        species_points = []
-        base_dir = '/DATA/biotaphy/out3/'
-    
-        # Initial number of points
-        # Num filtered out
-        #  Num filtered from gbif
-        #  Num filtered from idigbio
-        # Num filtered by bbox
-        # Num filtered by duplicates
-        # Num filtered by localities
-    
-        # Initial number of points
-        initial_num_points = 0
-    
-        # Idigbio
-        idigbio_points = get_idigbio_points(base_dir, species)
-        initial_num_points += len(idigbio_points)
-        filtered_points, idigbio_filtered = filter_points(
-            idigbio_points, idigbio_flag_filter)
-        species_points.extend(filtered_points)
-    
-        # GBIF
-        gbif_points = get_gbif_points(base_dir, species)
-        initial_num_points += len(gbif_points)
-        filtered_points, gbif_filtered = filter_points(
-            gbif_points, gbif_flag_filter)
-        species_points.extend(filtered_points)
-    
-        # Bounding box
-        species_points, bbox_filtered = filter_points(
-            species_points, bbox_filter)
-    
-        # Duplicates
-        species_points, dup_filtered = filter_points(
-            species_points, unique_filter)
-    
-        # Locality
-        loc_filtered = 0
-        locality_filter = get_kew_filter(base_dir, species)
-        if locality_filter is not None:
-            species_points, loc_filtered = filter_points(
-                species_points, locality_filter)
-        return (
-            species, species_points, initial_num_points, gbif_filtered,
-            idigbio_filtered, bbox_filtered, dup_filtered, loc_filtered)
-    return process_species_2
-
-# .............................................................................
-def get_idigbio_points(base_dir, species):
-    fn = _get_filename(base_dir, species, '_idigbio.csv')
-    if os.path.exists(fn):
-        points = []
-        with open(fn, 'r') as in_file:
-            for line in in_file:
-                try:
-                    row = line.strip().split(', ')
-                    points.append(Point(row[0], float(row[1]), float(row[2]), json.loads(row[3])))
-                except Exception as err:
-                    print(err)
-        return points
-    return []
-
-# .............................................................................
-def get_kew_filter(base_dir, species):
-    fn = _get_filename(base_dir, species, '_powo.json')
-    if os.path.exists(fn):
-        with open(fn) as json_in:
-            species_info = json.load(json_in)
-            try:
-                return get_tdwg_locality_filter(species_info['distribution']['natives'])
-            except Exception as err:
-                pass
-    return None
-
 # .............................................................................
 def main(base_dir, out_filename, species_filename, min_points, bbox=None, use_powo=True,
-         remove_duplicates=True, idigbio_flags=None, gbif_flags=None):
-    """Main method for script"""
-    # Get species names
-    print('Get species names')
-    start_time = time.time()
-    species_names = get_species_list_from_file(species_filename)
-    report_filename = '{}.report'.format(out_filename)
-    process_species = get_process_species_function(base_dir, idigbio_flags, gbif_flags, bbox)
-    
-    total_points = 0
-    total_gbif_filtered = 0
-    total_idigbio_filtered = 0
-    total_bbox_filtered = 0
-    total_duplicate_filtered = 0
-    total_locality_filtered = 0
-
-    removed_initial = 0
-    removed_flags = 0
-    removed_bbox = 0
-    removed_duplicates = 0
-    removed_locality = 0
-    
-    
-    
-    with open(out_filename, 'w') as out_file:
-        i = 0
-        valid_sp = 0
-        percent = 0
-        ten_percent = int(len(species_names) / 10)
-        one_percent = int(len(species_names) / 100)
-        one_tenth_percent = int(len(species_names) / 1000)
-        
-        with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
-            for result in executor.map(process_species, species_names):
+         remove_duplicates=True, idigbio_flags=None, gbif_flags=None,
+         duplicate_precision=None, backend='thread', max_workers=MAX_WORKERS,
+         chunk_size=SPECIES_CHUNK_SIZE, wgsrpd_index_filename=None,
+         locality_cache_size=DEFAULT_MAX_SIZE, use_region_raster=False,
+         resume=False, store_dir=None, prefetch_depth=None,
+         prefetch_bytes=DEFAULT_MAX_BYTES, coordinate_precision=None):
+    """Main method for script
+
+    See occurrence_pipeline.create_species_csv for the options.  The use_powo
+    option is unused, the POWO locality filter is always applied.
+    """
+    return create_species_csv(
+        base_dir, out_filename, species_filename, min_points, bbox,
+        idigbio_flags, gbif_flags, wgsrpd_dir=WGSRPD_BASE_DIR,
+        remove_duplicates=remove_duplicates,
+        duplicate_precision=duplicate_precision, backend=backend,
+        max_workers=max_workers, chunk_size=chunk_size,
+        wgsrpd_index_filename=wgsrpd_index_filename,
+        locality_cache_size=locality_cache_size,
+        use_region_raster=use_region_raster, resume=resume,
+        store_dir=store_dir, prefetch_depth=prefetch_depth,
+        prefetch_bytes=prefetch_bytes,
+        coordinate_precision=coordinate_precision)
 
-                (sp_name, sp_points, initial_points, gbif_filtered,
-                 idigbio_filtered, bbox_filtered, dup_filtered,
-                 locality_filtered) = result
-                
-                # Add counts to totals
-                total_points += initial_points
-                total_gbif_filtered += gbif_filtered
-                total_idigbio_filtered += idigbio_filtered
-                total_bbox_filtered += bbox_filtered
-                total_duplicate_filtered += dup_filtered
-                total_locality_filtered += locality_filtered
-                
-        
-                # If enough points leftover...
-                if len(sp_points) >= min_points:
-                    valid_sp += 1
-                    for point in sp_points:
-                        out_file.write(
-                            '{}, {}, {}\n'.format(
-                                point.species_name, point.x, point.y))
-                else:
-                    # What removed this species?
-                    t = initial_points
-                    if t < min_points:
-                        removed_initial += 1
-                    else:
-                        t -= gbif_filtered
-                        t -= idigbio_filtered
-                        if t < min_points:
-                            removed_flags += 1
-                        else:
-                            t -= bbox_filtered
-                            if t < min_points:
-                                removed_bbox += 1
-                            else:
-                                t -= dup_filtered
-                                if t < min_points:
-                                    removed_duplicates += 1
-                                else:
-                                    removed_locality += 1
-                i += 1
-                #if i % one_percent == 0:
-                #    percent += 1
-                #    print('{}%, {} seconds'.format(percent, time.time() - start_time))
-                if i % one_tenth_percent == 0:
-                    percent += .1
-                    print('{}%, {} seconds'.format(percent, time.time() - start_time))
-    # Print results of filters
-    print('')
-    print('Total number of points: {}'.format(total_points))
-    print('Total number of points filtered by GBIF flags: {}'.format(total_gbif_filtered))
-    print('Total number of points filtered by iDigBio flags: {}'.format(total_idigbio_filtered))
-    print('Total number of points filtered by bounding box: {}'.format(total_bbox_filtered))
-    print('Total number of points filtered by duplicates: {}'.format(total_duplicate_filtered))
-    print('Total number of points filtered by locality: {}'.format(total_locality_filtered))
-    print('')
-    print('Total number of species: {}'.format(i))
-    print('Number of species removed by not having enough point to start: {}'.format(removed_initial))
-    print('Number of species removed by flags: {}'.format(removed_flags))
-    print('Number of species removed by bounding box: {}'.format(removed_bbox))
-    print('Number of species removed by duplicates: {}'.format(removed_duplicates))
-    print('Number of species removed by locality: {}'.format(removed_locality))
-    print('')
-    print('Number of species remaining: {}'.format(valid_sp))
-    
 
 # .............................................................................
-if __name__ == '__main__':
-    # Montane
+def init():
+    """Initialize."""
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        '--region', type=str, choices=sorted(REGION_BBOXES),
+        default='montane',
+        help='Use the bounding box of a study region (default montane).')
+    parser.add_argument(
+        '--bbox', type=float, nargs=4,
+        metavar=('MIN_X', 'MIN_Y', 'MAX_X', 'MAX_Y'),
+        help='Bounding box to use instead of the --region bounding box.')
+    parser.add_argument(
+        '-p', '--duplicate_precision', type=int,
+        help='Number of decimal places to round coordinates to when '
+        'removing duplicate localities.')
+    parser.add_argument(
+        '-b', '--backend', type=str, choices=BACKENDS, default='thread',
+        help='Run species in a pool of threads or of processes.')
+    parser.add_argument(
+        '-w', '--max_workers', type=int, default=MAX_WORKERS,
+        help='Maximum number of worker threads or processes.')
+    parser.add_argument(
+        '-c', '--chunk_size', type=int, default=SPECIES_CHUNK_SIZE,
+        help='Number of species sent to a worker process at a time.')
+    parser.add_argument(
+        '-i', '--wgsrpd_index', type=str,
+        help='Base file location of a saved WGSRPD region index, built there '
+        'if it does not exist.')
+    parser.add_argument(
+        '-l', '--locality_cache_size', type=int, default=DEFAULT_MAX_SIZE,
+        help='Maximum number of compiled locality filters to keep.')
+    parser.add_argument(
+        '-r', '--region_raster', action='store_true',
+        help='Look up points in a raster of the WGSRPD level 3 and 4 regions, '
+        'testing exactly only near region boundaries.  Requires --wgsrpd_index.')
+    parser.add_argument(
+        '-s', '--store_dir', type=str,
+        help='Read points from this occurrence store instead of the '
+        'per-species files in base_dir.')
+    parser.add_argument(
+        '--prefetch_depth', type=int, nargs='?', const=DEFAULT_DEPTH,
+        help='Read the input files of this many upcoming species in the '
+        'background (default {} if given without a value).'.format(
+            DEFAULT_DEPTH))
+    parser.add_argument(
+        '--prefetch_mb', type=int, default=DEFAULT_MAX_BYTES // 1024 // 1024,
+        help='Maximum megabytes of species files held by --prefetch_depth.')
+    parser.add_argument(
+        '--coordinate_precision', type=int,
+        help='Hold coordinates as int32 fixed point values with this many '
+        'decimal places, such as 4.')
+    parser.add_argument(
+        '--resume', action='store_true',
+        help='Skip species recorded in the journal of an interrupted run and '
+        'append to its output.')
+    parser.add_argument(
+        '--base_dir', type=str, default=BASE_DIR,
+        help='Base data directory (default {}).'.format(BASE_DIR))
+    parser.add_argument(
+        '--accepted_taxa_filename', type=str, default=ACCEPTED_TAXA_FILENAME,
+        help='File location containing accepted taxon names (default '
+        '{}).'.format(ACCEPTED_TAXA_FILENAME))
+    parser.add_argument(
+        '--minimum_number_of_points', type=int, default=MIN_POINTS,
+        help='Minimum number of points required to keep a species in output '
+        '(default {}).'.format(MIN_POINTS))
+    parser.add_argument(
+        'out_csv_filename', type=str,
+        help='File location to write CSV points.')
+    args = parser.parse_args()
+    bbox = REGION_BBOXES[args.region]
+    if args.bbox is not None:
+        bbox = tuple(args.bbox)
+
     main(
-        '/DATA/biotaphy/out3/',
-        '/DATA/biotaphy/montane_v7.csv',
-        '/DATA/biotaphy/seed_plants/accepted_species.csv', 12,
-        bbox=(-180.0, -56.0, -34.0, 90.0), use_powo=True,
+        args.base_dir, args.out_csv_filename, args.accepted_taxa_filename,
+        args.minimum_number_of_points, bbox=bbox, use_powo=True,
         remove_duplicates=True, idigbio_flags=IDIGBIO_FILTER_FLAGS,
-        gbif_flags=GBIF_FILTER_FLAGS)
-
-    # Australia
-    #main(
-    #    '/DATA/biotaphy/out3/',
-    #    '/DATA/biotaphy/australia_v1.csv',
-    #    '/DATA/biotaphy/seed_plants/accepted_species.csv', 12,
-    #    bbox=(112.0, -44.0, 154.0, -10.0), use_powo=True,
-    #    remove_duplicates=True, idigbio_flags=IDIGBIO_FILTER_FLAGS,
-    #    gbif_flags=GBIF_FILTER_FLAGS)
-
-    # China
-    #main(
-    #    '/DATA/biotaphy/out3/',
-    #    '/DATA/biotaphy/china_v2.csv',
-    #    '/DATA/biotaphy/seed_plants/accepted_species.csv', 12,
-    #    bbox=(73.66, 18.21, 135.05, 53.47), use_powo=True,
-    #    remove_duplicates=True, idigbio_flags=IDIGBIO_FILTER_FLAGS,
-    #    gbif_flags=GBIF_FILTER_FLAGS)
+        gbif_flags=GBIF_FILTER_FLAGS,
+        duplicate_precision=args.duplicate_precision, backend=args.backend,
+        max_workers=args.max_workers, chunk_size=args.chunk_size,
+        wgsrpd_index_filename=args.wgsrpd_index,
+        locality_cache_size=args.locality_cache_size,
+        use_region_raster=args.region_raster, resume=args.resume,
+        store_dir=args.store_dir, prefetch_depth=args.prefetch_depth,
+        prefetch_bytes=args.prefetch_mb * 1024 * 1024,
+        coordinate_precision=args.coordinate_precision)
 
-    # South America
-    #main(
-    #    '/DATA/biotaphy/out3/',
-    #    '/DATA/biotaphy/south_america_v1.csv',
-    #    '/DATA/biotaphy/seed_plants/accepted_species.csv', 12,
-    #    bbox=(-82.0, -32.0, 0.0, 33.0), use_powo=True,
-    #    remove_duplicates=True, idigbio_flags=IDIGBIO_FILTER_FLAGS,
-    #    gbif_flags=GBIF_FILTER_FLAGS)
-
-    # Africa
-    #main(
-    #    '/DATA/biotaphy/out3/',
-    #    '/DATA/biotaphy/africa_v4.csv',
-    #    '/DATA/biotaphy/seed_plants/accepted_species.csv', 12,
-    #    bbox=(0.0, -40.0, 60.0, 0.0), use_powo=True,
-    #    remove_duplicates=True, idigbio_flags=IDIGBIO_FILTER_FLAGS,
-    #    gbif_flags=GBIF_FILTER_FLAGS)
 
+# .............................................................................
+if __name__ == '__main__':
+    init()
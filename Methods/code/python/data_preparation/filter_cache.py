@@ -0,0 +1,95 @@
+"""Module containing a cache of compiled locality filters.
+
+Many species share the same set of native TDWG regions, so the filter built
+for one species can be reused for the next species with the same regions.
+
+Each cache lives in one worker, so the counters of a run are gathered by
+passing a Counter to get_filter for each species and adding up the Counters
+where the results are collected.
+"""
+from collections import Counter, OrderedDict
+import threading
+
+DEFAULT_MAX_SIZE = 256
+CACHE_COUNTERS = ('hits', 'misses', 'evictions')
+
+
+# .............................................................................
+class LocalityFilterCache:
+    """This class keeps the most recently used locality filters."""
+    # ..........................
+    def __init__(self, filter_factory, max_size=DEFAULT_MAX_SIZE):
+        """Constructor.
+
+        Args:
+            filter_factory (function): A function that takes a list of TDWG
+                locality dictionaries and returns a filter function.
+            max_size (int): The maximum number of filters to keep.
+        """
+        self.filter_factory = filter_factory
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._filters = OrderedDict()
+        self._lock = threading.Lock()
+
+    # ..........................
+    def __len__(self):
+        return len(self._filters)
+
+    # ..........................
+    @staticmethod
+    def get_key(locality_dicts_list):
+        """Get the cache key for a list of TDWG locality dictionaries."""
+        return frozenset(
+            (int(locality_dict['tdwgLevel']), str(locality_dict['tdwgCode']))
+            for locality_dict in locality_dicts_list)
+
+    # ..........................
+    def get_filter(self, locality_dicts_list, counts=None):
+        """Get a filter for the localities, building it if not cached.
+
+        Args:
+            locality_dicts_list (list of dict): A list of dictionaries
+                representing TDWG localities.
+            counts (Counter): If provided, the hits, misses and evictions of
+                this call are also added to it.
+
+        Returns:
+            function - The filter function for the localities.
+        """
+        if counts is None:
+            counts = Counter()
+        key = self.get_key(locality_dicts_list)
+        with self._lock:
+            if key in self._filters:
+                self._filters.move_to_end(key)
+                self.hits += 1
+                counts['hits'] += 1
+                return self._filters[key]
+            self.misses += 1
+            counts['misses'] += 1
+
+        # Build outside of the lock so other species are not held up
+        flt = self.filter_factory(locality_dicts_list)
+        with self._lock:
+            self._filters[key] = flt
+            self._filters.move_to_end(key)
+            while len(self._filters) > self.max_size:
+                self._filters.popitem(last=False)
+                self.evictions += 1
+                counts['evictions'] += 1
+        return flt
+
+    # ..........................
+    def get_stats(self):
+        """Get a dictionary of cache counters."""
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'size': len(self._filters),
+                'max_size': self.max_size
+            }
@@ -0,0 +1,106 @@
+"""Module containing a class for applying a chain of mask filters.
+
+The chain evaluates each stage only for the points that survived the previous
+stages, so every point is rejected by at most one stage and the number of
+points removed by each stage is known without recomputing it afterwards.
+"""
+from collections import OrderedDict
+
+import numpy as np
+
+INITIAL_STAGE = 'initial'
+
+
+# .............................................................................
+class FilterChainResult:
+    """This class holds the outcome of running a filter chain on a batch."""
+    # ..........................
+    def __init__(self, points, initial_count, removed):
+        """Constructor.
+
+        Args:
+            points (PointBatch): The points that passed every stage.
+            initial_count (int): The number of points before filtering.
+            removed (OrderedDict): The number of points removed by each stage,
+                in stage order.
+        """
+        self.points = points
+        self.initial_count = initial_count
+        self.removed = removed
+
+    # ..........................
+    def get_limiting_stage(self, min_points):
+        """Get the stage that brought the number of points below a minimum.
+
+        Args:
+            min_points (int): The minimum number of points required.
+
+        Returns:
+            str or None - INITIAL_STAGE if there were never enough points, the
+                name of the first stage after which fewer than min_points
+                remained, or None if enough points remain.
+        """
+        remaining = self.initial_count
+        if remaining < min_points:
+            return INITIAL_STAGE
+        for stage_name, num_removed in self.removed.items():
+            remaining -= num_removed
+            if remaining < min_points:
+                return stage_name
+        return None
+
+
+# .............................................................................
+class FilterChain:
+    """This class applies an ordered list of mask filters in one pass."""
+    # ..........................
+    def __init__(self, stages=None):
+        """Constructor.
+
+        Args:
+            stages (list of tuple): A list of (name, mask filter) tuples.  A
+                stage with a filter of None is skipped but still reported.
+        """
+        self.stages = []
+        if stages:
+            for stage_name, mask_filter in stages:
+                self.add_stage(stage_name, mask_filter)
+
+    # ..........................
+    def add_stage(self, stage_name, mask_filter):
+        """Add a stage to the end of the chain.
+
+        Args:
+            stage_name (str): The name to report counts under.
+            mask_filter (function): A function that takes a PointBatch and
+                returns a boolean array of valid points.
+        """
+        self.stages.append((stage_name, mask_filter))
+
+    # ..........................
+    def apply(self, batch):
+        """Run the points in a batch through each stage of the chain.
+
+        Each stage only sees the points that passed the stages before it, and
+        the surviving points are only copied out once at the end.
+
+        Args:
+            batch (PointBatch): The points to filter.
+
+        Returns:
+            FilterChainResult - The surviving points and per-stage counts.
+        """
+        removed = OrderedDict()
+        alive_idxs = np.arange(len(batch))
+        stage_batch = batch
+        for stage_name, mask_filter in self.stages:
+            removed[stage_name] = 0
+            if mask_filter is None or len(alive_idxs) == 0:
+                continue
+            mask = mask_filter(stage_batch)
+            num_removed = len(alive_idxs) - int(mask.sum())
+            if num_removed > 0:
+                removed[stage_name] = num_removed
+                alive_idxs = alive_idxs[mask]
+                stage_batch = batch.subset(alive_idxs)
+        return FilterChainResult(stage_batch, len(batch), removed)
@@ -3,9 +3,14 @@
 Todo:
     * Handle missing keys (for flags)
 """
-import os
+import math
+
+import numpy as np
 from osgeo import ogr
+
+from .occurrence_flags import get_flag_attribute_provider
 from .spatial_index import SpatialIndex
+from .wgsrpd import get_wgsrpd_catalog
 
 WGSRPD_BASE_DIR = '/home/cjgrady/git/wgsrpd'
 
@@ -33,6 +38,56 @@ def get_bounding_box_filter(min_x, min_y, max_x, max_y):
     return bounding_box_filter
 
 
+# .............................................................................
+def get_bounding_box_mask_filter(min_x, min_y, max_x, max_y):
+    """Get a mask filter function for the specified bounding box.
+
+    Args:
+        min_x (numeric): The minimum 'x' value for the bounding box.
+        min_y (numeric): The minimum 'y' value for the bounding box.
+        max_x (numeric): The maximum 'x' value for the bounding box.
+        max_y (numeric): The maximum 'y' value for the bounding box.
+
+    Returns:
+        function - A function that takes a PointBatch as input and returns a
+            boolean array indicating which points are valid.  Batches with
+            fixed point coordinates are compared to integer bounds.
+    """
+    fixed_point_bounds = {}
+    # .......................
+    def bounding_box_mask_filter(batch):
+        """Bounding box mask filter function."""
+        if batch.precision is None:
+            low_x, low_y, high_x, high_y = min_x, min_y, max_x, max_y
+        else:
+            try:
+                low_x, low_y, high_x, high_y = fixed_point_bounds[
+                    batch.precision]
+            except KeyError:
+                low_x, low_y, high_x, high_y = _get_fixed_point_bounds(
+                    (min_x, min_y, max_x, max_y), batch.precision)
+                fixed_point_bounds[batch.precision] = (
+                    low_x, low_y, high_x, high_y)
+        return ((low_x <= batch.x) & (batch.x <= high_x) &
+                (low_y <= batch.y) & (batch.y <= high_y))
+    return bounding_box_mask_filter
+
+
+# .............................................................................
+def _get_fixed_point_bounds(bbox, precision):
+    """Get the bounds of a bounding box in fixed point units.
+
+    A fixed point value is inside the box if the coordinate it represents is,
+    so the minimums are rounded up and the maximums rounded down, ignoring
+    float error in scaling the bounds.
+    """
+    scale = 10 ** precision
+    min_x, min_y, max_x, max_y = [round(value * scale, 6) for value in bbox]
+    return (
+        math.ceil(min_x), math.ceil(min_y), math.floor(max_x),
+        math.floor(max_y))
+
+
 # .............................................................................
 def get_data_flag_filter(filter_flags):
     """Get a filter function for the specified flags.
@@ -47,16 +102,112 @@ def get_data_flag_filter(filter_flags):
         function - A function that takes a point as input and returns a boolean
             output indicating if the point is valid according to this filter.
     """
+    filter_flags = set(filter_flags)
     # .......................
     def flag_filter(point):
         """Data flag filter function."""
         test_flags = point.flags
         if not isinstance(test_flags, (list, tuple)):
             test_flags = [test_flags]
-        return not any([flag in filter_flags for flag in test_flags])
+        return filter_flags.isdisjoint(test_flags)
     return flag_filter
 
 
+# .............................................................................
+def get_data_flag_mask_filter(filter_flags, flag_vocabulary):
+    """Get a mask filter function for the specified flags.
+
+    Args:
+        filter_flags (list): A list of flag values that should be considered to
+            be invalid.
+        flag_vocabulary (FlagVocabulary): The vocabulary used to encode the
+            flags of the batches that will be filtered.
+
+    Returns:
+        function - A function that takes a PointBatch as input and returns a
+            boolean array indicating which points are valid.
+    """
+    filter_mask = flag_vocabulary.get_mask(filter_flags)
+    # .......................
+    def flag_mask_filter(batch):
+        """Data flag mask filter function."""
+        return ~np.any(batch.flags & filter_mask, axis=1)
+    return flag_mask_filter
+
+
+# .............................................................................
+def get_attribute_flag_mask_filter(wrangler_config, flag_vocabulary):
+    """Get a mask filter from an attribute_filter data wrangler configuration.
+
+    Supported conditions are 'all' or 'any' of a point's flags being 'in' or
+    'not_in' a list of values, evaluated as a bitwise AND of each point's
+    flags against a mask of the listed values.
+
+    Args:
+        wrangler_config (dict): A data wrangler configuration, such as one of
+            the gbif_flag_filter.json files.
+        flag_vocabulary (FlagVocabulary): The vocabulary used to encode the
+            flags of the batches that will be filtered.
+
+    Returns:
+        function - A function that takes a PointBatch and returns a boolean
+            array, True for points that pass the filter.
+
+    Raises:
+        ValueError: Raised if the configuration is not a supported flag
+            attribute filter.
+    """
+    if wrangler_config.get('wrangler_type') != 'attribute_filter' or \
+            get_flag_attribute_provider(
+                wrangler_config.get('attribute_name')) is None:
+        raise ValueError(
+            'Not a flag attribute filter: {}'.format(wrangler_config))
+    condition = wrangler_config.get('condition', {})
+    if len(condition) != 1:
+        raise ValueError('Unsupported condition: {}'.format(condition))
+    quantifier, test = list(condition.items())[0]
+    if quantifier not in ('all', 'any') or len(test) != 1:
+        raise ValueError('Unsupported condition: {}'.format(condition))
+    operator, values = list(test.items())[0]
+    if operator not in ('in', 'not_in'):
+        raise ValueError('Unsupported condition: {}'.format(condition))
+
+    mask = flag_vocabulary.get_mask(values)
+    if operator == 'not_in':
+        # Flags not in the list are any set bit outside of the mask
+        mask = ~mask
+    keep_any = quantifier == 'any'
+
+    # .......................
+    def attribute_flag_mask_filter(batch):
+        """Attribute flag mask filter function."""
+        if keep_any:
+            # Some flag passes the test
+            return np.any(batch.flags & mask, axis=1)
+        # No flag fails the test
+        return ~np.any(batch.flags & ~mask, axis=1)
+    return attribute_flag_mask_filter
+
+
+# .............................................................................
+def get_flag_mask_filter(flag_filter, flag_vocabulary):
+    """Get a flag mask filter from a flag list or a wrangler configuration.
+
+    Args:
+        flag_filter (list or dict): Flag values that make a point invalid, or
+            an attribute_filter data wrangler configuration.
+        flag_vocabulary (FlagVocabulary): The vocabulary used to encode the
+            flags of the batches that will be filtered.
+
+    Returns:
+        function - A function that takes a PointBatch and returns a boolean
+            array indicating which points are valid.
+    """
+    if isinstance(flag_filter, dict):
+        return get_attribute_flag_mask_filter(flag_filter, flag_vocabulary)
+    return get_data_flag_mask_filter(flag_filter, flag_vocabulary)
+
+
 # .............................................................................
 def get_intersect_geometries_filter(geometry_wkts):
     """Get a filter function for intersecting the provided shapefiles.
@@ -85,25 +236,127 @@ def get_intersect_geometries_filter(geometry_wkts):
 
 
 # .............................................................................
-def get_unique_localities_filter():
+def get_unique_localities_filter(decimal_precision=None):
     """Get a filter function that only allows unique (x, y) values.
 
+    The filter remembers every locality it has seen, so a new filter should be
+    created for each species.
+
+    Args:
+        decimal_precision (int): If provided, coordinates are rounded to this
+            many decimal places before being compared.
+
     Returns:
         function - A function that takes a point as input and returns a boolean
             output indicating if the point is valid according to this filter.
     """
-    unique_values = []
+    unique_values = set()
+    if decimal_precision is not None:
+        scale = 10.0 ** decimal_precision
     # .......................
     def unique_localities_filter(point):
         """Unique localities filter function."""
-        test_val = (point.x, point.y)
+        if decimal_precision is None:
+            test_val = (point.x, point.y)
+        else:
+            test_val = (round(point.x * scale), round(point.y * scale))
         if test_val in unique_values:
             return False
-        unique_values.append(test_val)
+        unique_values.add(test_val)
         return True
     return unique_localities_filter
 
 
+# .............................................................................
+def get_unique_localities_mask_filter(decimal_precision=None):
+    """Get a mask filter function that only allows unique (x, y) values.
+
+    Only the first point at each locality is kept.  Uniqueness is evaluated
+    within each batch passed to the filter, so no state is kept between
+    calls.  Fixed point coordinates are compared as packed integers.
+
+    Args:
+        decimal_precision (int): If provided, coordinates are rounded to this
+            many decimal places before being compared.
+
+    Returns:
+        function - A function that takes a PointBatch as input and returns a
+            boolean array indicating which points are valid.
+    """
+    if decimal_precision is not None:
+        scale = 10.0 ** decimal_precision
+    # .......................
+    def unique_localities_mask_filter(batch):
+        """Unique localities mask filter function."""
+        mask = np.zeros(len(batch), dtype=bool)
+        if len(batch) > 0:
+            if batch.precision is not None:
+                _, first_idxs = np.unique(
+                    _get_fixed_point_locality_keys(batch, decimal_precision),
+                    return_index=True)
+            else:
+                if decimal_precision is None:
+                    # Adding 0.0 folds -0.0 into 0.0 so they compare as equal
+                    coords = np.column_stack(
+                        (batch.x + 0.0, batch.y + 0.0))
+                else:
+                    coords = np.column_stack(
+                        (np.rint(batch.x * scale) + 0.0,
+                         np.rint(batch.y * scale) + 0.0))
+                _, first_idxs = np.unique(coords, axis=0, return_index=True)
+            mask[first_idxs] = True
+        return mask
+    return unique_localities_mask_filter
+
+
+# .............................................................................
+def _get_fixed_point_locality_keys(batch, decimal_precision=None):
+    """Get one int64 key per point for the fixed point (x, y) locality.
+
+    Coordinates are first rounded to decimal_precision places if that is
+    coarser than the batch precision, half to even like the np.rint used for
+    floating point coordinates.
+    """
+    xs = batch.x.astype(np.int64)
+    ys = batch.y.astype(np.int64)
+    if decimal_precision is not None and decimal_precision < batch.precision:
+        divisor = 10 ** (batch.precision - decimal_precision)
+        xs = _round_divide_half_even(xs, divisor)
+        ys = _round_divide_half_even(ys, divisor)
+    # Pack x into the high and y into the low 32 bits
+    return (xs << 32) | (ys & 0xFFFFFFFF)
+
+
+# .............................................................................
+def _round_divide_half_even(values, divisor):
+    """Divide integers, rounding exact halves to the even quotient."""
+    quotients, remainders = np.divmod(values, divisor)
+    twice = 2 * remainders
+    round_up = (twice > divisor) | ((twice == divisor) & (quotients % 2 == 1))
+    return quotients + round_up
+
+
+# .............................................................................
+def get_point_mask_filter(point_filter):
+    """Get a mask filter function that applies a point filter to a batch.
+
+    Args:
+        point_filter (function): A function that takes a point as input and
+            returns a boolean indicating if the point is valid.
+
+    Returns:
+        function - A function that takes a PointBatch as input and returns a
+            boolean array indicating which points are valid.
+    """
+    # .......................
+    def point_mask_filter(batch):
+        """Point mask filter function."""
+        return np.fromiter(
+            (point_filter(point) for point in batch.iter_points()),
+            dtype=bool, count=len(batch))
+    return point_mask_filter
+
+
 # .............................................................................
 def get_tdwg_locality_filter_old(locality_dicts_list):
     """Get a filter function that only allows points within the localities.
@@ -138,12 +391,14 @@ def get_tdwg_locality_filter_old(locality_dicts_list):
 
 
 # .............................................................................
-def get_tdwg_locality_filter(locality_dicts_list):
+def get_tdwg_locality_filter(locality_dicts_list, wgsrpd_dir=WGSRPD_BASE_DIR):
     """Get a filter function that only allows points within the localities.
 
     Args:
         locality_dicts_list (list of dict): A list of dictionaries representing
             TDWG localities.
+        wgsrpd_dir (str): The base directory of the WGSRPD shapefiles.  The
+            geometries are read from the shared catalog for this directory.
 
     Returns:
         function - A function that takes a point as input and returns a boolean
@@ -159,41 +414,190 @@ def get_tdwg_locality_filter(locality_dicts_list):
         }
 
     """
-    # Get geometries
-    geometries = []
-    for locality_dict in locality_dicts_list:
-        tdwg_code = locality_dict['tdwgCode']
-        tdwg_level = locality_dict['tdwgLevel']
-        feat_id = locality_dict['featureId']
-        geometries.extend(
-            get_geometry_for_tdwg_feature(tdwg_level, tdwg_code, feat_id))
-    return get_spatial_index_filter(geometries)
+    catalog = get_wgsrpd_catalog(wgsrpd_dir)
+    return get_spatial_index_filter(
+        catalog.get_locality_geometries(locality_dicts_list))
 
 
 # .............................................................................
-def get_spatial_index_filter(geometries):
-    spatial_index = SpatialIndex()
+def get_tdwg_locality_mask_filter(locality_dicts_list,
+                                  wgsrpd_dir=WGSRPD_BASE_DIR):
+    """Get a mask filter that only allows points within the localities.
+
+    Args:
+        locality_dicts_list (list of dict): A list of dictionaries representing
+            TDWG localities, see get_tdwg_locality_filter.
+        wgsrpd_dir (str): The base directory of the WGSRPD shapefiles.
+
+    Returns:
+        function - A function that takes a PointBatch as input and returns a
+            boolean array indicating which points are valid.
+    """
+    catalog = get_wgsrpd_catalog(wgsrpd_dir)
+    return get_spatial_index_mask_filter(
+        catalog.get_locality_geometries(locality_dicts_list))
+
+
+# .............................................................................
+def _get_region_ids(region_index, localities):
+    """Get the identifiers of the indexed regions matching (level, code)s."""
+    att_table = region_index.att_lookup
+    return np.array(
+        [identifier for identifier, level, code in zip(
+            att_table.identifiers, att_table.get_column('level'),
+            att_table.get_column('code'))
+         if (level, code) in localities],
+        dtype=np.int64)
+
+
+# .............................................................................
+def _get_index_mask(spatial_index, xs, ys, identifiers=None):
+    """Get which points are within any feature, or any of identifiers."""
+    offsets, hit_ids = spatial_index.search_many(xs, ys)
+    if identifiers is None:
+        return np.diff(offsets) > 0
+    mask = np.zeros(len(xs), dtype=bool)
+    hit_points = np.repeat(np.arange(len(xs)), np.diff(offsets))
+    mask[hit_points[np.isin(hit_ids, identifiers)]] = True
+    return mask
+
+
+# .............................................................................
+def get_tdwg_region_index_filter(locality_dicts_list, region_index):
+    """Get a filter function using a prebuilt index of TDWG regions.
+
+    Args:
+        locality_dicts_list (list of dict): A list of dictionaries representing
+            TDWG localities.
+        region_index (SpatialIndex): An index of TDWG regions with
+            {'level': , 'code': } attributes, see wgsrpd.get_wgsrpd_index.
+
+    Returns:
+        function - A function that takes a point as input and returns a boolean
+            output indicating if the point is valid according to this filter.
+    """
+    localities = set(
+        (int(locality_dict['tdwgLevel']), str(locality_dict['tdwgCode']))
+        for locality_dict in locality_dicts_list)
+    # .......................
+    def region_index_filter(point):
+        """Region index filter function."""
+        for att_dict in region_index.search(point.x, point.y).values():
+            if (att_dict['level'], att_dict['code']) in localities:
+                return True
+        return False
+    return region_index_filter
+
+
+# .............................................................................
+def get_tdwg_region_index_mask_filter(locality_dicts_list, region_index):
+    """Get a mask filter function using a prebuilt index of TDWG regions.
+
+    Args:
+        locality_dicts_list (list of dict): A list of dictionaries representing
+            TDWG localities.
+        region_index (SpatialIndex): An index of TDWG regions with
+            {'level': , 'code': } attributes, see wgsrpd.get_wgsrpd_index.
+
+    Returns:
+        function - A function that takes a PointBatch as input and returns a
+            boolean array indicating which points are valid.
+    """
+    region_ids = _get_region_ids(region_index, set(
+        (int(locality_dict['tdwgLevel']), str(locality_dict['tdwgCode']))
+        for locality_dict in locality_dicts_list))
+    # .......................
+    def region_index_mask_filter(batch):
+        """Region index mask filter function."""
+        xs, ys = batch.get_coordinates()
+        return _get_index_mask(region_index, xs, ys, region_ids)
+    return region_index_mask_filter
+
+
+# .............................................................................
+def get_region_raster_mask_filter(locality_dicts_list, region_rasters,
+                                  region_index):
+    """Get a mask filter function using rasterized TDWG regions.
+
+    Args:
+        locality_dicts_list (list of dict): A list of dictionaries representing
+            TDWG localities.
+        region_rasters (dict): A dictionary of TDWG level to RegionRaster.
+        region_index (SpatialIndex): The index of TDWG regions the rasters
+            were built from.  Localities at levels without a raster are tested
+            against it directly.
+
+    Returns:
+        function - A function that takes a PointBatch as input and returns a
+            boolean array indicating which points are valid.
+    """
+    localities = set(
+        (int(locality_dict['tdwgLevel']), str(locality_dict['tdwgCode']))
+        for locality_dict in locality_dicts_list)
+    raster_region_ids = []
+    index_region_ids = _get_region_ids(
+        region_index, set(
+            (level, code) for level, code in localities
+            if level not in region_rasters))
+    for level, region_raster in region_rasters.items():
+        level_codes = [code for lvl, code in localities if lvl == level]
+        if level_codes:
+            raster_region_ids.append(
+                (region_raster, region_raster.get_region_ids(level_codes)))
+    # .......................
+    def region_raster_mask_filter(batch):
+        """Region raster mask filter function."""
+        mask = np.zeros(len(batch), dtype=bool)
+        xs, ys = batch.get_coordinates()
+        for region_raster, region_ids in raster_region_ids:
+            mask |= region_raster.within(xs, ys, region_ids)
+        if len(index_region_ids) > 0:
+            idxs = np.flatnonzero(~mask)
+            mask[idxs] = _get_index_mask(
+                region_index, xs[idxs], ys[idxs], index_region_ids)
+        return mask
+    return region_raster_mask_filter
+
+
+# .............................................................................
+def _get_geometries_index(geometries):
+    """Build a spatial index of geometries, identified by list position."""
+    spatial_index = SpatialIndex(bulk_load=True)
     for i, geom in enumerate(geometries):
         spatial_index.add_feature(i, geom, i)
+    return spatial_index
+
+
+# .............................................................................
+def get_spatial_index_filter(geometries):
+    spatial_index = _get_geometries_index(geometries)
     def spatial_index_filter(point):
         return bool(spatial_index.search(point.x, point.y))
     return spatial_index_filter
 
 
 # .............................................................................
-def _get_tdwg_level_shapefile(level):
-    return os.path.join(
-        WGSRPD_BASE_DIR, 'level{}'.format(level), 'level{}.shp'.format(level))
+def get_spatial_index_mask_filter(geometries):
+    """Get a mask filter allowing points within any of the geometries.
+
+    Args:
+        geometries (list of ogr.Geometry): The geometries to allow.
+
+    Returns:
+        function - A function that takes a PointBatch as input and returns a
+            boolean array indicating which points are valid.
+    """
+    spatial_index = _get_geometries_index(geometries)
+    # .......................
+    def spatial_index_mask_filter(batch):
+        """Spatial index mask filter function."""
+        xs, ys = batch.get_coordinates()
+        return _get_index_mask(spatial_index, xs, ys)
+    return spatial_index_mask_filter
+
 
 # .............................................................................
 def get_geometry_for_tdwg_feature(level, code, feat_id):
-    # Get the shapefile
-    geometries = []
-    level_shapefile = _get_tdwg_level_shapefile(level)
-    driver = ogr.GetDriverByName("ESRI Shapefile")
-    dataset = driver.Open(level_shapefile, 0)
-    layer = dataset.GetLayer()
-    layer.SetAttributeFilter("LEVEL{}_COD = '{}'".format(level, code))
-    for feature in layer:
-        geometries.append(feature.GetGeometryRef().ExportToWkt())
-    return geometries
+    """Get the WKT of the geometries for a TDWG feature."""
+    catalog = get_wgsrpd_catalog(WGSRPD_BASE_DIR)
+    return [geom.ExportToWkt() for geom in catalog.get_geometries(level, code)]
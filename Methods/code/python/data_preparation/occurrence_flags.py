@@ -0,0 +1,110 @@
+"""Module containing the fixed vocabulary of GBIF issues and iDigBio flags.
+
+Every FlagVocabulary created with get_flag_vocabulary assigns the same bit to
+each known GBIF issue and iDigBio flag, so batches and stores written at
+different times share bit positions and a flag filter can be precomputed as a
+single mask.  Flags that are not listed here are assigned the bits after the
+known flags in the order they are seen.
+
+Data wrangler configurations of the 'attribute_filter' type that test one of
+the flag attributes can be converted to a mask filter with
+filters.get_attribute_flag_mask_filter.
+"""
+from .point_batch import FlagVocabulary
+
+# Bit positions follow the order of these lists, only append to them
+GBIF_ISSUES = (
+    'ZERO_COORDINATE', 'COORDINATE_OUT_OF_RANGE', 'COORDINATE_INVALID',
+    'COORDINATE_ROUNDED', 'GEODETIC_DATUM_INVALID',
+    'GEODETIC_DATUM_ASSUMED_WGS84', 'COORDINATE_REPROJECTED',
+    'COORDINATE_REPROJECTION_FAILED', 'COORDINATE_REPROJECTION_SUSPICIOUS',
+    'COORDINATE_ACCURACY_INVALID', 'COORDINATE_PRECISION_INVALID',
+    'COORDINATE_UNCERTAINTY_METERS_INVALID',
+    'COORDINATE_PRECISION_UNCERTAINTY_MISMATCH', 'FOOTPRINT_SRS_INVALID',
+    'FOOTPRINT_WKT_MISMATCH', 'FOOTPRINT_WKT_INVALID',
+    'COUNTRY_COORDINATE_MISMATCH', 'COUNTRY_MISMATCH', 'COUNTRY_INVALID',
+    'COUNTRY_DERIVED_FROM_COORDINATES', 'CONTINENT_COORDINATE_MISMATCH',
+    'CONTINENT_COUNTRY_MISMATCH', 'CONTINENT_INVALID',
+    'CONTINENT_DERIVED_FROM_COORDINATES', 'CONTINENT_DERIVED_FROM_COUNTRY',
+    'PRESUMED_SWAPPED_COORDINATE', 'PRESUMED_NEGATED_LONGITUDE',
+    'PRESUMED_NEGATED_LATITUDE', 'RECORDED_DATE_MISMATCH',
+    'RECORDED_DATE_INVALID', 'RECORDED_DATE_UNLIKELY', 'TAXON_MATCH_FUZZY',
+    'TAXON_MATCH_HIGHERRANK', 'TAXON_MATCH_AGGREGATE', 'TAXON_MATCH_NONE',
+    'TAXON_CONCEPT_ID_NOT_FOUND', 'TAXON_ID_NOT_FOUND',
+    'SCIENTIFIC_NAME_ID_NOT_FOUND', 'TAXON_MATCH_TAXON_CONCEPT_ID_IGNORED',
+    'TAXON_MATCH_TAXON_ID_IGNORED', 'TAXON_MATCH_SCIENTIFIC_NAME_ID_IGNORED',
+    'DEPTH_NOT_METRIC', 'DEPTH_UNLIKELY', 'DEPTH_MIN_MAX_SWAPPED',
+    'DEPTH_NON_NUMERIC', 'ELEVATION_UNLIKELY', 'ELEVATION_MIN_MAX_SWAPPED',
+    'ELEVATION_NOT_METRIC', 'ELEVATION_NON_NUMERIC', 'MODIFIED_DATE_INVALID',
+    'MODIFIED_DATE_UNLIKELY', 'IDENTIFIED_DATE_UNLIKELY',
+    'IDENTIFIED_DATE_INVALID', 'GEOREFERENCED_DATE_INVALID',
+    'GEOREFERENCED_DATE_UNLIKELY', 'BASIS_OF_RECORD_INVALID',
+    'TYPE_STATUS_INVALID', 'SUSPECTED_TYPE', 'MULTIMEDIA_DATE_INVALID',
+    'MULTIMEDIA_URI_INVALID', 'REFERENCES_URI_INVALID',
+    'INTERPRETATION_ERROR', 'INDIVIDUAL_COUNT_INVALID',
+    'INDIVIDUAL_COUNT_CONFLICTS_WITH_OCCURRENCE_STATUS',
+    'OCCURRENCE_STATUS_UNPARSABLE',
+    'OCCURRENCE_STATUS_INFERRED_FROM_INDIVIDUAL_COUNT',
+    'OCCURRENCE_STATUS_INFERRED_FROM_BASIS_OF_RECORD',
+    'AMBIGUOUS_COLLECTION', 'AMBIGUOUS_INSTITUTION',
+    'COLLECTION_MATCH_FUZZY', 'COLLECTION_MATCH_NONE',
+    'INSTITUTION_MATCH_FUZZY', 'INSTITUTION_MATCH_NONE',
+    'INSTITUTION_COLLECTION_MISMATCH', 'DIFFERENT_OWNER_INSTITUTION',
+    'RECORDED_BY_ID_INVALID', 'IDENTIFIED_BY_ID_INVALID',
+    'POSSIBLY_ON_LOAN')
+IDIGBIO_FLAGS = (
+    'geopoint_0_coord', 'geopoint_bounds', 'geopoint_datum_error',
+    'geopoint_datum_missing', 'geopoint_low_precision', 'geopoint_pre_flip',
+    'geopoint_similar_coord', 'rev_geocode_both_sign',
+    'rev_geocode_corrected', 'rev_geocode_eez', 'rev_geocode_eez_corrected',
+    'rev_geocode_failure', 'rev_geocode_flip', 'rev_geocode_flip_both_sign',
+    'rev_geocode_flip_lat_sign', 'rev_geocode_flip_lon_sign',
+    'rev_geocode_lat_sign', 'rev_geocode_lon_sign', 'rev_geocode_mismatch',
+    'taxon_match_failed', 'datecollected_bounds',
+    'dwc_basisofrecord_invalid', 'dwc_basisofrecord_removed',
+    'dwc_basisofrecord_replaced', 'dwc_country_added',
+    'dwc_country_replaced', 'dwc_stateprovince_replaced',
+    'dwc_datasetid_added', 'dwc_datasetid_replaced', 'dwc_kingdom_added',
+    'dwc_kingdom_replaced', 'dwc_kingdom_suspect', 'dwc_phylum_added',
+    'dwc_phylum_replaced', 'dwc_class_added', 'dwc_class_replaced',
+    'dwc_order_added', 'dwc_order_replaced', 'dwc_family_added',
+    'dwc_family_replaced', 'dwc_genus_added', 'dwc_genus_replaced',
+    'dwc_specificepithet_added', 'dwc_specificepithet_replaced',
+    'dwc_scientificname_added', 'dwc_scientificname_replaced',
+    'dwc_taxonrank_added', 'dwc_taxonrank_invalid', 'dwc_taxonrank_removed',
+    'dwc_taxonrank_replaced', 'dwc_multimedia_added', 'gbif_canonical',
+    'gbif_genericname', 'gbif_taxon_corrected', 'gbif_vernacular')
+KNOWN_FLAGS = GBIF_ISSUES + IDIGBIO_FLAGS
+
+# Record attributes holding flags in data wrangler configurations
+GBIF_ISSUE_ATTRIBUTES = ('issue', 'issues')
+IDIGBIO_FLAG_ATTRIBUTES = ('idigbio:flags', 'flags')
+
+
+# .............................................................................
+def get_flag_vocabulary():
+    """Get a flag vocabulary with the known flags assigned their fixed bits.
+
+    Returns:
+        FlagVocabulary - A new vocabulary, later flags are added after the
+            known flags.
+    """
+    return FlagVocabulary(KNOWN_FLAGS)
+
+
+# .............................................................................
+def get_flag_attribute_provider(attribute_name):
+    """Get the provider whose flags are held in a record attribute.
+
+    Args:
+        attribute_name (str): The attribute name used in a data wrangler
+            configuration.
+
+    Returns:
+        str - 'gbif', 'idigbio', or None if the attribute does not hold flags.
+    """
+    if attribute_name in GBIF_ISSUE_ATTRIBUTES:
+        return 'gbif'
+    if attribute_name in IDIGBIO_FLAG_ATTRIBUTES:
+        return 'idigbio'
+    return None
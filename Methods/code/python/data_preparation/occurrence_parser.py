@@ -0,0 +1,153 @@
+"""Module containing a bulk parser for species occurrence files.
+
+Occurrence files have one point per line as 'species, x, y, flags', where the
+flags field has been written as a JSON list, a quoted comma separated string,
+or a semicolon separated list depending on the tool that wrote it.  A whole
+file is parsed at once into a PointBatch, and lines that cannot be parsed are
+counted by reason instead of being printed one at a time.
+"""
+from array import array
+from collections import Counter
+import re
+
+import numpy as np
+
+from .point_batch import (
+    FLAG_WORDS, PointBatch, SpeciesVocabulary, to_fixed_point)
+
+REJECT_FIELDS = 'missing_fields'
+REJECT_COORDINATES = 'bad_coordinates'
+REJECT_FLAGS = 'bad_flags'
+REJECT_REASONS = (REJECT_FIELDS, REJECT_COORDINATES, REJECT_FLAGS)
+
+FLAG_SEPARATOR_RE = re.compile(r'[,;]')
+FLAG_STRIP_CHARS = ' \'"'
+
+
+# .............................................................................
+def parse_flags(flags_text):
+    """Split the flags field of a line into individual flag tokens.
+
+    Args:
+        flags_text (str): The flags field, such as '["a", "b"]', '"a,b"', or
+            '[a; b]'.
+
+    Returns:
+        list of str - The flag tokens.
+    """
+    flags_text = flags_text.strip().strip(FLAG_STRIP_CHARS).strip('[]')
+    tokens = []
+    for token in FLAG_SEPARATOR_RE.split(flags_text):
+        token = token.strip(FLAG_STRIP_CHARS)
+        if token:
+            tokens.append(token)
+    return tokens
+
+
+# .............................................................................
+def _parse_column(values, rejected_rows):
+    """Parse a column of coordinate strings, noting rows that fail."""
+    try:
+        return np.array(values, dtype=np.float64)
+    except ValueError:
+        column = np.zeros(len(values), dtype=np.float64)
+        for i, value in enumerate(values):
+            try:
+                column[i] = float(value)
+            except ValueError:
+                rejected_rows.add(i)
+        return column
+
+
+# .............................................................................
+def parse_point_lines(lines, flag_vocabulary, rejected=None, precision=None):
+    """Parse occurrence lines into a PointBatch.
+
+    Species names and flag strings are interned as they are read, so only the
+    coordinate text of each line is kept until the batch is built.
+
+    Args:
+        lines (iterable of str): The lines to parse, such as an open file.
+            Blank lines are skipped.  Lines without all four fields, even an
+            empty flags field, are rejected.
+        flag_vocabulary (FlagVocabulary): The vocabulary to assign flag bits
+            with.
+        rejected (Counter): If provided, the number of lines rejected for each
+            reason is added to it.  Coordinates that are not finite numbers
+            are rejected as bad coordinates.
+        precision (int): If provided, coordinates are converted to fixed
+            point with this many decimal places.
+
+    Returns:
+        PointBatch - The parsed points.
+    """
+    if rejected is None:
+        rejected = Counter()
+    # Files repeat a few distinct flag strings, so encode each once
+    flag_words = {'': [0] * FLAG_WORDS}
+    species_vocabulary = SpeciesVocabulary()
+    x_values = []
+    y_values = []
+    species_ids = array('i')
+    flags = array('Q')
+    for line in lines:
+        line = line.strip()
+        if not line:
+            continue
+        fields = line.split(', ', 3)
+        if len(fields) < 4:
+            rejected[REJECT_FIELDS] += 1
+            continue
+        flags_text = fields[3]
+        try:
+            words = flag_words[flags_text]
+        except KeyError:
+            try:
+                words = flag_vocabulary.encode(parse_flags(flags_text))
+            except ValueError:
+                rejected[REJECT_FLAGS] += 1
+                continue
+            flag_words[flags_text] = words
+        flags.extend(words)
+        species_ids.append(species_vocabulary.get_id(fields[0]))
+        x_values.append(fields[1])
+        y_values.append(fields[2])
+
+    bad_rows = set()
+    xs = _parse_column(x_values, bad_rows)
+    ys = _parse_column(y_values, bad_rows)
+    # 'inf' and 'nan' parse as floats but are not coordinates
+    keep = np.isfinite(xs) & np.isfinite(ys)
+    keep[list(bad_rows)] = False
+    rejected[REJECT_COORDINATES] += int(len(keep) - keep.sum())
+    xs = xs[keep]
+    ys = ys[keep]
+    if precision is not None:
+        xs = to_fixed_point(xs, precision)
+        ys = to_fixed_point(ys, precision)
+    return PointBatch(
+        species_vocabulary.names,
+        np.array(species_ids, dtype=np.int32)[keep], xs, ys,
+        np.array(flags, dtype=np.uint64).reshape((-1, FLAG_WORDS))[keep],
+        flag_vocabulary=flag_vocabulary, precision=precision)
+
+
+# .............................................................................
+def read_point_file(filename, flag_vocabulary, rejected=None, precision=None):
+    """Read an occurrence file into a PointBatch.
+
+    Args:
+        filename (str): The file location to read.
+        flag_vocabulary (FlagVocabulary): The vocabulary to assign flag bits
+            with.
+        rejected (Counter): If provided, the number of lines rejected for each
+            reason is added to it.
+        precision (int): If provided, coordinates are converted to fixed
+            point with this many decimal places.
+
+    Returns:
+        PointBatch - The parsed points.
+    """
+    with open(filename, 'r') as in_file:
+        return parse_point_lines(
+            in_file, flag_vocabulary, rejected=rejected, precision=precision)
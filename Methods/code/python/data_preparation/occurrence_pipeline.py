@@ -0,0 +1,538 @@
+"""Module containing the per-species occurrence filtering pipeline.
+
+The pipeline reads the iDigBio and GBIF points of each species in a species
+list, runs them through the flag, bounding box, duplicate and POWO locality
+filters, and writes the species with enough remaining points to one CSV file.
+The create_csv scripts of each project are argument and configuration
+wrappers around create_species_csv.
+"""
+from collections import Counter, defaultdict
+from functools import partial
+import json
+import os
+import time
+
+from tools.common.parallel import map_in_order
+from tools.common.prefetch import (
+    DEFAULT_MAX_BYTES, FilePrefetcher, open_prefetched)
+from tools.common.run_journal import RunJournal, get_journal_filename
+
+from .filter_cache import (
+    CACHE_COUNTERS, DEFAULT_MAX_SIZE, LocalityFilterCache)
+from .filter_chain import FilterChain, INITIAL_STAGE
+from .filters import (
+    WGSRPD_BASE_DIR, get_bounding_box_mask_filter, get_flag_mask_filter,
+    get_region_raster_mask_filter, get_tdwg_locality_mask_filter,
+    get_tdwg_region_index_mask_filter, get_unique_localities_mask_filter)
+from .occurrence_flags import get_flag_vocabulary
+from .occurrence_parser import REJECT_REASONS, parse_point_lines
+from .occurrence_store import OccurrenceStore, convert_directory_tree
+from .point_batch import PointBatch
+from .region_raster import (
+    RASTER_LEVELS, get_region_raster, get_region_raster_filename)
+from .spatial_index import META_EXTENSION
+from .wgsrpd import get_wgsrpd_index
+
+MAX_WORKERS = 7
+# Number of species sent to a worker process at a time
+SPECIES_CHUNK_SIZE = 50
+
+GBIF_FILTER_FLAGS = [
+    'TAXON_MATCH_FUZZY', 'TAXON_MATCH_HIGHERRANK', 'TAXON_MATCH_NONE']
+IDIGBIO_FILTER_FLAGS = [
+    'geopoint_datum_missing', 'geopoint_bounds', 'geopoint_datum_error',
+    'geopoint_similar_coord', 'rev_geocode_mismatch', 'rev_geocode_failure',
+    'geopoint_0_coord', 'taxon_match_failed', 'dwc_kingdom_suspect',
+    'dwc_taxonrank_invalid', 'dwc_taxonrank_removed']
+# Species removed by either flag stage are reported together
+FLAG_STAGES = ('idigbio_flags', 'gbif_flags')
+
+
+# .............................................................................
+def get_species_list_from_file(filename):
+    """Get a list of species names from a file."""
+    species_names = []
+    with open(filename) as in_file:
+        for line in in_file:
+            try:
+                parts = line.split(',')
+                species_names.append(parts[1].strip().strip('"'))
+            except Exception as err:
+                print(err)
+    return species_names
+
+
+# .............................................................................
+def _get_filename(base_dir, species, service_suffix):
+    genus = species.split(' ')[0]
+    return os.path.join(
+        base_dir, genus, '{}{}'.format(species, service_suffix))
+
+
+# .............................................................................
+def get_species_filenames(base_dir, species, store_dir=None):
+    """Get the input file locations for a species, to prefetch."""
+    suffixes = ['_powo.json']
+    if store_dir is None:
+        suffixes.extend(['_idigbio.csv', '_gbif.csv'])
+    return [_get_filename(base_dir, species, suffix) for suffix in suffixes]
+
+
+# .............................................................................
+def _get_provider_points(provider, base_dir, species, flag_vocabulary,
+                         store=None, rejected=None, files=None,
+                         precision=None):
+    """Get the points of a species from one provider as a PointBatch."""
+    if store is not None:
+        return store.get_points(
+            provider, species, flag_vocabulary).with_precision(precision)
+    in_file = open_prefetched(
+        _get_filename(base_dir, species, '_{}.csv'.format(provider)),
+        files=files)
+    if in_file is not None:
+        with in_file:
+            return parse_point_lines(
+                in_file, flag_vocabulary, rejected=rejected,
+                precision=precision)
+    return PointBatch.empty(
+        flag_vocabulary=flag_vocabulary, precision=precision)
+
+
+# .............................................................................
+def get_gbif_points(base_dir, species, flag_vocabulary, store=None,
+                    rejected=None, files=None, precision=None):
+    """Get GBIF points for a species as a PointBatch.
+
+    Points are read from store, an OccurrenceStore, if it is provided.
+    Lines that cannot be parsed are counted by reason in rejected, a Counter,
+    if it is provided.  The file is taken from files, prefetched contents
+    from a FilePrefetcher, if it is there.  Coordinates are fixed point with
+    precision decimal places if it is provided.
+    """
+    return _get_provider_points(
+        'gbif', base_dir, species, flag_vocabulary, store=store,
+        rejected=rejected, files=files, precision=precision)
+
+
+# .............................................................................
+def get_idigbio_points(base_dir, species, flag_vocabulary, store=None,
+                       rejected=None, files=None, precision=None):
+    """Get iDigBio points for a species as a PointBatch.
+
+    See get_gbif_points.
+    """
+    return _get_provider_points(
+        'idigbio', base_dir, species, flag_vocabulary, store=store,
+        rejected=rejected, files=files, precision=precision)
+
+
+# .............................................................................
+def convert_to_store(base_dir, store_dir, precision=None):
+    """Convert the per-species GBIF and iDigBio files to an occurrence store.
+
+    Coordinates are stored as fixed point with precision decimal places if it
+    is provided.
+    """
+    return convert_directory_tree(
+        base_dir, store_dir,
+        {
+            'gbif': ('_gbif.csv', get_gbif_points),
+            'idigbio': ('_idigbio.csv', get_idigbio_points)
+        }, precision=precision)
+
+
+# .............................................................................
+def get_region_rasters(region_index, wgsrpd_index_filename):
+    """Load or build the region rasters saved next to a WGSRPD index."""
+    return {
+        level: get_region_raster(
+            region_index, level,
+            filename=get_region_raster_filename(wgsrpd_index_filename, level))
+        for level in RASTER_LEVELS}
+
+
+# .............................................................................
+def _saved_regions_exist(wgsrpd_index_filename, use_region_raster):
+    """Test if the saved WGSRPD index, and rasters if used, are on disk."""
+    filenames = ['{}{}'.format(wgsrpd_index_filename, META_EXTENSION)]
+    if use_region_raster:
+        filenames.extend(
+            get_region_raster_filename(wgsrpd_index_filename, level)
+            for level in RASTER_LEVELS)
+    return all(os.path.exists(filename) for filename in filenames)
+
+
+# .............................................................................
+def get_kew_filter(base_dir, species, get_locality_filter=None, files=None,
+                   wgsrpd_dir=WGSRPD_BASE_DIR):
+    """Get a filter for KEW POWO expert opinion
+
+    Args:
+        base_dir (str): The base directory of the species files.
+        species (str): The species name.
+        get_locality_filter (function): A function that takes a list of native
+            TDWG localities and returns a filter, such as
+            LocalityFilterCache.get_filter.  Defaults to building a new
+            get_tdwg_locality_mask_filter.
+        files (dict): Prefetched file contents from a FilePrefetcher.
+        wgsrpd_dir (str): The base directory of the WGSRPD shapefiles, used
+            by the default locality filter.
+
+    Returns:
+        function or None - A mask filter, or None if the species has no POWO
+            distribution.
+    """
+    json_in = open_prefetched(
+        _get_filename(base_dir, species, '_powo.json'), files=files)
+    if json_in is not None:
+        with json_in:
+            species_info = json.load(json_in)
+            try:
+                natives = species_info['distribution']['natives']
+                if get_locality_filter is not None:
+                    return get_locality_filter(natives)
+                return get_tdwg_locality_mask_filter(
+                    natives, wgsrpd_dir=wgsrpd_dir)
+            except Exception as err:
+                print(err)
+    return None
+
+
+# .............................................................................
+def get_process_species_function(base_dir, idigbio_flags, gbif_flags, bbox,
+                                 wgsrpd_dir=WGSRPD_BASE_DIR,
+                                 remove_duplicates=True,
+                                 duplicate_precision=None,
+                                 wgsrpd_index_filename=None,
+                                 locality_cache_size=DEFAULT_MAX_SIZE,
+                                 use_region_raster=False, store_dir=None,
+                                 coordinate_precision=None, index_engine=None,
+                                 region_index=None, region_rasters=None):
+    """Get a function to process a species.
+
+    The idigbio_flags and gbif_flags are each a list of flags that make a
+    point invalid or an attribute_filter data wrangler configuration.  A
+    region_index and region_rasters already loaded from
+    wgsrpd_index_filename are used as they are instead of being loaded again.
+    See create_species_csv for the other options.
+
+    Returns:
+        function - A function that takes a species name, or a (species,
+            files) pair from a FilePrefetcher, and returns a (species,
+            FilterChainResult, rejected line Counter, locality filter cache
+            Counter) tuple.
+    """
+    flag_vocabulary = get_flag_vocabulary()
+    # Points are read from a consolidated store instead of per-species files
+    store = None
+    if store_dir is not None:
+        store = OccurrenceStore(store_dir)
+    # A saved index of every WGSRPD region is loaded once and shared by all
+    #    species instead of indexing each species' regions
+    if wgsrpd_index_filename is not None:
+        if region_index is None:
+            region_index = get_wgsrpd_index(
+                wgsrpd_dir, wgsrpd_index_filename, engine=index_engine)
+        if use_region_raster and region_rasters is None:
+            region_rasters = get_region_rasters(
+                region_index, wgsrpd_index_filename)
+
+    # Species with the same native regions share a compiled locality filter
+    def build_locality_filter(natives):
+        if region_rasters is not None:
+            return get_region_raster_mask_filter(
+                natives, region_rasters, region_index)
+        if region_index is not None:
+            return get_tdwg_region_index_mask_filter(natives, region_index)
+        return get_tdwg_locality_mask_filter(natives, wgsrpd_dir=wgsrpd_dir)
+    locality_filters = LocalityFilterCache(
+        build_locality_filter, max_size=locality_cache_size)
+    idigbio_flag_filter = get_flag_mask_filter(idigbio_flags, flag_vocabulary)
+    gbif_flag_filter = get_flag_mask_filter(gbif_flags, flag_vocabulary)
+    bbox_filter = get_bounding_box_mask_filter(*bbox)
+    # Duplicates are judged within each species batch
+    unique_filter = None
+    if remove_duplicates:
+        unique_filter = get_unique_localities_mask_filter(
+            decimal_precision=duplicate_precision)
+
+    def process_species(item):
+        # Items are species names, or (species, files) pairs when the files
+        #    have been read ahead by a FilePrefetcher
+        species, files = item if isinstance(item, tuple) else (item, None)
+        rejected = Counter()
+        cache_counts = Counter()
+        # iDigBio flags are lower case and GBIF issues are upper case, so each
+        # flag stage only removes points from its own provider
+        species_points = PointBatch.concatenate(
+            [get_idigbio_points(
+                base_dir, species, flag_vocabulary, store=store,
+                rejected=rejected, files=files,
+                precision=coordinate_precision),
+             get_gbif_points(
+                 base_dir, species, flag_vocabulary, store=store,
+                 rejected=rejected, files=files,
+                 precision=coordinate_precision)],
+            flag_vocabulary=flag_vocabulary, precision=coordinate_precision)
+
+        # Locality
+        locality_filter = get_kew_filter(
+            base_dir, species,
+            get_locality_filter=partial(
+                locality_filters.get_filter, counts=cache_counts),
+            files=files, wgsrpd_dir=wgsrpd_dir)
+
+        filter_chain = FilterChain([
+            ('idigbio_flags', idigbio_flag_filter),
+            ('gbif_flags', gbif_flag_filter),
+            ('bbox', bbox_filter),
+            ('duplicates', unique_filter),
+            ('locality', locality_filter)])
+        return (
+            species, filter_chain.apply(species_points), rejected,
+            cache_counts)
+    return process_species
+
+
+# .............................................................................
+class RunTotals:
+    """This class adds up the journal records of a run for its report."""
+    # ..........................
+    def __init__(self):
+        """Constructor."""
+        self.num_species = 0
+        self.num_points = 0
+        self.valid_species = 0
+        self.filtered = defaultdict(int)
+        self.removed_species = defaultdict(int)
+        self.rejected = defaultdict(int)
+        # Cache counts are only known for the species run in this process,
+        #    they are not journaled
+        self.cache_counts = Counter()
+
+    # ..........................
+    def add(self, record):
+        """Add the counts of a species journal record."""
+        self.num_species += 1
+        self.num_points += record['initial_count']
+        for reason, num_rejected in record.get('rejected', {}).items():
+            self.rejected[reason] += num_rejected
+        for stage_name, num_removed in record['removed'].items():
+            self.filtered[stage_name] += num_removed
+        if record['limiting_stage'] is None:
+            self.valid_species += 1
+        else:
+            self.removed_species[record['limiting_stage']] += 1
+
+    # ..........................
+    def add_cache_counts(self, cache_counts):
+        """Add the locality filter cache counts of a species."""
+        self.cache_counts.update(cache_counts)
+
+    # ..........................
+    def print_report(self):
+        """Print the point and species counts of each filter."""
+        print('')
+        print('Total number of points: {}'.format(self.num_points))
+        for reason in REJECT_REASONS:
+            print('Total number of lines rejected by parser ({}): {}'.format(
+                reason, self.rejected[reason]))
+        print('Total number of points filtered by GBIF flags: {}'.format(
+            self.filtered['gbif_flags']))
+        print('Total number of points filtered by iDigBio flags: {}'.format(
+            self.filtered['idigbio_flags']))
+        print('Total number of points filtered by bounding box: {}'.format(
+            self.filtered['bbox']))
+        print('Total number of points filtered by duplicates: {}'.format(
+            self.filtered['duplicates']))
+        print('Total number of points filtered by locality: {}'.format(
+            self.filtered['locality']))
+        print('')
+        print('Total number of species: {}'.format(self.num_species))
+        print('Species without enough points to begin with: {}'.format(
+            self.removed_species[INITIAL_STAGE]))
+        print('Number of species removed by flags: {}'.format(
+            self.removed_species['flags']))
+        print('Number of species removed by bounding box: {}'.format(
+            self.removed_species['bbox']))
+        print('Number of species removed by duplicates: {}'.format(
+            self.removed_species['duplicates']))
+        print('Number of species removed by locality: {}'.format(
+            self.removed_species['locality']))
+        print('')
+        print('Number of species remaining: {}'.format(self.valid_species))
+        print('')
+        print('Locality filter cache (species run this time): {}'.format(
+            ', '.join(
+                '{} {}'.format(self.cache_counts[counter], counter)
+                for counter in CACHE_COUNTERS)))
+
+
+# .............................................................................
+def create_species_csv(base_dir, out_filename, species_filename, min_points,
+                       bbox, idigbio_flags, gbif_flags,
+                       wgsrpd_dir=WGSRPD_BASE_DIR, remove_duplicates=True,
+                       duplicate_precision=None, backend='thread',
+                       max_workers=MAX_WORKERS, chunk_size=SPECIES_CHUNK_SIZE,
+                       wgsrpd_index_filename=None,
+                       locality_cache_size=DEFAULT_MAX_SIZE,
+                       use_region_raster=False, resume=False, store_dir=None,
+                       prefetch_depth=None, prefetch_bytes=DEFAULT_MAX_BYTES,
+                       coordinate_precision=None, index_engine=None):
+    """Filter the points of each species and write them to a CSV file.
+
+    The 'thread' backend shares one set of filters between threads, the
+    'process' backend builds the filters once in each worker process and
+    sends species to the workers chunk_size at a time.  Results are written in
+    species list order with either backend.
+
+    If wgsrpd_index_filename is provided, a saved index of the WGSRPD regions
+    is used for the locality filter, and it is built there first if needed.
+    With use_region_raster, the level 3 and 4 regions of that index are also
+    rasterized onto a grid so most points are placed with an array lookup and
+    only points in grid cells on a region boundary are tested exactly.
+    index_engine selects how that index finds the cells under points, see
+    SpatialIndex, and defaults to the engine it was saved with.
+
+    Each completed species is recorded in a journal next to the output file.
+    With resume, species already in the journal are skipped, their counts are
+    restored from the journal, and new points are appended to the output.
+
+    If store_dir is provided, points are read from that occurrence store (see
+    convert_to_store) and base_dir is only used for POWO distributions.
+
+    If prefetch_depth is provided, the input files of up to that many
+    upcoming species, holding at most about prefetch_bytes, are read into
+    memory in a background thread and handed to the workers with the species.
+
+    If coordinate_precision is provided, coordinates are held and filtered as
+    int32 fixed point values with that many decimal places, and written with
+    that many decimal places.
+
+    Args:
+        base_dir (str): The base directory of the per-species files.
+        out_filename (str): The file location to write CSV points to.
+        species_filename (str): A file of accepted species names.
+        min_points (int): The minimum number of points to keep a species.
+        bbox (tuple): The (min_x, min_y, max_x, max_y) bounding box.
+        idigbio_flags (list): iDigBio flags that make a point invalid, or an
+            attribute_filter data wrangler configuration.
+        gbif_flags (list): GBIF issues that make a point invalid, or an
+            attribute_filter data wrangler configuration.
+        wgsrpd_dir (str): The base directory of the WGSRPD shapefiles.
+
+    Returns:
+        RunTotals - The counts of the run, including resumed species.
+
+    Raises:
+        ValueError: Raised if resuming with a journal that does not match the
+            species list.
+    """
+    # Get species names
+    print('Get species names')
+    start_time = time.time()
+    species_names = get_species_list_from_file(species_filename)
+    process_species_kwargs = {
+        'remove_duplicates': remove_duplicates,
+        'duplicate_precision': duplicate_precision,
+        'wgsrpd_index_filename': wgsrpd_index_filename,
+        'locality_cache_size': locality_cache_size,
+        'use_region_raster': use_region_raster,
+        'store_dir': store_dir,
+        'coordinate_precision': coordinate_precision,
+        'index_engine': index_engine
+    }
+    if wgsrpd_index_filename is not None:
+        if backend == 'thread':
+            # Threads share the index and rasters loaded here
+            region_index = get_wgsrpd_index(
+                wgsrpd_dir, wgsrpd_index_filename, engine=index_engine)
+            process_species_kwargs['region_index'] = region_index
+            if use_region_raster:
+                process_species_kwargs['region_rasters'] = get_region_rasters(
+                    region_index, wgsrpd_index_filename)
+        elif not _saved_regions_exist(
+                wgsrpd_index_filename, use_region_raster):
+            # Each worker process loads the saved index and rasters, so any
+            #    missing ones are built once here rather than in every worker
+            region_index = get_wgsrpd_index(
+                wgsrpd_dir, wgsrpd_index_filename, engine=index_engine)
+            if use_region_raster:
+                get_region_rasters(region_index, wgsrpd_index_filename)
+    if backend == 'thread':
+        # Threads share one function so send them one species at a time
+        chunk_size = 1
+
+    # Completed species are journaled so an interrupted run can be resumed
+    journal = RunJournal(get_journal_filename(out_filename))
+    completed = []
+    if resume:
+        completed = journal.load(out_filename)
+        if [record['species'] for record in completed] != \
+                species_names[:len(completed)]:
+            raise ValueError(
+                'Journal {} does not match species list {}'.format(
+                    journal.filename, species_filename))
+        # Drop any output written after the last journaled species
+        if os.path.exists(out_filename):
+            os.truncate(
+                out_filename, completed[-1]['offset'] if completed else 0)
+        print('Resuming after {} completed species'.format(len(completed)))
+
+    totals = RunTotals()
+    for record in completed:
+        totals.add(record)
+
+    with open(out_filename, 'a' if resume else 'w') as out_file, journal:
+        journal.open(out_file, resume=resume)
+        i = len(completed)
+        one_tenth_percent = max(1, int(len(species_names) / 1000))
+        percent = .1 * (i // one_tenth_percent)
+
+        species_items = species_names[i:]
+        prefetcher = None
+        if prefetch_depth:
+            # Species are processed by workers after later species have been
+            #    handed out, so their files are released as results return
+            prefetcher = FilePrefetcher(
+                species_items,
+                lambda species: get_species_filenames(
+                    base_dir, species, store_dir=store_dir),
+                depth=prefetch_depth, max_bytes=prefetch_bytes,
+                manual_release=True)
+            species_items = prefetcher
+        for sp_name, chain_result, rejected, cache_counts in map_in_order(
+                get_process_species_function,
+                (base_dir, idigbio_flags, gbif_flags, bbox, wgsrpd_dir),
+                species_items, factory_kwargs=process_species_kwargs,
+                backend=backend, max_workers=max_workers,
+                chunk_size=chunk_size):
+            sp_points = chain_result.points
+
+            # If enough points leftover...
+            stage_name = None
+            if len(sp_points) >= min_points:
+                sp_points.write_csv(out_file)
+            else:
+                # What removed this species?
+                stage_name = chain_result.get_limiting_stage(min_points)
+                if stage_name in FLAG_STAGES:
+                    stage_name = 'flags'
+
+            # Journal the species and add its counts to the totals
+            totals.add(
+                journal.record(
+                    sp_name, out_file.tell(), chain_result.initial_count,
+                    chain_result.removed, limiting_stage=stage_name,
+                    rejected=rejected))
+            totals.add_cache_counts(cache_counts)
+            if prefetcher is not None:
+                prefetcher.release()
+            i += 1
+            if i % one_tenth_percent == 0:
+                percent += .1
+                print('{}%, {} seconds'.format(
+                    percent, time.time() - start_time))
+    # Print results of filters
+    totals.print_report()
+    return totals
@@ -0,0 +1,292 @@
+"""Module containing a consolidated, memory-mappable occurrence store.
+
+The store replaces the directory of per-species CSV files with a few flat
+binary column files and an index, so reading a species is a slice of each
+memory-mapped column instead of opening and parsing a text file.
+
+Files in a store directory:
+    * x.f8, y.f8 - Little-endian float64 coordinates, or
+    * x.i4, y.i4 - Little-endian int32 fixed point coordinates, if the store
+        was written with a precision.
+    * flags.u8 - Little-endian uint64 flag bitmasks, FLAG_WORDS per point.
+    * index.json - The format version, the coordinate precision, the flag
+        vocabulary and, for each provider, a mapping of species name to
+        [offset, count] of its points.
+
+The points of one species and provider are always contiguous.
+
+The download scripts add points to a store directly with an appending
+OccurrenceStoreWriter.  convert_directory_tree carries species CSV files
+written before the store existed over to a store.
+"""
+import json
+import os
+
+import numpy as np
+
+from .occurrence_flags import get_flag_vocabulary
+from .point_batch import (
+    FLAG_WORDS, FlagVocabulary, PointBatch, remap_flags)
+
+X_FILENAME = 'x.f8'
+Y_FILENAME = 'y.f8'
+FIXED_POINT_X_FILENAME = 'x.i4'
+FIXED_POINT_Y_FILENAME = 'y.i4'
+FLAGS_FILENAME = 'flags.u8'
+INDEX_FILENAME = 'index.json'
+STORE_VERSION = 2
+
+COORDINATE_DTYPE = np.dtype('<f8')
+FIXED_POINT_DTYPE = np.dtype('<i4')
+FLAG_DTYPE = np.dtype('<u8')
+
+
+# .............................................................................
+def get_coordinate_files(precision=None):
+    """Get the x and y file names and data type for a coordinate precision."""
+    if precision is None:
+        return X_FILENAME, Y_FILENAME, COORDINATE_DTYPE
+    return FIXED_POINT_X_FILENAME, FIXED_POINT_Y_FILENAME, FIXED_POINT_DTYPE
+
+
+# .............................................................................
+def get_species_from_tree(base_dir, service_suffix):
+    """Get the species names with a data file in a genus directory tree.
+
+    Args:
+        base_dir (str): The base directory containing genus directories.
+        service_suffix (str): The file name suffix for the provider, such as
+            '_gbif.csv'.
+
+    Returns:
+        list of str - The sorted species names.
+    """
+    species_names = []
+    for genus in sorted(os.listdir(base_dir)):
+        genus_dir = os.path.join(base_dir, genus)
+        if not os.path.isdir(genus_dir):
+            continue
+        for filename in sorted(os.listdir(genus_dir)):
+            if filename.endswith(service_suffix):
+                species_names.append(filename[:-len(service_suffix)])
+    return species_names
+
+
+# .............................................................................
+def convert_directory_tree(base_dir, store_dir, readers, precision=None):
+    """Convert a directory of per-species CSV files to an occurrence store.
+
+    This is for existing data, new downloads are written to a store directly.
+
+    Args:
+        base_dir (str): The base directory containing genus directories.
+        store_dir (str): The directory to write the store to.
+        readers (dict): A dictionary of provider name to a tuple of (service
+            suffix, reader function).  Reader functions take (base_dir,
+            species, flag_vocabulary) and return a PointBatch, such as
+            occurrence_pipeline.get_gbif_points.
+        precision (int): If provided, store fixed point coordinates with this
+            many decimal places.
+
+    Returns:
+        OccurrenceStore - The new store, opened for reading.
+    """
+    with OccurrenceStoreWriter(store_dir, precision=precision) as writer:
+        for provider, (service_suffix, reader) in readers.items():
+            for species in get_species_from_tree(base_dir, service_suffix):
+                writer.add_species(
+                    provider, species,
+                    reader(base_dir, species, writer.flag_vocabulary))
+    return OccurrenceStore(store_dir)
+
+
+# .............................................................................
+class OccurrenceStoreWriter:
+    """This class writes point batches to a new occurrence store."""
+    # ..........................
+    def __init__(self, store_dir, precision=None, append=False):
+        """Constructor.
+
+        Args:
+            store_dir (str): The directory to write the store to.  Existing
+                store files there are replaced unless appending.
+            precision (int): If provided, store fixed point coordinates with
+                this many decimal places.
+            append (bool): If True and a store exists in store_dir, add to it
+                instead, keeping its coordinate precision.  This lets each
+                provider download be added to the same store.
+
+        Raises:
+            ValueError: Raised if appending to a store written in a different
+                store format version.
+        """
+        self.store_dir = store_dir
+        self.precision = precision
+        self.flag_vocabulary = get_flag_vocabulary()
+        self.species_offsets = {}
+        self.num_points = 0
+        if not os.path.exists(store_dir):
+            os.makedirs(store_dir)
+        elif append and os.path.exists(
+                os.path.join(store_dir, INDEX_FILENAME)):
+            store = OccurrenceStore(store_dir)
+            self.precision = store.precision
+            self.flag_vocabulary = store.flag_vocabulary
+            self.species_offsets = store.species_offsets
+            self.num_points = store.num_points
+            # Release the column maps before the files are truncated
+            del store
+        x_filename, y_filename, self._coordinate_dtype = \
+            get_coordinate_files(self.precision)
+        self._x_file = self._open_column(
+            x_filename, self._coordinate_dtype.itemsize)
+        self._y_file = self._open_column(
+            y_filename, self._coordinate_dtype.itemsize)
+        self._flags_file = self._open_column(
+            FLAGS_FILENAME, FLAG_DTYPE.itemsize * FLAG_WORDS)
+
+    # ..........................
+    def _open_column(self, filename, point_size):
+        """Open a column file to add points after those already stored."""
+        col_file = open(os.path.join(self.store_dir, filename), 'ab')
+        # Drop anything written after the index was last saved
+        col_file.truncate(self.num_points * point_size)
+        return col_file
+
+    # ..........................
+    def __enter__(self):
+        return self
+
+    # ..........................
+    def __exit__(self, *args):
+        self.close()
+
+    # ..........................
+    def add_species(self, provider, species, batch):
+        """Add the points of a species from one provider.
+
+        Args:
+            provider (str): The data provider, such as 'gbif'.
+            species (str): The species name to store the points under.
+            batch (PointBatch): The points of the species.
+
+        Raises:
+            ValueError: Raised if the species was already added for the
+                provider.
+        """
+        provider_offsets = self.species_offsets.setdefault(provider, {})
+        if species in provider_offsets:
+            raise ValueError(
+                '{} points were already added for {}'.format(
+                    provider, species))
+        if len(batch) == 0:
+            return
+        batch = batch.with_precision(self.precision)
+        flags = remap_flags(
+            batch.flags, batch.flag_vocabulary, self.flag_vocabulary)
+        self._x_file.write(batch.x.astype(self._coordinate_dtype).tobytes())
+        self._y_file.write(batch.y.astype(self._coordinate_dtype).tobytes())
+        self._flags_file.write(flags.astype(FLAG_DTYPE).tobytes())
+        provider_offsets[species] = [self.num_points, len(batch)]
+        self.num_points += len(batch)
+
+    # ..........................
+    def close(self):
+        """Close the column files and write the index."""
+        if self._x_file is None:
+            return
+        for col_file in (self._x_file, self._y_file, self._flags_file):
+            col_file.close()
+        self._x_file = self._y_file = self._flags_file = None
+        with open(os.path.join(self.store_dir, INDEX_FILENAME), 'w') as idx_out:
+            json.dump(
+                {
+                    'version': STORE_VERSION,
+                    'num_points': self.num_points,
+                    'precision': self.precision,
+                    'flags': self.flag_vocabulary.flags,
+                    'species': self.species_offsets
+                }, idx_out)
+
+
+# .............................................................................
+class OccurrenceStore:
+    """This class reads species points from an occurrence store."""
+    # ..........................
+    def __init__(self, store_dir):
+        """Constructor.
+
+        Args:
+            store_dir (str): The directory containing the store files.
+
+        Raises:
+            ValueError: Raised if the store was written in a different store
+                format version.
+        """
+        self.store_dir = store_dir
+        with open(os.path.join(store_dir, INDEX_FILENAME)) as idx_in:
+            index = json.load(idx_in)
+        version = index.get('version')
+        if version != STORE_VERSION:
+            raise ValueError(
+                'Occurrence store {} has format version {}, expected {}.  '
+                'Convert the species files to a new store.'.format(
+                    store_dir, version, STORE_VERSION))
+        self.num_points = index['num_points']
+        self.precision = index['precision']
+        self.flag_vocabulary = FlagVocabulary(index['flags'])
+        self.species_offsets = index['species']
+        x_filename, y_filename, coordinate_dtype = get_coordinate_files(
+            self.precision)
+        self.x = self._map_column(x_filename, coordinate_dtype)
+        self.y = self._map_column(y_filename, coordinate_dtype)
+        self.flags = self._map_column(
+            FLAGS_FILENAME, FLAG_DTYPE, shape=(self.num_points, FLAG_WORDS))
+
+    # ..........................
+    def _map_column(self, filename, dtype, shape=None):
+        """Memory map the indexed points of a column file."""
+        if shape is None:
+            shape = (self.num_points, )
+        # Zero length files cannot be memory mapped
+        if self.num_points == 0:
+            return np.zeros(shape, dtype=dtype)
+        # Points written after the index was saved are left out
+        return np.memmap(
+            os.path.join(self.store_dir, filename), dtype=dtype, mode='r',
+            shape=shape)
+
+    # ..........................
+    def get_species(self, provider):
+        """Get the species names stored for a provider."""
+        return list(self.species_offsets.get(provider, {}).keys())
+
+    # ..........................
+    def get_points(self, provider, species, flag_vocabulary=None):
+        """Get the points for a species from one provider.
+
+        Args:
+            provider (str): The data provider, such as 'gbif'.
+            species (str): The species name.
+            flag_vocabulary (FlagVocabulary): The vocabulary to assign flag
+                bits with.  Defaults to the store vocabulary.
+
+        Returns:
+            PointBatch - The points, empty if the species is not stored, with
+                the coordinate precision of the store.
+        """
+        if flag_vocabulary is None:
+            flag_vocabulary = self.flag_vocabulary
+        try:
+            offset, count = self.species_offsets[provider][species]
+        except KeyError:
+            return PointBatch.empty(
+                flag_vocabulary=flag_vocabulary, precision=self.precision)
+        flags = remap_flags(
+            np.array(self.flags[offset:offset + count]), self.flag_vocabulary,
+            flag_vocabulary)
+        return PointBatch(
+            [species], np.zeros(count, dtype=np.int32),
+            np.array(self.x[offset:offset + count]),
+            np.array(self.y[offset:offset + count]), flags,
+            flag_vocabulary=flag_vocabulary, precision=self.precision)
@@ -0,0 +1,475 @@
+"""Module containing a columnar representation of a collection of points.
+
+A point batch stores the points of one (or a few) species as parallel NumPy
+arrays so that filters can be evaluated for every point at once instead of
+calling a Python function per point.
+
+Columns:
+    * species_ids - Integer ids indexing into species_names.
+    * x, y - Float coordinates, or int32 fixed point coordinates counting
+        units of 10 ** -precision degrees if the batch has a precision.
+    * flags - A (num_points, FLAG_WORDS) uint64 bitmask, bits are assigned by a
+        FlagVocabulary.
+
+Species names and flag values are interned: each distinct value is stored
+once in a vocabulary and points only hold integer ids or bits, so large point
+collections do not carry a copy of the same strings for every point.  Names
+and flags are only turned back into strings when points are written.
+"""
+from array import array
+from collections import namedtuple
+import threading
+
+import numpy as np
+
+FLAG_WORDS = 4
+MAX_FLAGS = FLAG_WORDS * 64
+FIXED_POINT_DTYPE = np.int32
+# 180 degrees at 7 decimal places still fits in an int32
+MAX_PRECISION = 7
+
+Point = namedtuple('Point', 'species_name, x, y, flags')
+
+
+# .............................................................................
+class FlagVocabulary:
+    """This class maps flag values to bit positions in a flag bitmask."""
+    # ..........................
+    def __init__(self, flags=None):
+        """Constructor.
+
+        Args:
+            flags (list of str): Optional flag values to assign bits to first.
+        """
+        self.bits = {}
+        self.flags = []
+        self._lock = threading.Lock()
+        if flags:
+            for flag in flags:
+                self.get_bit(flag)
+
+    # ..........................
+    def __len__(self):
+        return len(self.flags)
+
+    # ..........................
+    def __getstate__(self):
+        """Get the state to pickle, locks cannot be pickled."""
+        state = self.__dict__.copy()
+        del state['_lock']
+        return state
+
+    # ..........................
+    def __setstate__(self, state):
+        """Restore a pickled vocabulary with a new lock."""
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    # ..........................
+    def get_bit(self, flag):
+        """Get the bit position for a flag, assigning one if necessary.
+
+        Args:
+            flag (str): The flag value to look up.
+
+        Raises:
+            ValueError: Raised if the vocabulary has no bits left.
+        """
+        try:
+            return self.bits[flag]
+        except KeyError:
+            with self._lock:
+                if flag not in self.bits:
+                    if len(self.flags) >= MAX_FLAGS:
+                        raise ValueError(
+                            'Flag vocabulary is full, cannot add {}'.format(
+                                flag))
+                    self.bits[flag] = len(self.flags)
+                    self.flags.append(flag)
+                return self.bits[flag]
+
+    # ..........................
+    def encode(self, flags):
+        """Encode flag values as a bitmask row.
+
+        Args:
+            flags (list or str): The flag value(s) for a point.
+
+        Returns:
+            list of int - FLAG_WORDS integers making up the bitmask.
+        """
+        words = [0] * FLAG_WORDS
+        if not isinstance(flags, (list, tuple)):
+            flags = [flags]
+        for flag in flags:
+            if flag:
+                bit = self.get_bit(flag)
+                words[bit // 64] |= 1 << (bit % 64)
+        return words
+
+    # ..........................
+    def decode(self, words):
+        """Decode a bitmask row back into a list of flag values."""
+        flags = []
+        for word_idx, word in enumerate(words):
+            word = int(word)
+            while word:
+                low_bit = word & -word
+                flags.append(
+                    self.flags[word_idx * 64 + low_bit.bit_length() - 1])
+                word ^= low_bit
+        return flags
+
+    # ..........................
+    def get_mask(self, flags):
+        """Get a bitmask array with the bits for all of the flags set."""
+        return np.array(self.encode(list(flags or [])), dtype=np.uint64)
+
+
+# .............................................................................
+class SpeciesVocabulary:
+    """This class maps species names to integer ids."""
+    # ..........................
+    def __init__(self, names=None):
+        """Constructor.
+
+        Args:
+            names (list of str): Optional species names to assign ids to first.
+        """
+        self.ids = {}
+        self.names = []
+        if names:
+            for name in names:
+                self.get_id(name)
+
+    # ..........................
+    def __len__(self):
+        return len(self.names)
+
+    # ..........................
+    def get_id(self, name):
+        """Get the id for a species name, assigning one if necessary."""
+        try:
+            return self.ids[name]
+        except KeyError:
+            self.ids[name] = len(self.names)
+            self.names.append(name)
+            return self.ids[name]
+
+    # ..........................
+    def get_ranks(self):
+        """Get the position of each id when the names are sorted.
+
+        Returns:
+            numpy.ndarray - An array, indexed by id, of sorted name positions.
+        """
+        ranks = np.empty(len(self.names), dtype=np.int32)
+        ranks[sorted(range(len(self.names)), key=self.names.__getitem__)] = \
+            np.arange(len(self.names), dtype=np.int32)
+        return ranks
+
+
+# .............................................................................
+def remap_flags(flags, from_vocabulary, to_vocabulary):
+    """Convert a flag bitmask array from one vocabulary to another.
+
+    Args:
+        flags (numpy.ndarray): A (num_points, FLAG_WORDS) bitmask array.
+        from_vocabulary (FlagVocabulary): The vocabulary the bits were
+            assigned by.
+        to_vocabulary (FlagVocabulary): The vocabulary to assign bits with.
+
+    Returns:
+        numpy.ndarray - The bitmask array using to_vocabulary bits.
+    """
+    if from_vocabulary is to_vocabulary or len(flags) == 0:
+        return flags
+    # Vocabularies sharing the fixed flags usually assign identical bits
+    if to_vocabulary.flags[:len(from_vocabulary)] == from_vocabulary.flags:
+        return flags
+    # Points share a few distinct flag combinations, so remap each once
+    rows, inverse = np.unique(flags, axis=0, return_inverse=True)
+    new_rows = np.array(
+        [to_vocabulary.encode(from_vocabulary.decode(row)) for row in rows],
+        dtype=np.uint64)
+    return new_rows[inverse.reshape(-1)]
+
+
+# .............................................................................
+def to_fixed_point(values, precision):
+    """Convert coordinates in degrees to fixed point integers.
+
+    Args:
+        values (array-like): The coordinates in degrees.
+        precision (int): The number of decimal places to keep.
+
+    Returns:
+        numpy.ndarray - The coordinates as int32 units of 10 ** -precision
+            degrees.  NaN and values too large to represent are clipped to
+            the int32 limits, outside of any valid bounding box.
+
+    Raises:
+        ValueError: Raised if the precision is out of range.
+    """
+    if not 0 <= precision <= MAX_PRECISION:
+        raise ValueError(
+            'Precision must be from 0 to {}, not {}'.format(
+                MAX_PRECISION, precision))
+    limits = np.iinfo(FIXED_POINT_DTYPE)
+    scaled = np.rint(np.asarray(values, dtype=np.float64) * 10.0 ** precision)
+    scaled = np.nan_to_num(scaled, nan=limits.min)
+    return np.clip(scaled, limits.min, limits.max).astype(FIXED_POINT_DTYPE)
+
+
+# .............................................................................
+def from_fixed_point(values, precision):
+    """Convert fixed point integer coordinates back to degrees."""
+    return np.asarray(values, dtype=np.float64) / 10.0 ** precision
+
+
+# .............................................................................
+class PointBatch:
+    """This class holds a collection of points as columns."""
+    # ..........................
+    def __init__(self, species_names, species_ids, x, y, flags=None,
+                 flag_vocabulary=None, precision=None):
+        """Constructor.
+
+        Args:
+            species_names (list of str): The species names referenced by
+                species_ids.
+            species_ids (array-like): The species name index of each point.
+            x (array-like): The x coordinate of each point.
+            y (array-like): The y coordinate of each point.
+            flags (array-like): A (num_points, FLAG_WORDS) bitmask array.
+            flag_vocabulary (FlagVocabulary): The vocabulary used to assign
+                the flag bits.
+            precision (int): If provided, x and y are fixed point values from
+                to_fixed_point with this many decimal places.
+        """
+        self.species_names = list(species_names)
+        self.species_ids = np.asarray(species_ids, dtype=np.int32)
+        self.precision = precision
+        coordinate_dtype = np.float64
+        if precision is not None:
+            coordinate_dtype = FIXED_POINT_DTYPE
+        self.x = np.asarray(x, dtype=coordinate_dtype)
+        self.y = np.asarray(y, dtype=coordinate_dtype)
+        if flags is None:
+            flags = np.zeros((len(self.x), FLAG_WORDS), dtype=np.uint64)
+        self.flags = np.asarray(flags, dtype=np.uint64).reshape(
+            (len(self.x), FLAG_WORDS))
+        self.flag_vocabulary = flag_vocabulary
+
+    # ..........................
+    def __len__(self):
+        return len(self.x)
+
+    # ..........................
+    @classmethod
+    def empty(cls, flag_vocabulary=None, precision=None):
+        """Get an empty point batch."""
+        return cls(
+            [], [], [], [], flag_vocabulary=flag_vocabulary,
+            precision=precision)
+
+    # ..........................
+    @classmethod
+    def from_points(cls, points, flag_vocabulary=None):
+        """Create a point batch from an iterable of point objects.
+
+        Args:
+            points (iterable): Objects with species_name, x, y, and flags
+                attributes.
+            flag_vocabulary (FlagVocabulary): The vocabulary to use for flags.
+        """
+        builder = PointBatchBuilder(flag_vocabulary=flag_vocabulary)
+        for point in points:
+            builder.add_point(
+                point.species_name, point.x, point.y,
+                getattr(point, 'flags', None))
+        return builder.build()
+
+    # ..........................
+    @classmethod
+    def concatenate(cls, batches, flag_vocabulary=None, precision=None):
+        """Concatenate point batches, merging their species names.
+
+        Args:
+            batches (list of PointBatch): The batches to concatenate.  All
+                batches with flags must share a flag vocabulary.
+            flag_vocabulary (FlagVocabulary): The vocabulary for an empty
+                result.
+            precision (int): The coordinate precision of the result, see
+                with_precision.  Defaults to float coordinates.
+        """
+        batches = [
+            batch.with_precision(precision) for batch in batches
+            if batch is not None]
+        for batch in batches:
+            if flag_vocabulary is None:
+                flag_vocabulary = batch.flag_vocabulary
+        if not batches:
+            return cls.empty(
+                flag_vocabulary=flag_vocabulary, precision=precision)
+        species_vocabulary = SpeciesVocabulary()
+        species_ids = []
+        for batch in batches:
+            remap = np.array(
+                [species_vocabulary.get_id(name)
+                 for name in batch.species_names], dtype=np.int32)
+            species_ids.append(remap[batch.species_ids])
+        return cls(
+            species_vocabulary.names, np.concatenate(species_ids),
+            np.concatenate([batch.x for batch in batches]),
+            np.concatenate([batch.y for batch in batches]),
+            np.concatenate([batch.flags for batch in batches]),
+            flag_vocabulary=flag_vocabulary, precision=precision)
+
+    # ..........................
+    def subset(self, mask):
+        """Get a new batch containing the points selected by mask."""
+        return PointBatch(
+            self.species_names, self.species_ids[mask], self.x[mask],
+            self.y[mask], self.flags[mask],
+            flag_vocabulary=self.flag_vocabulary, precision=self.precision)
+
+    # ..........................
+    def get_coordinates(self):
+        """Get the x and y coordinates of the points in degrees."""
+        if self.precision is None:
+            return self.x, self.y
+        return (
+            from_fixed_point(self.x, self.precision),
+            from_fixed_point(self.y, self.precision))
+
+    # ..........................
+    def with_precision(self, precision):
+        """Get the batch with float or fixed point coordinates.
+
+        Args:
+            precision (int): The number of decimal places for fixed point
+                coordinates, or None for float coordinates.
+
+        Returns:
+            PointBatch - This batch if it already has the precision, otherwise
+                a new batch with converted coordinates.
+        """
+        if precision == self.precision:
+            return self
+        x, y = self.get_coordinates()
+        if precision is not None:
+            x = to_fixed_point(x, precision)
+            y = to_fixed_point(y, precision)
+        return PointBatch(
+            self.species_names, self.species_ids, x, y, self.flags,
+            flag_vocabulary=self.flag_vocabulary, precision=precision)
+
+    # ..........................
+    def sort_by_species(self):
+        """Get a new batch with the points stably sorted by species name."""
+        ranks = SpeciesVocabulary(self.species_names).get_ranks()
+        return self.subset(
+            np.argsort(ranks[self.species_ids], kind='stable'))
+
+    # ..........................
+    def iter_points(self):
+        """Iterate over the points in the batch as Point objects.
+
+        Points with the same flags share one decoded flag list, which should
+        not be modified.
+        """
+        if self.flag_vocabulary is not None and len(self) > 0:
+            # Decode each distinct bitmask row once
+            rows, inverse = np.unique(
+                self.flags, axis=0, return_inverse=True)
+            flag_lists = [self.flag_vocabulary.decode(row) for row in rows]
+            flag_ids = inverse.reshape(-1).tolist()
+        else:
+            flag_lists = [[]]
+            flag_ids = [0] * len(self)
+        names = self.species_names
+        xs, ys = self.get_coordinates()
+        for sp_id, x, y, flag_id in zip(
+                self.species_ids.tolist(), xs.tolist(), ys.tolist(),
+                flag_ids):
+            yield Point(names[sp_id], x, y, flag_lists[flag_id])
+
+    # ..........................
+    def write_csv(self, out_file):
+        """Write species name, x, y lines for each point to an open file.
+
+        Fixed point coordinates are written with exactly precision decimal
+        places.
+        """
+        names = self.species_names
+        line_format = '{}, {}, {}\n'
+        if self.precision is not None:
+            line_format = '{{}}, {{:.{0}f}}, {{:.{0}f}}\n'.format(
+                self.precision)
+        xs, ys = self.get_coordinates()
+        for sp_id, x, y in zip(
+                self.species_ids.tolist(), xs.tolist(), ys.tolist()):
+            out_file.write(line_format.format(names[sp_id], x, y))
+
+
+# .............................................................................
+class PointBatchBuilder:
+    """This class accumulates points one at a time and builds a batch."""
+    # ..........................
+    def __init__(self, flag_vocabulary=None):
+        """Constructor.
+
+        Args:
+            flag_vocabulary (FlagVocabulary): The vocabulary to use for flags.
+                If None, flags are dropped.
+        """
+        self.flag_vocabulary = flag_vocabulary
+        self.species_vocabulary = SpeciesVocabulary()
+        # Compact typed arrays instead of lists of Python objects
+        self.species_ids = array('i')
+        self.x = array('d')
+        self.y = array('d')
+        self.flags = array('Q')
+        # Points repeat a few distinct flag values, so encode each once
+        self._flag_words = {}
+
+    # ..........................
+    def __len__(self):
+        return len(self.x)
+
+    # ..........................
+    def add_point(self, species_name, x, y, flags=None):
+        """Add a point to the batch being built.
+
+        Args:
+            species_name (str): The species name of the point.
+            x (float): The x coordinate of the point.
+            y (float): The y coordinate of the point.
+            flags (list or str): The flag value(s) of the point.
+        """
+        if self.flag_vocabulary is not None:
+            if isinstance(flags, list):
+                flags = tuple(flags)
+            try:
+                words = self._flag_words[flags]
+            except KeyError:
+                words = self.flag_vocabulary.encode(flags)
+                self._flag_words[flags] = words
+            self.flags.extend(words)
+        self.species_ids.append(self.species_vocabulary.get_id(species_name))
+        self.x.append(x)
+        self.y.append(y)
+
+    # ..........................
+    def build(self):
+        """Build a PointBatch from the points added so far."""
+        flags = None
+        if self.flag_vocabulary is not None and self.flags:
+            flags = np.array(self.flags, dtype=np.uint64)
+        return PointBatch(
+            self.species_vocabulary.names,
+            np.array(self.species_ids, dtype=np.int32),
+            np.array(self.x, dtype=np.float64),
+            np.array(self.y, dtype=np.float64), flags=flags,
+            flag_vocabulary=self.flag_vocabulary)
@@ -0,0 +1,151 @@
+"""Module containing point in polygon tests on coordinate arrays.
+
+Polygons are converted once into an array of edges so that points can be
+tested with NumPy arithmetic instead of creating an OGR point geometry for
+each test.  The even-odd rule is applied across every edge of every ring, so
+holes and multi-part polygons are handled without tracking which ring an edge
+came from.
+
+Edge array columns: x0, y0, y1, and dx/dy of each non-horizontal edge.
+"""
+import numpy as np
+
+# Limit the (points x edges) temporary arrays for batch tests
+MAX_BLOCK_CELLS = 1000000
+
+
+# .............................................................................
+def get_geometry_rings(geom):
+    """Get the polygon rings of an OGR geometry as coordinate arrays.
+
+    Args:
+        geom (ogr.Geometry): A polygon, multipolygon, or geometry collection.
+            Points and lines have no area and are skipped.
+
+    Returns:
+        list of numpy.ndarray - A (num_vertices, 2) array for each ring.
+    """
+    rings = []
+    geom_name = geom.GetGeometryName()
+    if geom_name == 'POLYGON':
+        for i in range(geom.GetGeometryCount()):
+            points = geom.GetGeometryRef(i).GetPoints()
+            if points:
+                rings.append(np.array(points, dtype=np.float64)[:, :2])
+    elif geom_name in ('MULTIPOLYGON', 'GEOMETRYCOLLECTION'):
+        for i in range(geom.GetGeometryCount()):
+            rings.extend(get_geometry_rings(geom.GetGeometryRef(i)))
+    return rings
+
+
+# .............................................................................
+def get_ring_edges(rings):
+    """Get the edge array for a list of coordinate rings.
+
+    Args:
+        rings (list of numpy.ndarray): (num_vertices, 2) coordinate arrays.
+
+    Returns:
+        numpy.ndarray - A (num_edges, 4) array of x0, y0, y1, dx/dy.
+    """
+    edge_arrays = [np.zeros((0, 4), dtype=np.float64)]
+    for ring in rings:
+        if len(ring) < 3:
+            continue
+        if not np.array_equal(ring[0], ring[-1]):
+            ring = np.vstack((ring, ring[:1]))
+        x0, y0 = ring[:-1, 0], ring[:-1, 1]
+        x1, y1 = ring[1:, 0], ring[1:, 1]
+        # Horizontal edges can never be crossed by the horizontal ray
+        keep = y0 != y1
+        x0, y0, x1, y1 = x0[keep], y0[keep], x1[keep], y1[keep]
+        edge_arrays.append(
+            np.column_stack((x0, y0, y1, (x1 - x0) / (y1 - y0))))
+    return np.concatenate(edge_arrays)
+
+
+# .............................................................................
+def get_packed_ring_edges(coords, ring_offsets):
+    """Get the edge arrays of closed rings packed into one coordinate array.
+
+    Args:
+        coords (numpy.ndarray): A (num_vertices, 2) array of the vertices of
+            every ring, each ring closed and with at least 4 vertices.
+        ring_offsets (numpy.ndarray): The first vertex of each ring followed
+            by the number of vertices.
+
+    Returns:
+        tuple - (edges, edge_offsets), the edge array of every ring in order,
+            as from get_ring_edges, and the first edge of each ring followed
+            by the number of edges.
+    """
+    num_rings = len(ring_offsets) - 1
+    ring_sizes = np.diff(ring_offsets)
+    # Each vertex starts an edge to the next, except the last of each ring
+    starts = np.ones(len(coords), dtype=bool)
+    starts[ring_offsets[1:][ring_sizes > 0] - 1] = False
+    edge_rings = np.repeat(np.arange(num_rings), ring_sizes)[starts]
+    x0, y0 = coords[:-1, 0][starts[:-1]], coords[:-1, 1][starts[:-1]]
+    x1, y1 = coords[1:, 0][starts[:-1]], coords[1:, 1][starts[:-1]]
+    # Horizontal edges can never be crossed by the horizontal ray
+    keep = y0 != y1
+    x0, y0, x1, y1 = x0[keep], y0[keep], x1[keep], y1[keep]
+    edge_offsets = np.zeros(num_rings + 1, dtype=np.int64)
+    np.cumsum(
+        np.bincount(edge_rings[keep], minlength=num_rings),
+        out=edge_offsets[1:])
+    return (
+        np.column_stack((x0, y0, y1, (x1 - x0) / (y1 - y0))), edge_offsets)
+
+
+# .............................................................................
+def get_geometry_edges(geom):
+    """Get the edge array for an OGR geometry."""
+    return get_ring_edges(get_geometry_rings(geom))
+
+
+# .............................................................................
+def point_in_polygon_edges(x, y, edges):
+    """Test if a single point is inside the polygon described by edges.
+
+    Args:
+        x (float): The x coordinate of the point.
+        y (float): The y coordinate of the point.
+        edges (numpy.ndarray): An edge array from get_ring_edges.
+
+    Returns:
+        bool - True if the point is inside.
+    """
+    y0 = edges[:, 1]
+    spans = (y0 > y) != (edges[:, 2] > y)
+    x_cross = edges[spans, 0] + (y - y0[spans]) * edges[spans, 3]
+    return bool(np.count_nonzero(x < x_cross) % 2)
+
+
+# .............................................................................
+def points_in_polygon_edges(xs, ys, edges):
+    """Test which points are inside the polygon described by edges.
+
+    Args:
+        xs (numpy.ndarray): The x coordinates of the points.
+        ys (numpy.ndarray): The y coordinates of the points.
+        edges (numpy.ndarray): An edge array from get_ring_edges.
+
+    Returns:
+        numpy.ndarray - A boolean array, True for points inside.
+    """
+    xs = np.asarray(xs, dtype=np.float64)
+    ys = np.asarray(ys, dtype=np.float64)
+    inside = np.zeros(len(xs), dtype=bool)
+    if len(edges) == 0:
+        return inside
+    x0, y0, y1, dxdy = (edges[:, i] for i in range(4))
+    block_size = max(1, MAX_BLOCK_CELLS // len(edges))
+    for start in range(0, len(xs), block_size):
+        block_xs = xs[start:start + block_size, np.newaxis]
+        block_ys = ys[start:start + block_size, np.newaxis]
+        spans = (y0 > block_ys) != (y1 > block_ys)
+        x_cross = x0 + (block_ys - y0) * dxdy
+        crossings = np.count_nonzero(spans & (block_xs < x_cross), axis=1)
+        inside[start:start + block_size] = crossings % 2 == 1
+    return inside
@@ -0,0 +1,128 @@
+"""Module containing a point reader for compressed occurrence files.
+
+ArchivePointCsvReader has the interface of lmpy's PointCsvReader, yielding
+lists of consecutive points with the same species, but reads through
+common.archive_io so zip and gzip files are read as streams.
+"""
+import csv
+import json
+
+from lmpy import Point
+from lmpy.point import PointCsvReader
+
+from tools.common.archive_io import is_archive, open_text
+
+
+# .............................................................................
+def get_point_reader(filename, species_field, x_field, y_field,
+                     geopoint=None, member=None):
+    """Get a point reader for a plain or compressed CSV file.
+
+    Args:
+        filename (str): The file location to read.
+        species_field (str): The field containing the species name.
+        x_field (str): The field (or geopoint key) containing x.
+        y_field (str): The field (or geopoint key) containing y.
+        geopoint (str): A field containing a JSON object with x and y.
+        member (str): The member to read from a zip archive.
+
+    Returns:
+        PointCsvReader or ArchivePointCsvReader - An unopened reader.
+    """
+    if is_archive(filename):
+        return ArchivePointCsvReader(
+            filename, species_field, x_field, y_field, geopoint=geopoint,
+            member=member)
+    return PointCsvReader(
+        filename, species_field, x_field, y_field, geopoint=geopoint)
+
+
+# .............................................................................
+class ArchivePointCsvReader:
+    """This class reads groups of points from a compressed CSV file."""
+    # ..........................
+    def __init__(self, filename, species_field, x_field, y_field,
+                 geopoint=None, member=None):
+        """Constructor.
+
+        Args:
+            filename (str): The file location to read.
+            species_field (str): The field containing the species name.
+            x_field (str): The field (or geopoint key) containing x.
+            y_field (str): The field (or geopoint key) containing y.
+            geopoint (str): A field containing a JSON object with x and y.
+            member (str): The member to read from a zip archive.
+        """
+        self.filename = filename
+        self.species_field = species_field
+        self.x_field = x_field
+        self.y_field = y_field
+        self.geopoint = geopoint
+        self.member = member
+        self.file = None
+        self.reader = None
+        self._next_point = None
+
+    # ..........................
+    def __enter__(self):
+        self.open()
+        return self
+
+    # ..........................
+    def __exit__(self, *args):
+        self.close()
+
+    # ..........................
+    def __iter__(self):
+        return self
+
+    # ..........................
+    def __next__(self):
+        """Get the next list of consecutive points with the same species."""
+        points = []
+        if self._next_point is not None:
+            points.append(self._next_point)
+            self._next_point = None
+        for point in self._iter_points():
+            if points and point.species_name != points[0].species_name:
+                self._next_point = point
+                return points
+            points.append(point)
+        if points:
+            return points
+        raise StopIteration
+
+    # ..........................
+    def _iter_points(self):
+        """Read points from the file, skipping rows without coordinates."""
+        for row in self.reader:
+            try:
+                if self.geopoint is not None:
+                    coordinates = json.loads(row[self.geopoint])
+                else:
+                    coordinates = row
+                yield Point(
+                    row[self.species_field],
+                    float(coordinates[self.x_field]),
+                    float(coordinates[self.y_field]), row)
+            except (KeyError, TypeError, ValueError):
+                pass
+
+    # ..........................
+    def open(self):
+        """Open the file, detecting the delimiter from the header."""
+        self.file = open_text(
+            self.filename, member=self.member, read_ahead=True)
+        header = self.file.readline()
+        dialect = csv.Sniffer().sniff(header, delimiters='\t,')
+        fieldnames = next(csv.reader([header], dialect=dialect))
+        self.reader = csv.DictReader(
+            self.file, fieldnames=fieldnames, dialect=dialect)
+
+    # ..........................
+    def close(self):
+        """Close the file."""
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+            self.reader = None
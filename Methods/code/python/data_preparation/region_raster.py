@@ -0,0 +1,285 @@
+"""Module containing a rasterized lookup of TDWG regions.
+
+The quadtree cells of a region index are burned into a global grid once.
+Each grid cell holds the id of the single region that completely covers it,
+NO_REGION if no region touches it, or BOUNDARY if it is only partly covered or
+covered by more than one region.  Looking up a point is then an array index,
+and only points in BOUNDARY cells are tested exactly against the region
+index.
+"""
+import json
+
+import numpy as np
+
+NO_REGION = -1
+BOUNDARY = -2
+# Version 2 marks the grid cells starting on the max edges of quadtree cells
+RASTER_VERSION = 2
+DEFAULT_RESOLUTION = 0.1
+WORLD_EXTENT = (-180.0, -90.0, 180.0, 90.0)
+# Level 3 and 4 regions are small enough that most grid cells fall inside one
+RASTER_LEVELS = (3, 4)
+
+
+# .............................................................................
+def get_region_raster_filename(base_filename, level):
+    """Get the raster file location that goes with a saved region index."""
+    return '{}_level{}.npz'.format(base_filename, level)
+
+
+# .............................................................................
+def get_region_raster(region_index, level, filename=None,
+                      resolution=DEFAULT_RESOLUTION):
+    """Load a saved region raster, building and saving it if needed.
+
+    Args:
+        region_index (SpatialIndex): An index of TDWG regions with
+            {'level': , 'code': } attributes, see wgsrpd.get_wgsrpd_index.
+        level (int): The TDWG level to rasterize.
+        filename (str): The file location of the saved raster, or None to
+            always build it.
+        resolution (float): The grid cell size in degrees when building.
+
+    Returns:
+        RegionRaster - The raster for the level.  A missing raster, or one
+            saved in another format version, is built and saved again.
+    """
+    if filename is not None:
+        try:
+            return RegionRaster.load_from_file(filename, region_index)
+        except (IOError, ValueError):
+            pass
+    region_raster = RegionRaster(region_index, level, resolution=resolution)
+    if filename is not None:
+        region_raster.save(filename)
+    return region_raster
+
+
+# .............................................................................
+class RegionRaster:
+    """This class looks up the TDWG region for points using a grid."""
+    # ..........................
+    def __init__(self, region_index, level, resolution=DEFAULT_RESOLUTION,
+                 extent=WORLD_EXTENT, build=True):
+        """Constructor.
+
+        Args:
+            region_index (SpatialIndex): An index of TDWG regions with
+                {'level': , 'code': } attributes.  Used to build the grid and
+                for exact tests in boundary cells.
+            level (int): The TDWG level to rasterize.
+            resolution (float): The grid cell size in degrees.
+            extent (tuple): The (min_x, min_y, max_x, max_y) grid extent.
+            build (bool): Rasterize the region index now.  Set to False when
+                the grid will be filled in by load_from_file.
+        """
+        self.region_index = region_index
+        self.level = level
+        self.resolution = resolution
+        self.extent = extent
+        self.codes = []
+        self.code_ids = {}
+        num_cols = int(np.ceil((extent[2] - extent[0]) / resolution))
+        num_rows = int(np.ceil((extent[3] - extent[1]) / resolution))
+        self.grid = np.full((num_rows, num_cols), NO_REGION, dtype=np.int16)
+        if build:
+            self._build()
+
+    # ..........................
+    @classmethod
+    def load_from_file(cls, filename, region_index):
+        """Load a raster saved with save().
+
+        Args:
+            filename (str): The file location of the saved raster.
+            region_index (SpatialIndex): The region index the raster was built
+                from, used for boundary cells.
+
+        Raises:
+            ValueError: Raised if the raster was saved in a different raster
+                format version.
+        """
+        with np.load(filename) as raster_data:
+            meta = json.loads(str(raster_data['meta']))
+            version = meta.get('version')
+            if version != RASTER_VERSION:
+                raise ValueError(
+                    'Region raster {} has format version {}, expected {}.  '
+                    'Rebuild the raster from its region index.'.format(
+                        filename, version, RASTER_VERSION))
+            region_raster = cls(
+                region_index, meta['level'], resolution=meta['resolution'],
+                extent=tuple(meta['extent']), build=False)
+            region_raster.grid = raster_data['grid']
+        region_raster.codes = meta['codes']
+        region_raster.code_ids = {
+            code: i for i, code in enumerate(region_raster.codes)}
+        return region_raster
+
+    # ..........................
+    def save(self, filename):
+        """Save the raster grid and region codes to a .npz file."""
+        meta = {
+            'version': RASTER_VERSION,
+            'level': self.level,
+            'resolution': self.resolution,
+            'extent': list(self.extent),
+            'codes': self.codes
+        }
+        with open(filename, 'wb') as raster_out:
+            np.savez(raster_out, grid=self.grid, meta=json.dumps(meta))
+
+    # ..........................
+    def _get_region_id(self, code):
+        """Get the grid value for a region code, assigning one if needed."""
+        if code not in self.code_ids:
+            self.code_ids[code] = len(self.codes)
+            self.codes.append(code)
+        return self.code_ids[code]
+
+    # ..........................
+    def _get_cell_range(self, bbox):
+        """Get the grid rows and columns overlapped by and inside a bbox.
+
+        Returns:
+            tuple - ((row_0, row_1, col_0, col_1), (row_0, row_1, col_0,
+                col_1)) half-open ranges of the grid cells touching the bbox
+                and of those entirely inside it.
+        """
+        min_x, min_y, max_x, max_y = bbox
+        cols = (np.array([min_x, max_x]) - self.extent[0]) / self.resolution
+        rows = (np.array([min_y, max_y]) - self.extent[1]) / self.resolution
+        num_rows, num_cols = self.grid.shape
+
+        def clip(values, limit):
+            return [int(min(max(value, 0), limit)) for value in values]
+
+        # Grid cells are half-open, so the cells starting on the max edges
+        #    touch the closed bbox too
+        touching = clip(
+            [np.floor(rows[0]), np.floor(rows[1]) + 1], num_rows) + clip(
+                [np.floor(cols[0]), np.floor(cols[1]) + 1], num_cols)
+        inside = clip(
+            [np.ceil(rows[0]), np.floor(rows[1])], num_rows) + clip(
+                [np.ceil(cols[0]), np.floor(cols[1])], num_cols)
+        return touching, inside
+
+    # ..........................
+    def _build(self):
+        """Burn the quadtree cells of the region index into the grid."""
+        region_ids = {}
+        att_table = self.region_index.att_lookup
+        for identifier, level, code in zip(
+                att_table.identifiers, att_table.get_column('level'),
+                att_table.get_column('code')):
+            if level == self.level:
+                region_ids[identifier] = self._get_region_id(code)
+
+        for identifier, bbox, cell in self.region_index.iter_cells():
+            if identifier not in region_ids:
+                continue
+            touching, inside = self._get_cell_range(bbox)
+            t_r0, t_r1, t_c0, t_c1 = touching
+            if t_r0 >= t_r1 or t_c0 >= t_c1:
+                continue
+            boundary = np.ones((t_r1 - t_r0, t_c1 - t_c0), dtype=bool)
+            i_r0, i_r1, i_c0, i_c1 = inside
+            if cell is True and i_r0 < i_r1 and i_c0 < i_c1:
+                # Grid cells entirely inside a full quadtree cell
+                region_id = region_ids[identifier]
+                inner = self.grid[i_r0:i_r1, i_c0:i_c1]
+                inner[(inner != NO_REGION) & (inner != region_id)] = BOUNDARY
+                inner[inner == NO_REGION] = region_id
+                boundary[i_r0 - t_r0:i_r1 - t_r0, i_c0 - t_c0:i_c1 - t_c0] = \
+                    False
+            self.grid[t_r0:t_r1, t_c0:t_c1][boundary] = BOUNDARY
+
+    # ..........................
+    def get_region_ids(self, codes):
+        """Get the grid values for a collection of region codes."""
+        return np.array(
+            [self.code_ids[code] for code in codes if code in self.code_ids],
+            dtype=np.int16)
+
+    # ..........................
+    def _get_grid_values(self, xs, ys):
+        """Get the grid value of each point and the points to test exactly.
+
+        Returns:
+            tuple - (values, boundary_idxs), the grid value of each point,
+                NO_REGION for points in boundary cells, and the indices of
+                the points in boundary cells.
+        """
+        num_rows, num_cols = self.grid.shape
+        cols = np.floor((xs - self.extent[0]) / self.resolution)
+        rows = np.floor((ys - self.extent[1]) / self.resolution)
+        # Points on the max edge of the extent belong to the last cell
+        cols[xs == self.extent[2]] = num_cols - 1
+        rows[ys == self.extent[3]] = num_rows - 1
+        valid = (cols >= 0) & (cols < num_cols) & (rows >= 0) & (
+            rows < num_rows)
+        values = np.full(len(xs), NO_REGION, dtype=np.int16)
+        values[valid] = self.grid[
+            rows[valid].astype(np.intp), cols[valid].astype(np.intp)]
+        boundary_idxs = np.flatnonzero(values == BOUNDARY)
+        values[boundary_idxs] = NO_REGION
+        return values, boundary_idxs
+
+    # ..........................
+    def _iter_boundary_hits(self, xs, ys, boundary_idxs):
+        """Get the exact regions of the level for points in boundary cells.
+
+        Yields:
+            tuple - (i, region_id) for each point index and region containing
+                it.  A point on an edge shared by regions is in each of them.
+        """
+        offsets, hit_ids = self.region_index.search_many(
+            xs[boundary_idxs], ys[boundary_idxs])
+        hit_points = np.repeat(boundary_idxs, np.diff(offsets))
+        for i, identifier in zip(hit_points, hit_ids):
+            att_dict = self.region_index.att_lookup[identifier]
+            if att_dict['level'] == self.level:
+                yield i, self.code_ids[att_dict['code']]
+
+    # ..........................
+    def lookup(self, xs, ys):
+        """Get the region value for each point.
+
+        Args:
+            xs (numpy.ndarray): The x coordinates of the points.
+            ys (numpy.ndarray): The y coordinates of the points.
+
+        Returns:
+            numpy.ndarray - The region id of each point, or NO_REGION.  A
+                point on an edge shared by regions gets one of them, use
+                within to test for a set of regions.
+        """
+        xs = np.asarray(xs, dtype=np.float64)
+        ys = np.asarray(ys, dtype=np.float64)
+        values, boundary_idxs = self._get_grid_values(xs, ys)
+        for i, region_id in self._iter_boundary_hits(xs, ys, boundary_idxs):
+            values[i] = region_id
+        return values
+
+    # ..........................
+    def within(self, xs, ys, region_ids):
+        """Test which points are within any of a set of regions.
+
+        Args:
+            xs (numpy.ndarray): The x coordinates of the points.
+            ys (numpy.ndarray): The y coordinates of the points.
+            region_ids (numpy.ndarray): Region ids from get_region_ids.
+
+        Returns:
+            numpy.ndarray - A boolean array, True for points in any of the
+                regions, including points on their edges.
+        """
+        xs = np.asarray(xs, dtype=np.float64)
+        ys = np.asarray(ys, dtype=np.float64)
+        values, boundary_idxs = self._get_grid_values(xs, ys)
+        mask = np.isin(values, region_ids)
+        region_ids = set(np.asarray(region_ids).tolist())
+        for i, region_id in self._iter_boundary_hits(xs, ys, boundary_idxs):
+            if region_id in region_ids:
+                mask[i] = True
+        return mask
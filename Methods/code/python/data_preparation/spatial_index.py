@@ -1,10 +1,58 @@
 """Module containing a class for working with a spatial index.
 
-Version 1: Store geometries in memory in table.  Save as wkt.
+Features are decomposed into quadtree cells kept in packed arrays, with
+feature attributes in columns.  Cells are found with an rtree of cell numbers
+or a uniform grid, either of which is rebuilt from the cell arrays when an
+index is loaded.  Only indexes saved in the current format version are
+loaded, older indexes must be rebuilt.
+
+Files written by save():
+    * {base}.idx, {base}.dat - The disk-backed rtree of cell numbers, for the
+        rtree engine.
+    * {base}.geom - NumPy arrays of the cell bounding boxes, feature rows and
+        geometry ids, and the packed partial cell geometry rings.
+    * {base}.json - Index settings and the feature attribute table.
 """
+from collections.abc import Mapping
+import itertools
+import json
+import math
+import threading
+import time
+
+import numpy as np
 from osgeo import ogr
 import rtree
 
+from .point_in_polygon import (
+    get_geometry_rings, get_packed_ring_edges, point_in_polygon_edges,
+    points_in_polygon_edges)
+
+GEOM_EXTENSION = '.geom'
+META_EXTENSION = '.json'
+INDEX_VERSION = 6
+# The geometry id of cells entirely inside their feature
+FULL_CELL = -1
+# search_many sweeps the cells under a batch instead of querying the rtree for
+#    each point unless there are this many times more cells than points
+MAX_CELLS_PER_POINT = 8
+# Bulk loaded trees are never inserted into, so their nodes are packed fuller
+#    than the default fill factor of 0.7
+BULK_LOAD_FILL_FACTOR = 0.95
+# Quadtree settings used unless they are chosen for each feature
+DEFAULT_MIN_SIZE = 0.01
+DEFAULT_DEPTH = 10
+# Tuned quadtrees split until leaves have at most this many vertices, going
+#    this many levels deeper than the vertex count alone suggests, at most
+DEFAULT_MAX_LEAF_VERTICES = 64
+TUNED_DEPTH_MARGIN = 2
+MAX_TUNED_DEPTH = 16
+# Cells can be found with the rtree or by bucketing them on a uniform grid
+RTREE_ENGINE = 'rtree'
+GRID_ENGINE = 'grid'
+INDEX_ENGINES = (RTREE_ENGINE, GRID_ENGINE)
+DEFAULT_GRID_RESOLUTION = 1.0
+
 # .............................................................................
 def create_geometry_from_bbox(min_x, min_y, max_x, max_y):
     """Create a geometry from a bounding box."""
@@ -14,8 +62,64 @@ def create_geometry_from_bbox(min_x, min_y, max_x, max_y):
 
 
 # .............................................................................
-def quadtree_index(geom, bbox, min_size, depth_left):
-    """Use a quadtree approach to gather spatial index data."""
+def count_vertices(geom):
+    """Count the polygon ring vertices of an OGR geometry."""
+    return sum(len(ring) for ring in get_geometry_rings(geom))
+
+
+# .............................................................................
+def get_quadtree_settings(geom, max_leaf_vertices=DEFAULT_MAX_LEAF_VERTICES):
+    """Choose quadtree settings for a geometry from its vertices and area.
+
+    The depth is enough halvings of the boundary to bring leaves down to
+    max_leaf_vertices, plus a margin for unevenly spread vertices, and the
+    minimum cell size is the area of a cell of the geometry envelope at that
+    depth.
+
+    Args:
+        geom (ogr.Geometry): The geometry to be indexed.
+        max_leaf_vertices (int): The target maximum vertices per leaf.
+
+    Returns:
+        tuple - (min_size, depth_left) for quadtree_index.
+    """
+    num_vertices = count_vertices(geom)
+    depth = 0
+    if num_vertices > max_leaf_vertices:
+        depth = min(
+            MAX_TUNED_DEPTH,
+            math.ceil(math.log2(num_vertices / max_leaf_vertices)) +
+            TUNED_DEPTH_MARGIN)
+    min_x, max_x, min_y, max_y = geom.GetEnvelope()
+    return (max_x - min_x) * (max_y - min_y) / 4 ** depth, depth
+
+
+# .............................................................................
+def quadtree_index(geom, bbox, min_size, depth_left, max_vertices=None):
+    """Use a quadtree approach to gather spatial index data.
+
+    Args:
+        geom (ogr.Geometry): The geometry to decompose.
+        bbox (tuple): The (min_x, min_y, max_x, max_y) cell to decompose.
+        min_size (float): Partial cells with less area than this are leaves.
+        depth_left (int): The number of times cells may still be split.
+            Partial cells left when the depth runs out are leaves.
+        max_vertices (int): If provided, partial cells with at most this many
+            vertices are leaves.
+
+    Note:
+        A partial cell that runs out of depth while still larger than
+        min_size is kept as a partial leaf.  Earlier versions dropped such
+        cells, so points in that part of the feature were never found, mostly
+        near the boundaries of large, detailed features.  Searches now find
+        those points, so they can return more hits than indexes built before
+        the change, which should be rebuilt.
+
+    Returns:
+        list of tuple - (bbox, cell) pairs where cell is True for a cell
+            entirely inside geom, or the intersection geometry of a partial
+            cell.
+    """
     # min_x, min_y, max_x, max_y = bbox
     test_geom = create_geometry_from_bbox(*bbox)
     intersection = geom.Intersection(test_geom)
@@ -28,47 +132,613 @@ def quadtree_index(geom, bbox, min_size, depth_left):
         return [(bbox, intersection)]
     if intersection.Area() == test_geom.Area():
         return [(bbox, True)]
+    # Partial cells are leaves once they may not be split or are simple enough
+    if depth_left <= 0 or (
+            max_vertices is not None and
+            count_vertices(intersection) <= max_vertices):
+        return [(bbox, intersection)]
+    half_x = min_x + (max_x - min_x) / 2.0
+    half_y = min_y + (max_y - min_y) / 2.0
+    # print('Half x: {}, half y: {}'.format(half_x, half_y))
     ret = []
-    if depth_left > 0:
-        half_x = min_x + (max_x - min_x) / 2.0
-        half_y = min_y + (max_y - min_y) / 2.0
-        # print('Half x: {}, half y: {}'.format(half_x, half_y))
+    for quad_bbox in [
+            (min_x, min_y, half_x, half_y), (half_x, min_y, max_x, half_y),
+            (half_x, half_y, max_x, max_y), (min_x, half_y, half_x, max_y)]:
         ret.extend(
             quadtree_index(
-                intersection, (min_x, min_y, half_x, half_y), min_size,
-                depth_left - 1))
-        ret.extend(
-            quadtree_index(
-                intersection, (half_x, min_y, max_x, half_y), min_size,
-                depth_left - 1))
-        ret.extend(
-            quadtree_index(
-                intersection, (half_x, half_y, max_x, max_y), min_size,
-                depth_left - 1))
-        ret.extend(
-            quadtree_index(
-                intersection, (min_x, half_y, half_x, max_y), min_size,
-                depth_left - 1))
+                intersection, quad_bbox, min_size, depth_left - 1,
+                max_vertices=max_vertices))
     return ret
 
 
 # .............................................................................
-class SpatialIndex:
-    """This class provides an index for quickly performing intersects."""
+def _bulk_load_rtree(entries, filename=None, properties=None):
+    """Build an rtree from entries with sort-tile-recursive packing.
+
+    Args:
+        entries (iterable of tuple): (id, bbox, object) entries to load.
+        filename (str): A base file location for a disk-backed rtree, or None
+            for an in-memory rtree.
+        properties (rtree.index.Property): Properties for the new index.
+    """
+    entries = iter(entries)
+    first_entry = next(entries, None)
+    args = [] if filename is None else [filename]
+    if first_entry is not None:
+        args.append(itertools.chain([first_entry], entries))
+    if properties is None:
+        properties = rtree.index.Property()
+        properties.fill_factor = BULK_LOAD_FILL_FACTOR
+    return rtree.index.Index(*args, properties=properties)
+
+
+# .............................................................................
+class CellGeometries:
+    """This class stores partial cell geometries as packed coordinate rings.
+
+    The closed rings of every geometry share one (num_vertices, 2) coordinate
+    array.  ring_offsets holds the first vertex of each ring and geom_offsets
+    the first ring of each geometry, each followed by the total, so geometry i
+    is rings geom_offsets[i] to geom_offsets[i + 1].  The edge arrays used
+    for point tests are derived from the rings and packed the same way.
+    """
+    # ..........................
+    def __init__(self, coords=None, ring_offsets=None, geom_offsets=None):
+        """Constructor.
+
+        Args:
+            coords (numpy.ndarray): Packed ring coordinates to start with.
+            ring_offsets (numpy.ndarray): The ring offsets of coords.
+            geom_offsets (numpy.ndarray): The geometry offsets of the rings.
+        """
+        self.coords = np.zeros((0, 2), dtype=np.float64)
+        self.ring_offsets = np.zeros(1, dtype=np.int64)
+        self.geom_offsets = np.zeros(1, dtype=np.int64)
+        self.edges = np.zeros((0, 4), dtype=np.float64)
+        self.edge_offsets = np.zeros(1, dtype=np.int64)
+        self._pending = []
+        if coords is not None:
+            self._append(
+                np.asarray(coords, dtype=np.float64).reshape(-1, 2),
+                np.asarray(ring_offsets, dtype=np.int64),
+                np.asarray(geom_offsets, dtype=np.int64))
+
+    # ..........................
+    def __len__(self):
+        return len(self.geom_offsets) - 1 + len(self._pending)
+
+    # ..........................
+    def __getstate__(self):
+        # The edges are derived from the rings so are not pickled
+        self.pack()
+        return {
+            'coords': self.coords, 'ring_offsets': self.ring_offsets,
+            'geom_offsets': self.geom_offsets}
+
+    # ..........................
+    def __setstate__(self, state):
+        self.__init__(**state)
+
+    # ..........................
+    @property
+    def nbytes(self):
+        """The number of bytes held by the packed arrays."""
+        self.pack()
+        return sum(
+            values.nbytes for values in (
+                self.coords, self.ring_offsets, self.geom_offsets,
+                self.edges, self.edge_offsets))
+
+    # ..........................
+    def add(self, rings):
+        """Add a geometry.
+
+        Args:
+            rings (list of numpy.ndarray): (num_vertices, 2) coordinate
+                arrays of the polygon rings, as from get_geometry_rings.
+                Rings with fewer than 3 vertices are dropped.
+
+        Returns:
+            int - The geometry id.
+        """
+        closed_rings = []
+        for ring in rings:
+            if len(ring) < 3:
+                continue
+            if not np.array_equal(ring[0], ring[-1]):
+                ring = np.vstack((ring, ring[:1]))
+            closed_rings.append(np.asarray(ring, dtype=np.float64))
+        self._pending.append(closed_rings)
+        return len(self) - 1
+
+    # ..........................
+    def pack(self):
+        """Pack geometries added since the last pack into the arrays."""
+        if not self._pending:
+            return
+        rings = [ring for geom_rings in self._pending for ring in geom_rings]
+        ring_offsets = np.zeros(len(rings) + 1, dtype=np.int64)
+        np.cumsum([len(ring) for ring in rings], out=ring_offsets[1:])
+        geom_offsets = np.zeros(len(self._pending) + 1, dtype=np.int64)
+        np.cumsum(
+            [len(geom_rings) for geom_rings in self._pending],
+            out=geom_offsets[1:])
+        coords = np.concatenate(
+            rings) if rings else np.zeros((0, 2), dtype=np.float64)
+        self._pending = []
+        self._append(coords, ring_offsets, geom_offsets)
+
+    # ..........................
+    def _append(self, coords, ring_offsets, geom_offsets):
+        """Append packed geometries and their edges to the arrays."""
+        edges, ring_edge_offsets = get_packed_ring_edges(coords, ring_offsets)
+        edge_offsets = ring_edge_offsets[geom_offsets]
+        self.ring_offsets = np.concatenate(
+            (self.ring_offsets, ring_offsets[1:] + self.ring_offsets[-1]))
+        self.geom_offsets = np.concatenate(
+            (self.geom_offsets, geom_offsets[1:] + self.geom_offsets[-1]))
+        self.edge_offsets = np.concatenate(
+            (self.edge_offsets, edge_offsets[1:] + self.edge_offsets[-1]))
+        self.coords = np.concatenate((self.coords, coords))
+        self.edges = np.concatenate((self.edges, edges))
+
+    # ..........................
+    def get_edges(self, geom_id):
+        """Get the edge array of a packed geometry."""
+        return self.edges[
+            self.edge_offsets[geom_id]:self.edge_offsets[geom_id + 1]]
+
+    # ..........................
+    def get_rings(self, geom_id):
+        """Get the coordinate arrays of the rings of a packed geometry."""
+        return [
+            self.coords[self.ring_offsets[i]:self.ring_offsets[i + 1]]
+            for i in range(
+                self.geom_offsets[geom_id], self.geom_offsets[geom_id + 1])]
+
+
+# .............................................................................
+class AttributeTable(Mapping):
+    """This class stores feature attributes as one column per attribute name.
+
+    The table is a read-only mapping of feature identifier to its attribute
+    dictionary, rebuilt from the columns on access.  Attributes that are not
+    dictionaries are stored and returned as they are.
+    """
     # ..........................
     def __init__(self):
-        self.index = rtree.index.Index()
-        self.att_lookup = {}
-        self.geom_lookup = {}
-        self.min_size = 0.01
-        self.depth_left = 10
-        self.next_geom = 0
+        """Constructor."""
+        self.identifiers = []
+        self.columns = {}
+        # Each feature has the index of a tuple of its attribute names in
+        #    schemas, or -1 if its attributes are a single value
+        self.schemas = []
+        self.schema_ids = []
+        self.values = []
+        self._rows = {}
+        self._schema_lookup = {}
+
+    # ..........................
+    def __getitem__(self, identifier):
+        row = self._rows[identifier]
+        schema_id = self.schema_ids[row]
+        if schema_id < 0:
+            return self.values[row]
+        return {
+            name: self.columns[name][row] for name in self.schemas[schema_id]}
+
+    # ..........................
+    def __iter__(self):
+        return iter(self.identifiers)
+
+    # ..........................
+    def __len__(self):
+        return len(self.identifiers)
+
+    # ..........................
+    def add(self, identifier, att_dict):
+        """Add the attributes of a feature.
+
+        Args:
+            identifier: The feature identifier.
+            att_dict (dict): The feature attributes.
+
+        Returns:
+            int - The row number of the feature.
+
+        Raises:
+            ValueError: Raised if the identifier was already added.
+        """
+        if identifier in self._rows:
+            raise ValueError(
+                'Feature {} was already added'.format(identifier))
+        row = len(self.identifiers)
+        self._rows[identifier] = row
+        self.identifiers.append(identifier)
+        if isinstance(att_dict, dict):
+            schema = tuple(att_dict.keys())
+            if schema not in self._schema_lookup:
+                self._schema_lookup[schema] = len(self.schemas)
+                self.schemas.append(schema)
+            self.schema_ids.append(self._schema_lookup[schema])
+            self.values.append(None)
+        else:
+            self.schema_ids.append(-1)
+            self.values.append(att_dict)
+            att_dict = {}
+        for name in att_dict.keys() - self.columns.keys():
+            self.columns[name] = [None] * row
+        for name, column in self.columns.items():
+            column.append(att_dict.get(name))
+        return row
+
+    # ..........................
+    def get_row(self, identifier):
+        """Get the row number of a feature."""
+        return self._rows[identifier]
+
+    # ..........................
+    def get_column(self, name):
+        """Get the values of an attribute for every feature, in row order.
+
+        Returns:
+            list - The values, None for features without the attribute.
+        """
+        return self.columns.get(name, [None] * len(self.identifiers))
+
+    # ..........................
+    def to_json(self):
+        """Get the table as a JSON serializable dictionary."""
+        return {
+            'identifiers': self.identifiers,
+            'columns': self.columns,
+            'schemas': self.schemas,
+            'schema_ids': self.schema_ids,
+            'values': self.values
+        }
+
+    # ..........................
+    @classmethod
+    def from_json(cls, table_json):
+        """Load a table from the dictionary written by to_json."""
+        table = cls()
+        table.identifiers = table_json['identifiers']
+        table.columns = table_json['columns']
+        table.schemas = [tuple(schema) for schema in table_json['schemas']]
+        table.schema_ids = table_json['schema_ids']
+        table.values = table_json['values']
+        table._rows = {
+            identifier: row for row, identifier in enumerate(
+                table.identifiers)}
+        table._schema_lookup = {
+            schema: i for i, schema in enumerate(table.schemas)}
+        return table
+
+
+# .............................................................................
+class CellGrid:
+    """This class buckets cell numbers on a uniform grid.
+
+    Each bucket is keyed by the integer id row * num_cols + col of a grid cell
+    and lists the cells whose bounding boxes touch it, so the candidate cells
+    for a point are one bucket.  The grid covers the bounding boxes it was
+    built from, in the same packed offsets form as the cell geometries.
+    """
+    # ..........................
+    def __init__(self, resolution=DEFAULT_GRID_RESOLUTION):
+        """Constructor.
+
+        Args:
+            resolution (float): The width and height of a grid cell.
+
+        Raises:
+            ValueError: Raised if the resolution is not positive.
+        """
+        if not resolution > 0:
+            raise ValueError(
+                'Grid resolution must be positive, not {}'.format(resolution))
+        self.resolution = resolution
+        self.origin = (0.0, 0.0)
+        self.num_cols = 0
+        self.num_rows = 0
+        self.bboxes = np.zeros((0, 4), dtype=np.float64)
+        self.offsets = np.zeros(1, dtype=np.int64)
+        self.cell_nums = np.zeros(0, dtype=np.int64)
+
+    # ..........................
+    def build(self, bboxes):
+        """Bucket cell bounding boxes, replacing any built before.
+
+        Args:
+            bboxes (numpy.ndarray): (num_cells, 4) cell bounding boxes, the
+                cell number of each is its row.
+        """
+        self.bboxes = bboxes
+        if len(bboxes) == 0:
+            self.__init__(self.resolution)
+            return
+        self.origin = (bboxes[:, 0].min(), bboxes[:, 1].min())
+        col_0, row_0 = self._get_cols_rows(bboxes[:, 0], bboxes[:, 1])
+        col_1, row_1 = self._get_cols_rows(bboxes[:, 2], bboxes[:, 3])
+        self.num_cols = int(col_1.max()) + 1
+        self.num_rows = int(row_1.max()) + 1
+
+        # Expand each cell to the grid cells its bounding box touches
+        widths = col_1 - col_0 + 1
+        counts = widths * (row_1 - row_0 + 1)
+        cell_nums = np.repeat(np.arange(len(bboxes), dtype=np.int64), counts)
+        steps = np.arange(counts.sum(), dtype=np.int64) - np.repeat(
+            np.cumsum(counts) - counts, counts)
+        widths = widths[cell_nums]
+        grid_ids = (row_0[cell_nums] + steps // widths) * self.num_cols + \
+            col_0[cell_nums] + steps % widths
+        order = np.argsort(grid_ids, kind='stable')
+        self.cell_nums = cell_nums[order]
+        self.offsets = np.zeros(self.num_cols * self.num_rows + 1, np.int64)
+        np.cumsum(
+            np.bincount(grid_ids, minlength=self.num_cols * self.num_rows),
+            out=self.offsets[1:])
+
+    # ..........................
+    def _get_cols_rows(self, xs, ys):
+        """Get the grid columns and rows of coordinates, unclipped."""
+        return (
+            np.floor((xs - self.origin[0]) / self.resolution).astype(np.int64),
+            np.floor((ys - self.origin[1]) / self.resolution).astype(np.int64))
+
+    # ..........................
+    def get_grid_ids(self, xs, ys):
+        """Get the grid cell id of each point, or -1 if off the grid."""
+        cols = np.floor(
+            (np.asarray(xs, dtype=np.float64) - self.origin[0]) /
+            self.resolution)
+        rows = np.floor(
+            (np.asarray(ys, dtype=np.float64) - self.origin[1]) /
+            self.resolution)
+        # Comparisons are False for NaN, so those points are off the grid too
+        valid = (cols >= 0) & (cols < self.num_cols) & (rows >= 0) & (
+            rows < self.num_rows)
+        grid_ids = np.full(len(cols), -1, dtype=np.int64)
+        grid_ids[valid] = rows[valid].astype(np.int64) * self.num_cols + \
+            cols[valid].astype(np.int64)
+        return grid_ids
+
+    # ..........................
+    def get_candidates(self, xs, ys):
+        """Get the cells whose bounding boxes contain each point.
+
+        Args:
+            xs (numpy.ndarray): The x coordinates of the points.
+            ys (numpy.ndarray): The y coordinates of the points.
+
+        Returns:
+            tuple - (point_idxs, cell_nums) arrays of matching pairs.
+        """
+        xs = np.asarray(xs, dtype=np.float64)
+        ys = np.asarray(ys, dtype=np.float64)
+        grid_ids = self.get_grid_ids(xs, ys)
+        point_idxs = np.flatnonzero(grid_ids >= 0)
+        grid_ids = grid_ids[point_idxs]
+        starts = self.offsets[grid_ids]
+        counts = self.offsets[grid_ids + 1] - starts
+        point_idxs = np.repeat(point_idxs, counts)
+        cell_nums = self.cell_nums[
+            np.repeat(starts - (np.cumsum(counts) - counts), counts) +
+            np.arange(counts.sum(), dtype=np.int64)]
+        bboxes = self.bboxes[cell_nums]
+        pt_xs = xs[point_idxs]
+        pt_ys = ys[point_idxs]
+        inside = (bboxes[:, 0] <= pt_xs) & (pt_xs <= bboxes[:, 2]) & (
+            bboxes[:, 1] <= pt_ys) & (pt_ys <= bboxes[:, 3])
+        return point_idxs[inside], cell_nums[inside]
+
+    # ..........................
+    def get_stats(self):
+        """Get statistics about the grid buckets.
+
+        Returns:
+            dict - 'num_cells', 'num_buckets', 'occupied_buckets', and
+                'mean_bucket_cells' and 'max_bucket_cells', the average and
+                largest number of cells in an occupied bucket.
+        """
+        bucket_sizes = np.diff(self.offsets)
+        occupied = int(np.count_nonzero(bucket_sizes))
+        return {
+            'num_cells': len(self.bboxes),
+            'num_buckets': len(bucket_sizes),
+            'occupied_buckets': occupied,
+            'mean_bucket_cells': len(self.cell_nums) / max(1, occupied),
+            'max_bucket_cells': int(bucket_sizes.max()) if occupied else 0
+        }
+
+
+# .............................................................................
+class SpatialIndex:
+    """This class provides an index for quickly performing intersects.
+
+    Each feature is decomposed into quadtree cells, either entirely inside the
+    feature or partial, with the part of the feature in the cell kept in
+    packed arrays.  The engine, an rtree or a CellGrid, finds the numbers of
+    the cells under a point, which index the cell bounding box, feature row
+    and geometry id arrays.  Indexes can be pickled, the engine is rebuilt
+    from the cell arrays when they are unpickled.
+    """
+    # ..........................
+    def __init__(self, base_filename=None, bulk_load=False,
+                 max_leaf_vertices=None, engine=RTREE_ENGINE,
+                 grid_resolution=DEFAULT_GRID_RESOLUTION):
+        """Constructor.
+
+        Args:
+            base_filename (str): The base file location used by save().
+            bulk_load (bool): If True, the rtree is packed in one bulk load
+                by build(), or by the first search or save after features are
+                added.  Otherwise the cells of new features are inserted into
+                the rtree then.  Either way add_feature only collects cells,
+                so adding features does not copy the cell arrays.
+            max_leaf_vertices (int): If provided, the quadtree depth and
+                minimum cell size are chosen for each feature with
+                get_quadtree_settings, and partial cells are split until they
+                have at most this many vertices.  Otherwise every feature uses
+                min_size and depth_left.
+            engine (str): RTREE_ENGINE to find cells with an rtree, or
+                GRID_ENGINE to bucket them on a uniform grid, which is rebuilt
+                by the first search after features are added.
+            grid_resolution (float): The grid cell size of the grid engine.
+
+        Raises:
+            ValueError: Raised if the engine is not one of INDEX_ENGINES.
+        """
+        if engine not in INDEX_ENGINES:
+            raise ValueError(
+                'Unknown index engine {}, expected one of {}'.format(
+                    engine, INDEX_ENGINES))
+        self.base_filename = base_filename
+        self.engine = engine
+        self.grid_resolution = grid_resolution
+        self.index = rtree.index.Index() if engine == RTREE_ENGINE else None
+        self.grid = CellGrid(
+            grid_resolution) if engine == GRID_ENGINE else None
+        self.att_lookup = AttributeTable()
+        self.geometries = CellGeometries()
+        self.min_size = DEFAULT_MIN_SIZE
+        self.depth_left = DEFAULT_DEPTH
+        self.max_leaf_vertices = max_leaf_vertices
+        self.bulk_load = bulk_load
+        # Cell bounding boxes, feature rows and geometry ids (FULL_CELL for
+        #    cells entirely inside their feature)
+        self.cell_bboxes = np.zeros((0, 4), dtype=np.float64)
+        self.cell_rows = np.zeros(0, dtype=np.int64)
+        self.cell_geoms = np.zeros(0, dtype=np.int64)
+        self._pending_cells = []
+        self._num_indexed = 0
+        self._identifiers = None
+        # rtree indexes are not safe to query from several threads at once
+        self._lock = threading.RLock()
+
+    # ..........................
+    def __getstate__(self):
+        self._prepare()
+        state = self.__dict__.copy()
+        del state['index']
+        del state['_lock']
+        return state
+
+    # ..........................
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.RLock()
+        self._build_engine()
+
+    # ..........................
+    @property
+    def next_geom(self):
+        """The number of partial cell geometries."""
+        return len(self.geometries)
 
     # ..........................
     @classmethod
-    def load_from_file(cls, filename):
-        """Load a stored index."""
-        pass
+    def load_from_file(cls, filename, in_memory=True, engine=None,
+                       grid_resolution=None):
+        """Load a stored index.
+
+        Args:
+            filename (str): The base file location the index was saved to.
+            in_memory (bool): If True, build the rtree in memory from the
+                cell arrays, otherwise query the disk-backed rtree directly.
+                Only used for indexes saved with the rtree engine.
+            engine (str): The engine to search with, defaults to the engine
+                the index was saved with.
+            grid_resolution (float): The grid cell size of the grid engine,
+                defaults to the saved grid resolution.
+
+        Returns:
+            SpatialIndex - The loaded index.
+
+        Raises:
+            ValueError: Raised if the index was saved in a different index
+                format version.
+        """
+        with open('{}{}'.format(filename, META_EXTENSION)) as meta_in:
+            meta = json.load(meta_in)
+        version = meta.get('version')
+        if version != INDEX_VERSION:
+            raise ValueError(
+                'Spatial index {} has format version {}, expected {}.  '
+                'Rebuild the index from its shapefiles.'.format(
+                    filename, version, INDEX_VERSION))
+        saved_engine = meta['engine']
+        spatial_index = cls(
+            filename,
+            engine=saved_engine if engine is None else engine,
+            grid_resolution=meta['grid_resolution']
+            if grid_resolution is None else grid_resolution)
+        spatial_index.min_size = meta['min_size']
+        spatial_index.depth_left = meta['depth_left']
+        spatial_index.max_leaf_vertices = meta['max_leaf_vertices']
+        spatial_index.att_lookup = AttributeTable.from_json(meta['attributes'])
+
+        # Cells and their geometries
+        with np.load('{}{}'.format(filename, GEOM_EXTENSION)) as geom_in:
+            spatial_index.geometries = CellGeometries(
+                geom_in['coords'], geom_in['ring_offsets'],
+                geom_in['geom_offsets'])
+            spatial_index.cell_bboxes = geom_in['cell_bboxes']
+            spatial_index.cell_rows = geom_in['cell_rows']
+            spatial_index.cell_geoms = geom_in['cell_geoms']
+        spatial_index._num_indexed = len(spatial_index.cell_rows)
+
+        # Engine
+        if spatial_index.engine == saved_engine == RTREE_ENGINE and \
+                not in_memory:
+            spatial_index.index = rtree.index.Index(filename)
+        else:
+            spatial_index._build_engine()
+        return spatial_index
+
+    # ..........................
+    def save(self, base_filename=None):
+        """Save the index to files so it can be loaded with load_from_file.
+
+        Args:
+            base_filename (str): The base file location to write to.  Defaults
+                to the base filename the index was created with.
+
+        Raises:
+            ValueError: Raised if no file location is available.
+        """
+        if base_filename is None:
+            base_filename = self.base_filename
+        if base_filename is None:
+            raise ValueError('No base filename provided to save index')
+        self._prepare()
+        if self.engine == RTREE_ENGINE:
+            props = rtree.index.Property()
+            props.fill_factor = BULK_LOAD_FILL_FACTOR
+            props.overwrite = True
+            _bulk_load_rtree(
+                self._iter_rtree_entries(), base_filename, props).close()
+
+        with open('{}{}'.format(base_filename, GEOM_EXTENSION), 'wb') as geom_out:
+            np.savez(
+                geom_out, coords=self.geometries.coords,
+                ring_offsets=self.geometries.ring_offsets,
+                geom_offsets=self.geometries.geom_offsets,
+                cell_bboxes=self.cell_bboxes, cell_rows=self.cell_rows,
+                cell_geoms=self.cell_geoms)
+
+        with open('{}{}'.format(base_filename, META_EXTENSION), 'w') as meta_out:
+            json.dump(
+                {
+                    'version': INDEX_VERSION,
+                    'min_size': self.min_size,
+                    'depth_left': self.depth_left,
+                    'max_leaf_vertices': self.max_leaf_vertices,
+                    'engine': self.engine,
+                    'grid_resolution': self.grid_resolution,
+                    'num_geometries': self.next_geom,
+                    'attributes': self.att_lookup.to_json()
+                }, meta_out)
 
     # ..........................
     def add_feature(self, identifier, geom, att_dict):
@@ -79,34 +749,360 @@ class SpatialIndex:
             geom: A geometry to spatially index
             att_dict: A dictionary of attributes to store in the lookup table
         """
-        self.att_lookup[identifier] = att_dict
+        row = self.att_lookup.add(identifier, att_dict)
+        self._identifiers = None
         min_x, max_x, min_y, max_y = geom.GetEnvelope()
-        idx_entries = quadtree_index(
-            geom, (min_x, min_y, max_x, max_y), self.min_size, self.depth_left)
+        if self.max_leaf_vertices is None:
+            idx_entries = quadtree_index(
+                geom, (min_x, min_y, max_x, max_y), self.min_size,
+                self.depth_left)
+        else:
+            min_size, depth_left = get_quadtree_settings(
+                geom, self.max_leaf_vertices)
+            idx_entries = quadtree_index(
+                geom, (min_x, min_y, max_x, max_y), min_size, depth_left,
+                max_vertices=self.max_leaf_vertices)
         for bbox, idx_geom in idx_entries:
             if isinstance(idx_geom, bool) and idx_geom:
                 # Index as entire bbox
-                self.index.insert(identifier, bbox, obj=True)
+                self._pending_cells.append((bbox, row, FULL_CELL))
+            else:
+                # Keep the rings of the partial cell, not the OGR geometry
+                self._pending_cells.append(
+                    (bbox, row,
+                     self.geometries.add(get_geometry_rings(idx_geom))))
+
+    # ..........................
+    def _pack_cells(self):
+        """Pack cells added since the last pack into the cell arrays."""
+        if not self._pending_cells:
+            return
+        bboxes, rows, geoms = zip(*self._pending_cells)
+        self._pending_cells = []
+        self.cell_bboxes = np.concatenate(
+            (self.cell_bboxes, np.array(bboxes, dtype=np.float64)))
+        self.cell_rows = np.concatenate(
+            (self.cell_rows, np.array(rows, dtype=np.int64)))
+        self.cell_geoms = np.concatenate(
+            (self.cell_geoms, np.array(geoms, dtype=np.int64)))
+        self.geometries.pack()
+
+    # ..........................
+    def _iter_rtree_entries(self, start=0):
+        """Get the rtree entries of the cells from a cell number on."""
+        for cell_num in range(start, len(self.cell_rows)):
+            yield cell_num, tuple(self.cell_bboxes[cell_num]), None
+
+    # ..........................
+    def _prepare(self):
+        """Pack new cells and add them to the engine before a query."""
+        if self._pending_cells or self._num_indexed < len(self.cell_rows):
+            with self._lock:
+                self._pack_cells()
+                if self.bulk_load or self.engine == GRID_ENGINE:
+                    self.build()
+                else:
+                    for cell_num, bbox, _ in self._iter_rtree_entries(
+                            self._num_indexed):
+                        self.index.insert(cell_num, bbox)
+                    self._num_indexed = len(self.cell_rows)
+
+    # ..........................
+    def _build_engine(self):
+        """Build the rtree or grid from every packed cell."""
+        if self.engine == RTREE_ENGINE:
+            self.index = _bulk_load_rtree(self._iter_rtree_entries())
+        else:
+            self.grid.build(self.cell_bboxes)
+        self._num_indexed = len(self.cell_rows)
+
+    # ..........................
+    def build(self):
+        """Pack every cell into a new rtree with one bulk load, or grid.
+
+        Returns:
+            dict - The build statistics, 'build_seconds' and those of
+                get_rtree_stats or get_grid_stats.
+        """
+        start_time = time.perf_counter()
+        with self._lock:
+            self._pack_cells()
+            self._build_engine()
+        if self.engine == RTREE_ENGINE:
+            stats = self.get_rtree_stats()
+        else:
+            stats = self.get_grid_stats()
+        stats['build_seconds'] = time.perf_counter() - start_time
+        return stats
+
+    # ..........................
+    def _check_engine(self, engine):
+        """Raise a ValueError if the index does not use an engine."""
+        if self.engine != engine:
+            raise ValueError(
+                'Index uses the {} engine, not {}'.format(self.engine, engine))
+
+    # ..........................
+    def get_grid_stats(self):
+        """Get statistics about the buckets of the grid engine.
+
+        Returns:
+            dict - The statistics of CellGrid.get_stats.
+
+        Raises:
+            ValueError: Raised if the index does not use the grid engine.
+        """
+        self._check_engine(GRID_ENGINE)
+        self._prepare()
+        with self._lock:
+            return self.grid.get_stats()
+
+    # ..........................
+    def get_rtree_stats(self):
+        """Get statistics about the packing of the rtree.
+
+        Returns:
+            dict - 'num_cells', 'num_leaves', 'leaf_capacity', and
+                'node_fill', the average fraction of leaf node capacity used.
+
+        Raises:
+            ValueError: Raised if the index does not use the rtree engine.
+        """
+        self._check_engine(RTREE_ENGINE)
+        self._prepare()
+        with self._lock:
+            leaves = self.index.leaves() if len(self.index) > 0 else []
+            leaf_capacity = self.index.properties.leaf_capacity
+        num_cells = sum(len(child_ids) for _, child_ids, _ in leaves)
+        return {
+            'num_cells': num_cells,
+            'num_leaves': len(leaves),
+            'leaf_capacity': leaf_capacity,
+            'node_fill': num_cells / max(1, len(leaves) * leaf_capacity)
+        }
+
+    # ..........................
+    def get_cell_stats(self):
+        """Get statistics about the quadtree cells of the index.
+
+        Returns:
+            dict - 'num_cells', the number of quadtree leaf cells,
+                'full_cell_ratio', the fraction of them entirely inside their
+                feature, 'mean_leaf_vertices', the average vertex count of the
+                partial cell geometries, and 'memory_bytes', the memory held
+                by the cell and partial cell geometry arrays.
+        """
+        self._prepare()
+        num_cells = len(self.cell_rows)
+        return {
+            'num_cells': num_cells,
+            'full_cell_ratio': (
+                num_cells - self.next_geom) / max(1, num_cells),
+            'mean_leaf_vertices': len(
+                self.geometries.coords) / max(1, self.next_geom),
+            'memory_bytes': self.geometries.nbytes + sum(
+                values.nbytes for values in (
+                    self.cell_bboxes, self.cell_rows, self.cell_geoms))
+        }
+
+    # ..........................
+    def get_identifiers(self):
+        """Get an array of the feature identifiers, in row order.
+
+        The dtype is inferred from the identifiers, or int64 for an index
+        without features, so empty search results have the dtype of the
+        usual integer identifiers rather than float64.
+        """
+        if self._identifiers is None:
+            if len(self.att_lookup) > 0:
+                self._identifiers = np.array(self.att_lookup.identifiers)
             else:
-                # Add geometry to lookup, increment counter
-                self.index.insert(identifier, bbox, obj=self.next_geom)
-                self.geom_lookup[self.next_geom] = idx_geom
-                self.next_geom += 1
+                self._identifiers = np.zeros(0, dtype=np.int64)
+        return self._identifiers
+
+    # ..........................
+    def iter_cells(self):
+        """Iterate over the quadtree cells stored in the index.
+
+        Yields:
+            tuple - (identifier, bbox, cell) where cell is True for a cell
+                entirely inside the feature or the geometry id of a partial
+                cell.
+        """
+        self._prepare()
+        identifiers = self.att_lookup.identifiers
+        for bbox, row, geom_id in zip(
+                self.cell_bboxes.tolist(), self.cell_rows.tolist(),
+                self.cell_geoms.tolist()):
+            yield (
+                identifiers[row], tuple(bbox),
+                True if geom_id == FULL_CELL else geom_id)
 
     # ..........................
     def search(self, x, y):
         """Search for x, y and return attributes in lookup if found."""
         hits = {}
-        for hit in self.index.intersection((x, y, x, y), objects=True):
-            if hit.id not in hits.keys():
-                if isinstance(hit.object, bool) or \
-                        self._point_intersect(x, y, self.geom_lookup[hit.object]):
-                    hits[hit.id] = self.att_lookup[hit.id]
+        self._prepare()
+        with self._lock:
+            if self.engine == GRID_ENGINE:
+                _, candidates = self.grid.get_candidates([x], [y])
+            else:
+                candidates = list(self.index.intersection((x, y, x, y)))
+        for cell_num in candidates:
+            identifier = self.att_lookup.identifiers[self.cell_rows[cell_num]]
+            if identifier not in hits:
+                geom_id = self.cell_geoms[cell_num]
+                if geom_id == FULL_CELL or \
+                        self._point_intersect(x, y, geom_id):
+                    hits[identifier] = self.att_lookup[identifier]
         return hits
 
     # ..........................
-    @staticmethod
-    def _point_intersect(pt_x, pt_y, geom):
-        # print('Intersecting geometry!')
-        pt_geom = ogr.CreateGeometryFromWkt('POINT ({} {})'.format(pt_x, pt_y))
-        return pt_geom.Within(geom)
+    def search_many(self, xs, ys):
+        """Search for many points at once.
+
+        Candidate cells are found with a single rtree query covering the
+        batch, or with one query per distinct point when the batch covers
+        many more cells than it has points, or from the grid buckets of the
+        points, and each partial cell tests all of its candidate points
+        together.
+
+        Args:
+            xs (numpy.ndarray): The x coordinates of the points.
+            ys (numpy.ndarray): The y coordinates of the points.
+
+        Returns:
+            tuple - (offsets, identifiers) arrays, the identifiers of the
+                features containing point i are
+                identifiers[offsets[i]:offsets[i + 1]].  Points with
+                non-finite coordinates are not found in any feature.
+        """
+        xs = np.asarray(xs, dtype=np.float64)
+        ys = np.asarray(ys, dtype=np.float64)
+        hit_points = []
+        hit_rows = []
+        for row, geom_id, point_idxs in self._iter_candidate_cells(xs, ys):
+            if geom_id != FULL_CELL:
+                point_idxs = point_idxs[
+                    self.points_in_cell(
+                        geom_id, xs[point_idxs], ys[point_idxs])]
+            if len(point_idxs) > 0:
+                hit_points.append(point_idxs)
+                hit_rows.append(np.full(len(point_idxs), row, dtype=np.int64))
+        identifiers = self.get_identifiers()
+        if not hit_points:
+            return np.zeros(len(xs) + 1, dtype=np.int64), identifiers[:0]
+
+        # A point in several cells of one feature is reported once
+        num_rows = len(identifiers)
+        pairs = np.unique(
+            np.concatenate(hit_points) * num_rows + np.concatenate(hit_rows))
+        point_idxs, rows = np.divmod(pairs, num_rows)
+        offsets = np.zeros(len(xs) + 1, dtype=np.int64)
+        np.cumsum(
+            np.bincount(point_idxs, minlength=len(xs)), out=offsets[1:])
+        return offsets, identifiers[rows]
+
+    # ..........................
+    def _iter_candidate_cells(self, xs, ys):
+        """Get the points whose coordinates fall within each cell bbox.
+
+        Yields:
+            tuple - (row, geom_id, point_idxs) where row is the feature row,
+                geom_id is the partial cell geometry id or FULL_CELL, and
+                point_idxs is an array of point indices.
+        """
+        valid_idxs = np.flatnonzero(np.isfinite(xs) & np.isfinite(ys))
+        if len(valid_idxs) == 0:
+            return
+        self._prepare()
+        valid_xs = xs[valid_idxs]
+        valid_ys = ys[valid_idxs]
+        if self.engine == GRID_ENGINE:
+            yield from self._iter_grid_candidate_cells(
+                valid_xs, valid_ys, valid_idxs)
+            return
+        bounds = (
+            valid_xs.min(), valid_ys.min(), valid_xs.max(), valid_ys.max())
+        with self._lock:
+            num_cells = self.index.count(bounds)
+            if num_cells <= MAX_CELLS_PER_POINT * len(valid_idxs):
+                cell_nums = np.fromiter(
+                    self.index.intersection(bounds), dtype=np.int64)
+        if num_cells > MAX_CELLS_PER_POINT * len(valid_idxs):
+            yield from self._iter_point_candidate_cells(
+                valid_xs, valid_ys, valid_idxs)
+            return
+
+        # Sweep the cells over the points sorted by x
+        order = np.argsort(valid_xs, kind='stable')
+        sorted_xs = valid_xs[order]
+        bboxes = self.cell_bboxes[cell_nums]
+        starts = np.searchsorted(sorted_xs, bboxes[:, 0], side='left')
+        stops = np.searchsorted(sorted_xs, bboxes[:, 2], side='right')
+        for cell_num, (_, min_y, _, max_y), start, stop in zip(
+                cell_nums, bboxes, starts, stops):
+            idxs = order[start:stop]
+            idxs = idxs[(valid_ys[idxs] >= min_y) & (valid_ys[idxs] <= max_y)]
+            if len(idxs) > 0:
+                yield (
+                    self.cell_rows[cell_num], self.cell_geoms[cell_num],
+                    valid_idxs[idxs])
+
+    # ..........................
+    def _iter_point_candidate_cells(self, xs, ys, point_idxs):
+        """Get candidate cells with an rtree query for each distinct point."""
+        coords, inverse = np.unique(
+            np.column_stack((xs, ys)), axis=0, return_inverse=True)
+        inverse = inverse.reshape(-1)
+        cell_coords = {}
+        with self._lock:
+            for coord_idx, (x, y) in enumerate(coords):
+                for cell_num in self.index.intersection((x, y, x, y)):
+                    # Full cells of a feature are interchangeable and
+                    #    partial cells have their own geometry id
+                    cell_coords.setdefault(
+                        (self.cell_rows[cell_num], self.cell_geoms[cell_num]),
+                        []).append(coord_idx)
+        if not cell_coords:
+            return
+        # Map distinct coordinates back to the points that share them
+        order = np.argsort(inverse, kind='stable')
+        starts = np.searchsorted(inverse[order], np.arange(len(coords) + 1))
+        for (row, geom_id), coord_idxs in cell_coords.items():
+            idxs = np.concatenate(
+                [order[starts[i]:starts[i + 1]] for i in coord_idxs])
+            yield row, geom_id, point_idxs[idxs]
+
+    # ..........................
+    def _iter_grid_candidate_cells(self, xs, ys, point_idxs):
+        """Get candidate cells from the grid buckets of the points."""
+        with self._lock:
+            pair_points, cell_nums = self.grid.get_candidates(xs, ys)
+        order = np.argsort(cell_nums, kind='stable')
+        cell_nums, starts = np.unique(cell_nums[order], return_index=True)
+        for cell_num, idxs in zip(
+                cell_nums, np.split(pair_points[order], starts[1:])):
+            yield (
+                self.cell_rows[cell_num], self.cell_geoms[cell_num],
+                point_idxs[idxs])
+
+    # ..........................
+    def points_in_cell(self, geom_id, xs, ys):
+        """Test which of an array of points fall within a partial cell.
+
+        Args:
+            geom_id (int): The geometry id of the partial cell.
+            xs (numpy.ndarray): The x coordinates of the points.
+            ys (numpy.ndarray): The y coordinates of the points.
+
+        Returns:
+            numpy.ndarray - A boolean array, True for points inside the cell.
+        """
+        return points_in_polygon_edges(
+            xs, ys, self.geometries.get_edges(geom_id))
+
+    # ..........................
+    def _point_intersect(self, pt_x, pt_y, geom_id):
+        return point_in_polygon_edges(
+            pt_x, pt_y, self.geometries.get_edges(geom_id))
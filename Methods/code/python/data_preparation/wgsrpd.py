@@ -0,0 +1,165 @@
+"""Module containing a catalog of WGSRPD (TDWG) region geometries.
+
+The catalog reads each level shapefile once and keeps the geometries in
+memory keyed by (level, code), so locality filters for many species can be
+built without opening and scanning the shapefiles again.  The regions can
+also be put in a single spatial index that is saved to disk once and loaded
+by every later run.
+"""
+import os
+import threading
+
+from osgeo import ogr
+
+from .spatial_index import META_EXTENSION, RTREE_ENGINE, SpatialIndex
+
+WGSRPD_LEVELS = (1, 2, 3, 4)
+
+_catalogs = {}
+_catalogs_lock = threading.Lock()
+
+
+# .............................................................................
+def get_tdwg_level_shapefile(level, wgsrpd_dir):
+    """Get the shapefile location for a WGSRPD level."""
+    return os.path.join(
+        wgsrpd_dir, 'level{}'.format(level), 'level{}.shp'.format(level))
+
+
+# .............................................................................
+def get_wgsrpd_catalog(wgsrpd_dir):
+    """Get the shared catalog for a WGSRPD directory, loading it if needed.
+
+    Args:
+        wgsrpd_dir (str): The base directory containing the level shapefiles.
+
+    Returns:
+        WgsrpdCatalog - The catalog shared by every caller in this process.
+    """
+    with _catalogs_lock:
+        if wgsrpd_dir not in _catalogs:
+            _catalogs[wgsrpd_dir] = WgsrpdCatalog(wgsrpd_dir)
+        return _catalogs[wgsrpd_dir]
+
+
+# .............................................................................
+def build_wgsrpd_index(catalog, base_filename=None, levels=WGSRPD_LEVELS,
+                       max_leaf_vertices=None, engine=RTREE_ENGINE):
+    """Build a spatial index of WGSRPD regions.
+
+    Args:
+        catalog (WgsrpdCatalog): The catalog holding the region geometries.
+        base_filename (str): If provided, the index is saved to this base file
+            location.
+        levels (tuple of int): The WGSRPD levels to include.
+        max_leaf_vertices (int): If provided, the quadtree settings of each
+            region are chosen to keep at most this many vertices per leaf.
+        engine (str): The SpatialIndex engine used to find cells.
+
+    Returns:
+        SpatialIndex - An index whose attributes are {'level': , 'code': }
+            dictionaries.
+    """
+    spatial_index = SpatialIndex(
+        base_filename, bulk_load=True, max_leaf_vertices=max_leaf_vertices,
+        engine=engine)
+    feature_id = 0
+    for (level, code), geometries in sorted(catalog.geometries.items()):
+        if level in levels:
+            for geom in geometries:
+                spatial_index.add_feature(
+                    feature_id, geom, {'level': level, 'code': code})
+                feature_id += 1
+    if base_filename is not None:
+        spatial_index.save()
+    return spatial_index
+
+
+# .............................................................................
+def get_wgsrpd_index(wgsrpd_dir, base_filename, levels=WGSRPD_LEVELS,
+                     max_leaf_vertices=None, engine=None):
+    """Load a saved WGSRPD region index, building and saving it if needed.
+
+    Args:
+        wgsrpd_dir (str): The base directory containing the level shapefiles.
+        base_filename (str): The base file location of the saved index.
+        levels (tuple of int): The WGSRPD levels to include when building.
+        max_leaf_vertices (int): The leaf vertex target used when building,
+            see build_wgsrpd_index.
+        engine (str): The SpatialIndex engine to search with, defaults to the
+            engine of a saved index or the rtree when building.
+
+    Returns:
+        SpatialIndex - The region index.
+    """
+    if os.path.exists('{}{}'.format(base_filename, META_EXTENSION)):
+        return SpatialIndex.load_from_file(base_filename, engine=engine)
+    return build_wgsrpd_index(
+        get_wgsrpd_catalog(wgsrpd_dir), base_filename=base_filename,
+        levels=levels, max_leaf_vertices=max_leaf_vertices,
+        engine=RTREE_ENGINE if engine is None else engine)
+
+
+# .............................................................................
+class WgsrpdCatalog:
+    """This class holds the geometries of every WGSRPD region in memory."""
+    # ..........................
+    def __init__(self, wgsrpd_dir, levels=WGSRPD_LEVELS):
+        """Constructor.
+
+        Args:
+            wgsrpd_dir (str): The base directory containing the level
+                shapefiles.
+            levels (tuple of int): The WGSRPD levels to load.
+        """
+        self.wgsrpd_dir = wgsrpd_dir
+        self.geometries = {}
+        self.attributes = {}
+        for level in levels:
+            self._load_level(level)
+
+    # ..........................
+    def _load_level(self, level):
+        """Load all of the features of a level shapefile."""
+        code_field = 'LEVEL{}_COD'.format(level)
+        driver = ogr.GetDriverByName("ESRI Shapefile")
+        dataset = driver.Open(
+            get_tdwg_level_shapefile(level, self.wgsrpd_dir), 0)
+        layer = dataset.GetLayer()
+        lyr_def = layer.GetLayerDefn()
+        fields = [
+            lyr_def.GetFieldDefn(i).GetName() for i in range(
+                lyr_def.GetFieldCount())]
+        for feature in layer:
+            key = (level, str(feature.GetField(code_field)))
+            # Clone so the geometry outlives the feature and dataset
+            self.geometries.setdefault(key, []).append(
+                feature.GetGeometryRef().Clone())
+            if key not in self.attributes:
+                self.attributes[key] = {
+                    fld: feature.GetField(fld) for fld in fields}
+        layer = dataset = None
+
+    # ..........................
+    def get_geometries(self, level, code):
+        """Get the geometries for a region.
+
+        Args:
+            level (int or str): The WGSRPD level of the region.
+            code (int or str): The region code at that level.
+
+        Returns:
+            list of ogr.Geometry - The region geometries, shared with other
+                callers so they should not be modified.
+        """
+        return self.geometries.get((int(level), str(code)), [])
+
+    # ..........................
+    def get_locality_geometries(self, locality_dicts_list):
+        """Get the geometries for a list of POWO locality dictionaries."""
+        geometries = []
+        for locality_dict in locality_dicts_list:
+            geometries.extend(
+                self.get_geometries(
+                    locality_dict['tdwgLevel'], locality_dict['tdwgCode']))
+        return geometries
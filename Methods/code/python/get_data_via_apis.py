@@ -7,12 +7,13 @@ from time import sleep
 import urllib
 import requests
 
-from lmpy.data_preparation.occurrence_transformation import convert_json_to_point
-
 from tools.apis.gbif import get_points_from_gbif
 from tools.apis.idigbio import get_points_from_idigbio
 from tools.apis.powo import get_species_kew, get_kew_id_for_species
 from tools.common.utilities import get_species_filename
+from tools.data_preparation.occurrence_flags import get_flag_vocabulary
+from tools.data_preparation.occurrence_store import OccurrenceStoreWriter
+from tools.data_preparation.point_batch import PointBatch, PointBatchBuilder
 
 
 def species_chain_getter(*args):
@@ -31,6 +32,30 @@ def chain_getter(*args):
         return obj
     return getter
 
+# .............................................................................
+def convert_json_to_batch(json_points, species_getter, x_getter, y_getter,
+                          flags_getter):
+    """Convert API records to a PointBatch, skipping records that fail.
+
+    The batch holds species ids and flag bits, so the converted points do not
+    keep a copy of the species name and flags of every record.  Records
+    without flags are kept with no flags.
+    """
+    builder = PointBatchBuilder(flag_vocabulary=get_flag_vocabulary())
+    for json_point in json_points:
+        try:
+            flags = flags_getter(json_point)
+        except (KeyError, TypeError):
+            flags = []
+        try:
+            builder.add_point(
+                species_getter(json_point), float(x_getter(json_point)),
+                float(y_getter(json_point)), flags)
+        except (KeyError, TypeError, ValueError):
+            pass
+    return builder.build()
+
+
 # .............................................................................
 def get_genus_path(genus_name):
     """Get the base path for a genus"""
@@ -58,39 +83,58 @@ def write_points(filename, point_objs):
 
 
 # .............................................................................
-def get_gbif(species_key, species_name, base_dir):
+def write_species_points(batch, species_name, base_dir, provider,
+                         store_writer=None):
+    """Write the points of a species to a file or an occurrence store.
+
+    Args:
+        batch (PointBatch): The points of the species.
+        species_name (str): The species name.
+        base_dir (str): The base directory to write species files.
+        provider (str): The data provider, such as 'gbif'.
+        store_writer (OccurrenceStoreWriter): If provided, add the points to
+            this store instead of writing a species file.
+    """
+    if store_writer is not None:
+        store_writer.add_species(provider, species_name, batch)
+        return
+    sp_filename = get_species_filename(
+        species_name, base_dir, '_{}'.format(provider), '.csv')
+    write_points(sp_filename, batch.iter_points())
+
+
+# .............................................................................
+def get_gbif(species_key, species_name, base_dir, store_writer=None):
     """Attempt to get gbif record for species."""
     # Get points
     json_points = get_points_from_gbif(species_key)
-    converted_points = []
+    batch = PointBatch.empty(flag_vocabulary=get_flag_vocabulary())
     if len(json_points) > 0:
         # Convert points
-        converted_points = convert_json_to_point(
+        batch = convert_json_to_batch(
             json_points, itemgetter('species'), itemgetter('decimalLongitude'),
-            itemgetter('decimalLatitude'), flags_getter=itemgetter('issues'))
-    # Get file name
-    sp_filename = get_species_filename(species_name, base_dir, '_gbif', '.csv')
+            itemgetter('decimalLatitude'), itemgetter('issues'))
     # Write points
-    write_points(sp_filename, converted_points)
+    write_species_points(
+        batch, species_name, base_dir, 'gbif', store_writer=store_writer)
 
 
 # .............................................................................
-def get_idigbio(species_key, species_name, base_dir):
+def get_idigbio(species_key, species_name, base_dir, store_writer=None):
     """Attempt to get idigbio record for species."""
     # Get points
     json_points = get_points_from_idigbio(species_key=species_key)
-    converted_points = []
+    batch = PointBatch.empty(flag_vocabulary=get_flag_vocabulary())
     if len(json_points) > 0:
         # Convert points
-        converted_points = convert_json_to_point(
+        batch = convert_json_to_batch(
             json_points, species_chain_getter('indexTerms', 'canonicalname'),
             chain_getter('indexTerms', 'geopoint', 'lon'),
             chain_getter('indexTerms', 'geopoint', 'lat'),
-            flags_getter=chain_getter('indexTerms', 'flags'))
-    # Get file name
-    sp_filename = get_species_filename(species_name, base_dir, '_idigbio', '.csv')
+            chain_getter('indexTerms', 'flags'))
     # Write points
-    write_points(sp_filename, converted_points)
+    write_species_points(
+        batch, species_name, base_dir, 'idigbio', store_writer=store_writer)
 
 # .............................................................................
 def get_powo(species_key, species_name, base_dir):
@@ -119,24 +163,40 @@ def main():
     parser.add_argument(
         'accepted_taxa_filename', type=str,
         help='File containing accepted taxon names')
+    parser.add_argument(
+        '-s', '--store_dir', type=str,
+        help='Add the GBIF and iDigBio points to the occurrence store in this '
+        'directory instead of writing species files.  POWO data is still '
+        'written to the base directory.')
     args = parser.parse_args()
 
+    store_writer = None
+    if args.store_dir is not None:
+        store_writer = OccurrenceStoreWriter(args.store_dir, append=True)
     # Loop through accepted names
-    with open(args.accepted_taxa_filename) as taxa_file:
-        for line in taxa_file:
-            num_species += 1
-            parts = line.split(', ')
-            species_name = parts[1].strip().strip('"')
-            sp_key = int(parts[2])
-            try:
-                get_powo(species_key, species_name, args.base_dir)
-                get_gbif(species_key, species_name, args.base_dir)
-                get_idigbio(species_key, species_name, args.base_dir)
-            except Exception as err:
-                print('Failed to get all data for {}'.format(species_name))
-                print(err)
-                print('Sleep 60 seconds')
-                sleep(60)
+    try:
+        with open(args.accepted_taxa_filename) as taxa_file:
+            for line in taxa_file:
+                parts = line.split(', ')
+                species_name = parts[1].strip().strip('"')
+                species_key = int(parts[2])
+                try:
+                    get_powo(species_key, species_name, args.base_dir)
+                    get_gbif(
+                        species_key, species_name, args.base_dir,
+                        store_writer=store_writer)
+                    get_idigbio(
+                        species_key, species_name, args.base_dir,
+                        store_writer=store_writer)
+                except Exception as err:
+                    print('Failed to get all data for {}'.format(species_name))
+                    print(err)
+                    print('Sleep 60 seconds')
+                    sleep(60)
+    finally:
+        # Save the store index, even if the run is stopped
+        if store_writer is not None:
+            store_writer.close()
  
 
 # .............................................................................
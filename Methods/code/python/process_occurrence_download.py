@@ -1,5 +1,8 @@
 """Process a GBIF download and write out species data as separate files."""
 import argparse
+from collections import Counter
+import csv
+from itertools import groupby
 import json
 from operator import attrgetter, itemgetter
 import os
@@ -7,9 +10,23 @@ import sys
 
 #sys.path.append('/home/cjgrady/git/projects/')
 
-from lmpy.data_preparation.occurrence_transformation import (
-    convert_delimited_to_point, convert_json_to_point)
+from tools.common.archive_io import is_archive, open_text
+from tools.common.byte_ranges import (
+    DEFAULT_RANGE_SIZE, get_byte_ranges, open_byte_range)
+from tools.common.external_sort import (
+    DEFAULT_MAX_MERGE_RUNS, external_sort, get_run_size)
+from tools.common.parallel import map_in_order
 from tools.common.utilities import get_species_filename
+from tools.common.writer_pool import DEFAULT_MAX_OPEN, WriterPool
+from tools.data_preparation.occurrence_flags import get_flag_vocabulary
+from tools.data_preparation.occurrence_parser import (
+    REJECT_COORDINATES, REJECT_FIELDS, REJECT_FLAGS, REJECT_REASONS)
+from tools.data_preparation.occurrence_store import OccurrenceStoreWriter
+from tools.data_preparation.point_batch import Point, PointBatchBuilder
+
+# Providers with downloads that can be split into byte ranges
+RANGE_PROVIDERS = ('gbif',)
+
 
 def json_getter(fld_idx):
     def getter(obj):
@@ -35,85 +52,347 @@ def gbif_flag_getter(fld_idx):
     return getter
 
 # .............................................................................
-def convert_gbif_download(filename):
-    """Convert a GBIF download to points.
+def get_download_getters(provider):
+    """Get the row getters and delimiter for a provider download.
+
+    Args:
+        provider (str): 'gbif' or 'idigbio'.
+
+    Returns:
+        dict - Keyword arguments for iter_row_points and the csv delimiter.
+    """
+    if provider == 'idigbio':
+        return {
+            'species_getter': species_name_getter(33, 69),
+            'x_getter': key_getter(35, 'lon'),
+            'y_getter': key_getter(35, 'lat'),
+            'flags_getter': json_getter(31),
+            'delimiter': ','
+        }
+    return {
+        'species_getter': itemgetter(9),
+        'x_getter': itemgetter(22),
+        'y_getter': itemgetter(21),
+        'flags_getter': gbif_flag_getter(49),
+        'delimiter': '\t'
+    }
+
+
+# .............................................................................
+def iter_row_points(rows, species_getter, x_getter, y_getter,
+                    flags_getter=None, rejected=None):
+    """Convert delimited rows to points, skipping rows that fail.
+
+    Args:
+        rows (iterable of list): The rows of a delimited file.
+        species_getter (function): Gets the species name from a row.
+        x_getter (function): Gets the x coordinate from a row.
+        y_getter (function): Gets the y coordinate from a row.
+        flags_getter (function): Gets the flags from a row.
+        rejected (Counter): If provided, the number of rows skipped for each
+            reason is added to it, with the reasons of the occurrence parser.
+
+    Yields:
+        Point - The points in row order.  Points with equal species names or
+            flags share one interned copy of them.
+    """
+    if rejected is None:
+        rejected = Counter()
+    species_names = {}
+    flag_values = {}
+    for row in rows:
+        try:
+            flags = []
+            if flags_getter is not None:
+                try:
+                    flags = flags_getter(row)
+                except (KeyError, TypeError, ValueError):
+                    rejected[REJECT_FLAGS] += 1
+                    continue
+                flags_key = tuple(flags) if isinstance(flags, list) else flags
+                flags = flag_values.setdefault(flags_key, flags)
+            species_name = species_getter(row)
+            try:
+                x = float(x_getter(row))
+                y = float(y_getter(row))
+            except (KeyError, TypeError, ValueError):
+                rejected[REJECT_COORDINATES] += 1
+                continue
+        except IndexError:
+            rejected[REJECT_FIELDS] += 1
+            continue
+        yield Point(
+            species_names.setdefault(species_name, species_name), x, y, flags)
+
+
+# .............................................................................
+def read_download_batch(points):
+    """Collect download points into a PointBatch.
+
+    The batch holds species ids and flag bits instead of a string per point,
+    using far less memory than a list of points.
 
     Args:
-        filename (str): The file location of the GBIF download.
+        points (iterable of Point): The points to collect.
+
+    Returns:
+        PointBatch - The points, with flags assigned by a new vocabulary of
+            the known GBIF issues and iDigBio flags.
     """
-    return convert_delimited_to_point(
-        filename, itemgetter(9), itemgetter(22), itemgetter(21),
-        flags_getter=gbif_flag_getter(49), delimiter='\t', headers=True)
+    builder = PointBatchBuilder(flag_vocabulary=get_flag_vocabulary())
+    for point in points:
+        flags = point.flags
+        if isinstance(flags, str):
+            flags = flags.split(',')
+        builder.add_point(point.species_name, point.x, point.y, flags)
+    return builder.build()
 
 
 # .............................................................................
-def convert_idigbio_download(filename):
-    """Convert a iDigBio download to points.
+def iter_download(filename, provider, rejected=None):
+    """Iterate over the points of a download without loading them all.
+
+    Zip and gzip downloads are decompressed as a stream in a background
+    thread while the rows are parsed.
 
     Args:
-        filename (str): The file location of the iDigBio download.
+        filename (str): The file location of the download.
+        provider (str): 'gbif' or 'idigbio'.
+        rejected (Counter): If provided, the number of rows skipped for each
+            reason is added to it, see iter_row_points.
+
+    Yields:
+        Point - The points in file order.
     """
-    return convert_delimited_to_point(
-        filename, species_name_getter(33, 69), key_getter(35, 'lon'),
-        key_getter(35, 'lat'),
-        flags_getter=json_getter(31), delimiter=',', headers=True)
+    getters = get_download_getters(provider)
+    delimiter = getters.pop('delimiter')
+    with open_text(filename, read_ahead=True) as in_file:
+        reader = csv.reader(in_file, delimiter=delimiter)
+        next(reader, None)
+        for point in iter_row_points(reader, rejected=rejected, **getters):
+            yield point
+
 
 # .............................................................................
-def write_points(points, base_dir, service_suffix):
-    """Write the sorted points into separate directories and files.
+def get_range_parser(filename, provider):
+    """Get a function that parses a byte range of a download into points.
+
+    Args:
+        filename (str): The file location of the download.
+        provider (str): 'gbif' or 'idigbio'.
+
+    Returns:
+        function - A function that takes a (start, end) byte range and
+            returns a list of the points in it and a Counter of the rows
+            skipped for each reason.
+    """
+    getters = get_download_getters(provider)
+    delimiter = getters.pop('delimiter')
+    # .......................
+    def parse_range(byte_range):
+        reader = csv.reader(
+            open_byte_range(filename, byte_range), delimiter=delimiter)
+        rejected = Counter()
+        return list(
+            iter_row_points(reader, rejected=rejected, **getters)), rejected
+    return parse_range
+
+
+# .............................................................................
+def iter_download_ranges(filename, provider, max_workers=None,
+                         range_size=DEFAULT_RANGE_SIZE, rejected=None):
+    """Parse a download in parallel byte ranges.
+
+    The file is split into newline aligned byte ranges that are parsed in
+    worker processes.  Records with newlines inside quoted fields are not
+    supported, see common.byte_ranges, so only the tab delimited downloads of
+    RANGE_PROVIDERS can be parsed this way.  iDigBio downloads are comma
+    delimited CSV that may quote newlines.
 
     Args:
-        points (list of Point): A list of points sorted by species name.
+        filename (str): The file location of the download.
+        provider (str): 'gbif'.
+        max_workers (int): The number of parsing processes.
+        range_size (int): The approximate number of bytes in each range.
+        rejected (Counter): If provided, the number of rows skipped for each
+            reason is added to it, see iter_row_points.
+
+    Yields:
+        Point - The points in file order.
+
+    Raises:
+        ValueError: Raised if the provider is not in RANGE_PROVIDERS.
+    """
+    if provider not in RANGE_PROVIDERS:
+        raise ValueError(
+            '{} downloads may have newlines in quoted fields and cannot be '
+            'parsed in byte ranges'.format(provider))
+    if rejected is None:
+        rejected = Counter()
+    for range_points, range_rejected in map_in_order(
+            get_range_parser, (filename, provider),
+            get_byte_ranges(filename, range_size, skip_header=True),
+            backend='process', max_workers=max_workers):
+        rejected.update(range_rejected)
+        for point in range_points:
+            yield point
+
+
+# .............................................................................
+def write_points(points, base_dir, service_suffix, max_open=DEFAULT_MAX_OPEN,
+                 sorted_points=False):
+    """Write the points into separate directories and files for each species.
+
+    Species files are written through a WriterPool, so the points of a
+    species do not need to be contiguous, although sorted points need the
+    fewest file reopens.  With sorted_points, each species file is written
+    and closed as soon as the next species starts.
+
+    Args:
+        points (iterable of Point): Points, usually sorted by species name.
         base_dir (str): The base directory to write points.
         service_suffix (str): The service suffix for the data files.
+        max_open (int): The maximum number of species files open at once.
+        sorted_points (bool): The points are sorted by species name.
     """
-    current_species = None
-    out_file = None
-    for point in points:
-        if point.species_name != current_species:
-            if out_file:
-                out_file.close()
-            current_species = point.species_name
-            #print(point)
-            #print(current_species)
-            out_file = open(
-                get_species_filename(
-                    current_species, base_dir, service_suffix, '.csv'), 'w')
-        if isinstance(point.flags, list):
-            flags = ','.join(point.flags)
-        elif isinstance(point.flags, str):
-            flags = point.flags
-        else:
-            flags = ''
-        out_file.write(
-            '{}, {}, {}, "{}"\n'.format(
-                point.species_name, point.x, point.y, flags))
-    if out_file:
-        out_file.close()
+    species_filenames = {}
+    with WriterPool(
+            lambda filename: filename, max_open=max_open,
+            sorted_keys=sorted_points) as pool:
+        for point in points:
+            if point.species_name not in species_filenames:
+                species_filenames[point.species_name] = get_species_filename(
+                    point.species_name, base_dir, service_suffix, '.csv')
+            if isinstance(point.flags, list):
+                flags = ','.join(point.flags)
+            elif isinstance(point.flags, str):
+                flags = point.flags
+            else:
+                flags = ''
+            pool.write(
+                species_filenames[point.species_name],
+                '{}, {}, {}, "{}"\n'.format(
+                    point.species_name, point.x, point.y, flags))
+
+
+# .............................................................................
+def write_store(points, store_dir, provider):
+    """Add the points of a download to an occurrence store.
+
+    The points are added to any store already in store_dir, so the downloads
+    of each provider can be written to the same store.
+
+    Args:
+        points (iterable of Point): Points sorted by species name.
+        store_dir (str): The occurrence store directory.
+        provider (str): The data provider that created the download.
+
+    Raises:
+        ValueError: Raised if the points of a species are not contiguous or
+            the species was already stored for the provider.
+    """
+    with OccurrenceStoreWriter(store_dir, append=True) as writer:
+        for species_name, species_points in groupby(
+                points, key=attrgetter('species_name')):
+            writer.add_species(
+                provider, species_name, read_download_batch(species_points))
+
 
 # .............................................................................
 def main():
     """Main method for script."""
     parser = argparse.ArgumentParser()
+    parser.add_argument(
+        '-m', '--max_memory', type=int,
+        help='Sort in bounded memory: runs of points are sorted in parallel, '
+        'spilled to temporary files, and merged, keeping the runs under about '
+        'this many megabytes.')
+    parser.add_argument(
+        '-w', '--max_workers', type=int, default=os.cpu_count() or 1,
+        help='Number of processes sorting runs with --max_memory.')
+    parser.add_argument(
+        '-t', '--temp_dir', type=str,
+        help='Directory for temporary sorted runs with --max_memory.')
+    parser.add_argument(
+        '--max_merge_runs', type=int, default=DEFAULT_MAX_MERGE_RUNS,
+        help='Maximum number of sorted runs merged at once with --max_memory, '
+        'more runs are merged in several passes.')
+    parser.add_argument(
+        '-p', '--parse_workers', type=int,
+        help='Parse a GBIF download in this many processes, each reading a '
+        'range of lines.  iDigBio downloads are always parsed in order.')
+    parser.add_argument(
+        '-o', '--max_open', type=int, default=DEFAULT_MAX_OPEN,
+        help='Maximum number of species files open at once.')
     parser.add_argument(
         'provider', type=str, choices=('idigbio', 'gbif'),
         help='The data provider service that created the download.')
     parser.add_argument(
-        'filename', type=str, help='The downloaded occurrence data file.')
+        'filename', type=str,
+        help='The downloaded occurrence data file, or the zip or gzip archive '
+        'containing it.')
     parser.add_argument(
-        'base_dir', type=str, help='The base directory to write data')
+        '-s', '--store_dir', type=str,
+        help='Add the points to the occurrence store in this directory '
+        'instead of writing species files.')
+    parser.add_argument(
+        'base_dir', type=str, nargs='?',
+        help='The base directory to write species files')
     args = parser.parse_args()
-    print('Getting points...')
-    if args.provider == 'idigbio':
-        points = convert_idigbio_download(args.filename)
-        service_suffix = '_idigbio'
+    if args.base_dir is None and args.store_dir is None:
+        parser.error('Either base_dir or --store_dir is required.')
+    if args.parse_workers is not None:
+        if is_archive(args.filename):
+            print(
+                'Byte ranges cannot be read from an archive, parsing in '
+                'order.')
+            args.parse_workers = None
+        elif args.provider not in RANGE_PROVIDERS:
+            print(
+                'Byte ranges can split {} records with quoted newlines, '
+                'parsing in order.'.format(args.provider))
+            args.parse_workers = None
+    service_suffix = '_{}'.format(args.provider)
+    rejected = Counter()
+    if args.max_memory is not None or args.parse_workers is not None:
+        # Stream the download instead of loading it into a list
+        sorted_points = args.max_memory is not None
+        if args.parse_workers is not None:
+            points = iter_download_ranges(
+                args.filename, args.provider, max_workers=args.parse_workers,
+                rejected=rejected)
+        else:
+            points = iter_download(
+                args.filename, args.provider, rejected=rejected)
+        if args.max_memory is not None:
+            points = external_sort(
+                points, key=attrgetter('species_name'),
+                run_size=get_run_size(args.max_memory, args.max_workers),
+                temp_dir=args.temp_dir, max_workers=args.max_workers,
+                max_merge_runs=args.max_merge_runs)
+        elif args.store_dir is not None:
+            # The store needs the points of each species together
+            points = read_download_batch(
+                points).sort_by_species().iter_points()
+        # Otherwise the writer pool appends points to each species file in
+        #    file order, the same files a stable sort by species would give
     else:
-        points = convert_gbif_download(args.filename)
-        service_suffix = '_gbif'
-    print('Sorting points...')
-    points.sort(key=attrgetter('species_name'))
+        print('Getting points...')
+        batch = read_download_batch(
+            iter_download(args.filename, args.provider, rejected=rejected))
+        print('Sorting points...')
+        points = batch.sort_by_species().iter_points()
+        sorted_points = True
     print('Writing points...')
-    write_points(points, args.base_dir, service_suffix)
+    if args.store_dir is not None:
+        write_store(points, args.store_dir, args.provider)
+    else:
+        write_points(
+            points, args.base_dir, service_suffix, max_open=args.max_open,
+            sorted_points=sorted_points)
+    for reason in REJECT_REASONS:
+        print('Number of rows skipped ({}): {}'.format(
+            reason, rejected[reason]))
 
 
 # .............................................................................
@@ -0,0 +1,89 @@
+"""Shared pytest configuration for the tools package tests.
+
+The tools package is the Methods/code/python directory.  If it has not been
+installed or added to the python path, it is registered here under the name
+tools so the tests can import it the same way the scripts do.
+
+The wgsrpd_dir fixture writes the small WGSRPD level shapefiles described by
+wgsrpd_features for tests of the region filters.
+"""
+import importlib.util
+import os
+import sys
+
+import pytest
+
+TOOLS_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+if importlib.util.find_spec('tools') is None:
+    _spec = importlib.util.spec_from_file_location(
+        'tools', os.path.join(TOOLS_DIR, '__init__.py'),
+        submodule_search_locations=[TOOLS_DIR])
+    _module = importlib.util.module_from_spec(_spec)
+    sys.modules['tools'] = _module
+    _spec.loader.exec_module(_module)
+
+
+# .............................................................................
+# Small WGSRPD regions, (code, WKT) features for each level.  Region CCC has
+#    two features and level 4 splits AAA along its diagonal.
+WGSRPD_FEATURES = {
+    1: [
+        (1, 'POLYGON((0 0, 20 0, 20 20, 0 20, 0 0))'),
+        (2, 'POLYGON((20 0, 40 0, 40 20, 20 20, 20 0))')],
+    2: [
+        (10, 'POLYGON((0 0, 20 0, 20 10, 0 10, 0 0))'),
+        (11, 'POLYGON((0 10, 20 10, 20 20, 0 20, 0 10))'),
+        (20, 'POLYGON((20 0, 40 0, 40 20, 20 20, 20 0))')],
+    3: [
+        ('AAA', 'POLYGON((0 0, 10 0, 10 10, 0 10, 0 0))'),
+        ('BBB', 'POLYGON((10 0, 20 0, 20 10, 10 10, 10 0))'),
+        ('CCC', 'POLYGON((0 10, 10 10, 10 20, 0 20, 0 10))'),
+        ('CCC', 'POLYGON((12 12, 18 12, 18 18, 12 18, 12 12))'),
+        ('DDD', 'POLYGON((20 0, 40 0, 40 20, 20 20, 20 0), '
+                '(25 5, 35 5, 30 15, 25 5))')],
+    4: [
+        ('AAA-OO', 'POLYGON((0 0, 10 0, 0 10, 0 0))'),
+        ('AAA-XX', 'POLYGON((10 0, 10 10, 0 10, 10 0))'),
+        ('BBB-OO', 'POLYGON((10 0, 20 0, 20 10, 10 10, 10 0))')]
+}
+
+
+# .............................................................................
+@pytest.fixture(scope='session')
+def wgsrpd_features():
+    """The (code, WKT) features of each level written by wgsrpd_dir."""
+    return WGSRPD_FEATURES
+
+
+# .............................................................................
+@pytest.fixture(scope='session')
+def wgsrpd_dir(tmp_path_factory):
+    """Write WGSRPD_FEATURES as level shapefiles and return their directory.
+
+    Tests using this fixture need osgeo.
+    """
+    from osgeo import ogr
+    from tools.data_preparation.wgsrpd import get_tdwg_level_shapefile
+
+    base_dir = str(tmp_path_factory.mktemp('wgsrpd'))
+    driver = ogr.GetDriverByName('ESRI Shapefile')
+    for level, features in WGSRPD_FEATURES.items():
+        code_field = 'LEVEL{}_COD'.format(level)
+        os.makedirs(os.path.join(base_dir, 'level{}'.format(level)))
+        dataset = driver.CreateDataSource(
+            get_tdwg_level_shapefile(level, base_dir))
+        layer = dataset.CreateLayer(
+            'level{}'.format(level), geom_type=ogr.wkbPolygon)
+        layer.CreateField(ogr.FieldDefn(
+            code_field, ogr.OFTInteger if level < 3 else ogr.OFTString))
+        layer.CreateField(ogr.FieldDefn('NAME', ogr.OFTString))
+        for code, wkt in features:
+            feature = ogr.Feature(layer.GetLayerDefn())
+            feature.SetField(code_field, code)
+            feature.SetField('NAME', 'Region {}'.format(code))
+            feature.SetGeometry(ogr.CreateGeometryFromWkt(wkt))
+            layer.CreateFeature(feature)
+            feature = None
+        layer = dataset = None
+    return base_dir
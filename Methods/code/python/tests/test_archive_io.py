@@ -0,0 +1,137 @@
+"""Tests for the archive io module."""
+import gzip
+import io
+import zipfile
+
+import pytest
+
+from tools.common.archive_io import (
+    ReadAheadReader, get_archive_member, is_archive, open_text)
+
+TEXT = 'species\tx\ty\r\nSpecies a\t1.5\t2.0\nSpécies b\t-3\t4\n' * 50
+
+
+# .............................................................................
+def _write_zip(filename, members):
+    with zipfile.ZipFile(filename, 'w') as zip_file:
+        for name, text in members.items():
+            zip_file.writestr(name, text)
+    return str(filename)
+
+
+# .............................................................................
+class _FailingStream(io.RawIOBase):
+    """A binary stream that fails after its first read."""
+    # ..........................
+    def __init__(self):
+        super().__init__()
+        self.reads = 0
+
+    # ..........................
+    def readable(self):
+        return True
+
+    # ..........................
+    def read(self, size=-1):
+        self.reads += 1
+        if self.reads > 1:
+            raise IOError('Read failed')
+        return b'first'
+
+
+# .............................................................................
+def test_is_archive():
+    """Archives are recognised by extension, in any case."""
+    assert is_archive('download.zip')
+    assert is_archive('points.csv.GZ')
+    assert is_archive('points.gzip')
+    assert not is_archive('points.csv')
+    assert not is_archive('zip')
+
+
+# .............................................................................
+def test_get_archive_member(tmp_path):
+    """An explicit member is used, otherwise a default data file."""
+    filename = _write_zip(tmp_path / 'a.zip', {
+        'meta.xml': '', 'occurrence.csv': '', 'occurrence.txt': ''})
+    with zipfile.ZipFile(filename) as zip_file:
+        assert get_archive_member(zip_file) == 'occurrence.txt'
+        assert get_archive_member(zip_file, 'meta.xml') == 'meta.xml'
+        with pytest.raises(ValueError, match='not found'):
+            get_archive_member(zip_file, 'other.txt')
+
+
+# .............................................................................
+def test_get_archive_member_single_file(tmp_path):
+    """The only file in an archive is used, directories are ignored."""
+    filename = _write_zip(tmp_path / 'a.zip', {
+        'data/': '', 'data/points.csv': ''})
+    with zipfile.ZipFile(filename) as zip_file:
+        assert get_archive_member(zip_file) == 'data/points.csv'
+    filename = _write_zip(tmp_path / 'b.zip', {
+        'points.csv': '', 'other.csv': ''})
+    with zipfile.ZipFile(filename) as zip_file:
+        with pytest.raises(ValueError, match='Cannot choose'):
+            get_archive_member(zip_file)
+
+
+# .............................................................................
+@pytest.mark.parametrize('read_ahead', [False, True])
+def test_open_text(tmp_path, read_ahead):
+    """Plain, gzip and zip files read as the same text."""
+    plain_filename = tmp_path / 'points.csv'
+    plain_filename.write_bytes(TEXT.encode('utf-8'))
+    gzip_filename = tmp_path / 'points.csv.gz'
+    with gzip.open(gzip_filename, 'wb') as gzip_out:
+        gzip_out.write(TEXT.encode('utf-8'))
+    zip_filename = _write_zip(tmp_path / 'points.zip', {
+        'meta.xml': 'meta', 'occurrence.txt': TEXT})
+    for filename in (plain_filename, gzip_filename, zip_filename):
+        with open_text(str(filename), read_ahead=read_ahead) as in_file:
+            # Newlines are not translated for the csv module
+            assert in_file.readline() == 'species\tx\ty\r\n'
+            assert in_file.read() == TEXT[len('species\tx\ty\r\n'):]
+    with open_text(
+            zip_filename, member='meta.xml', read_ahead=read_ahead) as in_file:
+        assert in_file.read() == 'meta'
+
+
+# .............................................................................
+def test_read_ahead_reader_small_chunks():
+    """Reads smaller and larger than the chunks return every byte."""
+    data = bytes(range(256)) * 40
+    raw_reader = ReadAheadReader(io.BytesIO(data), chunk_size=7, max_chunks=2)
+    # Raw reads stop at the end of a chunk
+    assert raw_reader.read(100) == data[:7]
+    raw_reader.close()
+    reader = io.BufferedReader(
+        ReadAheadReader(io.BytesIO(data), chunk_size=7, max_chunks=2),
+        buffer_size=16)
+    assert reader.read(3) == data[:3]
+    assert reader.read(100) == data[3:103]
+    assert reader.read() == data[103:]
+    assert reader.read(10) == b''
+    reader.close()
+    assert reader.closed
+
+
+# .............................................................................
+def test_read_ahead_reader_raises_read_errors():
+    """Errors in the background thread are raised by the reader."""
+    reader = ReadAheadReader(_FailingStream(), chunk_size=5)
+    assert reader.read(5) == b'first'
+    with pytest.raises(IOError, match='Read failed'):
+        reader.read(5)
+    reader.close()
+
+
+# .............................................................................
+def test_read_ahead_reader_close_stops_thread():
+    """Closing the reader part way stops the thread and the raw stream."""
+    raw = io.BytesIO(b'x' * 1000)
+    reader = ReadAheadReader(raw, chunk_size=1, max_chunks=1)
+    assert reader.read(1) == b'x'
+    reader.close()
+    assert not reader._thread.is_alive()
+    assert raw.closed
+    reader.close()
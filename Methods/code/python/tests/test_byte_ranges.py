@@ -0,0 +1,63 @@
+"""Tests for the byte ranges module."""
+import pytest
+
+from tools.common.byte_ranges import get_byte_ranges, open_byte_range
+
+
+# .............................................................................
+def _write_file(tmp_path, data):
+    filename = str(tmp_path / 'data.txt')
+    with open(filename, 'wb') as out_file:
+        out_file.write(data)
+    return filename
+
+
+# .............................................................................
+def _get_data(num_lines, trailing_newline=True):
+    lines = [
+        'header\tx\ty'] + [
+            'Spécies {}\t{}\t{}'.format(i, 'x' * (i % 17), i)
+            for i in range(num_lines)]
+    text = '\n'.join(lines)
+    if trailing_newline:
+        text += '\n'
+    return text.encode('utf-8')
+
+
+# .............................................................................
+@pytest.mark.parametrize('range_size', [1, 7, 64, 1000, 1000000])
+@pytest.mark.parametrize('trailing_newline', [True, False])
+def test_ranges_rejoin_into_file(tmp_path, range_size, trailing_newline):
+    """The ranges are contiguous, line aligned, and cover the whole file."""
+    data = _get_data(200, trailing_newline=trailing_newline)
+    filename = _write_file(tmp_path, data)
+    ranges = get_byte_ranges(filename, range_size)
+    assert ranges[0][0] == 0
+    assert ranges[-1][1] == len(data)
+    for (_, end), (start, _) in zip(ranges, ranges[1:]):
+        assert end == start
+        assert data[start - 1:start] == b'\n'
+    text = ''.join(
+        open_byte_range(filename, byte_range).read()
+        for byte_range in ranges)
+    assert text.encode('utf-8') == data
+
+
+# .............................................................................
+def test_skip_header(tmp_path):
+    """With skip_header, the ranges cover everything after the first line."""
+    data = _get_data(50)
+    filename = _write_file(tmp_path, data)
+    ranges = get_byte_ranges(filename, 100, skip_header=True)
+    header_size = data.index(b'\n') + 1
+    assert ranges[0][0] == header_size
+    text = ''.join(
+        open_byte_range(filename, byte_range).read()
+        for byte_range in ranges)
+    assert text.encode('utf-8') == data[header_size:]
+
+
+# .............................................................................
+def test_empty_file(tmp_path):
+    """An empty file has no ranges."""
+    assert get_byte_ranges(_write_file(tmp_path, b''), 10) == []
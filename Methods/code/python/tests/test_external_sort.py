@@ -0,0 +1,81 @@
+"""Tests for the external sort module."""
+from operator import itemgetter
+import os
+import random
+
+import pytest
+
+from tools.common import external_sort as external_sort_module
+from tools.common.external_sort import external_sort, get_run_size
+
+
+# .............................................................................
+def _get_items(num_items, seed=0):
+    rng = random.Random(seed)
+    # Few distinct keys so stability is tested, with the input order kept
+    return [(rng.randrange(20), i) for i in range(num_items)]
+
+
+# .............................................................................
+@pytest.mark.parametrize('backend', ['thread', 'process'])
+@pytest.mark.parametrize('num_items, run_size, max_merge_runs', [
+    (50, 100, 4),
+    (1000, 100, 64),
+    (1000, 10, 3),
+    (1001, 7, 2)])
+def test_matches_sorted(tmp_path, backend, num_items, run_size,
+                        max_merge_runs):
+    """The output equals sorted() with the same key, including ties."""
+    items = _get_items(num_items)
+    result = list(external_sort(
+        iter(items), key=itemgetter(0), run_size=run_size,
+        temp_dir=str(tmp_path), backend=backend, max_workers=2,
+        max_merge_runs=max_merge_runs))
+    assert result == sorted(items, key=itemgetter(0))
+    # Temporary runs are removed
+    assert os.listdir(str(tmp_path)) == []
+
+
+# .............................................................................
+def test_merge_fan_in_is_bounded(tmp_path, monkeypatch):
+    """No merge opens more than max_merge_runs run files."""
+    merge_sizes = []
+    merge_run_files = external_sort_module._merge_run_files
+
+    def counting_merge(run_filenames, key):
+        merge_sizes.append(len(run_filenames))
+        return merge_run_files(run_filenames, key)
+    monkeypatch.setattr(
+        external_sort_module, '_merge_run_files', counting_merge)
+    items = _get_items(500)
+    result = list(external_sort(
+        items, key=itemgetter(0), run_size=5, temp_dir=str(tmp_path),
+        backend='thread', max_merge_runs=4))
+    assert result == sorted(items, key=itemgetter(0))
+    # 100 runs need three passes of merging before the final merge
+    assert max(merge_sizes) <= 4
+    assert len(merge_sizes) == 25 + 7 + 2 + 1
+
+
+# .............................................................................
+def test_sorts_without_key():
+    """Items are compared directly without a key."""
+    rng = random.Random(1)
+    items = [rng.random() for _ in range(300)]
+    assert list(external_sort(
+        items, run_size=50, backend='thread')) == sorted(items)
+
+
+# .............................................................................
+def test_max_merge_runs_must_merge():
+    """A fan in below two cannot merge runs."""
+    with pytest.raises(ValueError):
+        list(external_sort([3, 2, 1], max_merge_runs=1))
+
+
+# .............................................................................
+def test_get_run_size():
+    """Run sizes keep every in-flight run under the memory limit."""
+    run_size = get_run_size(100, 4, item_size=1000)
+    assert run_size * 1000 * 9 <= 100 * 1024 * 1024
+    assert get_run_size(0, 4) == 1
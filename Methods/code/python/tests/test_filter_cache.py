@@ -0,0 +1,61 @@
+"""Tests for the locality filter cache module."""
+from collections import Counter
+
+from tools.data_preparation.filter_cache import LocalityFilterCache
+
+
+# .............................................................................
+def _get_localities(*codes):
+    return [{'tdwgLevel': 3, 'tdwgCode': code} for code in codes]
+
+
+# .............................................................................
+def _get_cache(max_size=2):
+    built = []
+
+    def build(locality_dicts_list):
+        built.append(LocalityFilterCache.get_key(locality_dicts_list))
+        return object()
+    return LocalityFilterCache(build, max_size=max_size), built
+
+
+# .............................................................................
+def test_same_localities_share_a_filter():
+    """Equal locality sets in any order reuse one built filter."""
+    cache, built = _get_cache()
+    first = cache.get_filter(_get_localities('AAA', 'BBB'))
+    assert cache.get_filter(_get_localities('BBB', 'AAA')) is first
+    assert len(built) == 1
+    assert cache.get_stats()['hits'] == 1
+    assert cache.get_stats()['misses'] == 1
+
+
+# .............................................................................
+def test_least_recently_used_filter_is_evicted():
+    """The cache keeps at most max_size filters, dropping the oldest use."""
+    cache, built = _get_cache(max_size=2)
+    cache.get_filter(_get_localities('AAA'))
+    cache.get_filter(_get_localities('BBB'))
+    cache.get_filter(_get_localities('AAA'))
+    cache.get_filter(_get_localities('CCC'))
+    assert len(cache) == 2
+    cache.get_filter(_get_localities('AAA'))
+    cache.get_filter(_get_localities('BBB'))
+    assert len(built) == 4
+    assert cache.get_stats()['evictions'] == 2
+
+
+# .............................................................................
+def test_counts_are_added_per_call():
+    """A counts Counter only receives the counters of its own calls."""
+    cache, _ = _get_cache(max_size=1)
+    first_counts = Counter()
+    cache.get_filter(_get_localities('AAA'), counts=first_counts)
+    cache.get_filter(_get_localities('AAA'), counts=first_counts)
+    second_counts = Counter()
+    cache.get_filter(_get_localities('BBB'), counts=second_counts)
+    assert first_counts == {'hits': 1, 'misses': 1}
+    assert second_counts == {'misses': 1, 'evictions': 1}
+    total = first_counts + second_counts
+    stats = cache.get_stats()
+    assert all(total[key] == stats[key] for key in total)
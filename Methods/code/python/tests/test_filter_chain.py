@@ -0,0 +1,56 @@
+"""Tests for the filter chain module."""
+import numpy as np
+
+from tools.data_preparation.filter_chain import FilterChain, INITIAL_STAGE
+from tools.data_preparation.point_batch import PointBatch
+
+
+# .............................................................................
+def _get_batch(num_points):
+    return PointBatch(
+        ['Species a'], np.zeros(num_points, dtype=np.int32),
+        np.arange(num_points, dtype=float), np.zeros(num_points))
+
+
+# .............................................................................
+def test_stages_see_only_surviving_points():
+    """Each stage is given the points left by the stages before it."""
+    seen = []
+
+    def below_six(batch):
+        seen.append(len(batch))
+        return batch.x < 6
+
+    def even(batch):
+        seen.append(len(batch))
+        return batch.x % 2 == 0
+
+    result = FilterChain(
+        [('below_six', below_six), ('even', even)]).apply(_get_batch(10))
+    assert seen == [10, 6]
+    assert result.initial_count == 10
+    assert list(result.removed.items()) == [('below_six', 4), ('even', 3)]
+    assert result.points.x.tolist() == [0.0, 2.0, 4.0]
+
+
+# .............................................................................
+def test_none_stage_is_reported_with_no_removals():
+    """A stage without a filter is skipped but still counted."""
+    result = FilterChain(
+        [('skipped', None), ('all', lambda batch: batch.x >= 0)]).apply(
+            _get_batch(3))
+    assert result.removed == {'skipped': 0, 'all': 0}
+    assert len(result.points) == 3
+
+
+# .............................................................................
+def test_get_limiting_stage():
+    """The limiting stage is the first to leave fewer than the minimum."""
+    result = FilterChain([
+        ('first', lambda batch: batch.x < 8),
+        ('second', lambda batch: batch.x < 3)]).apply(_get_batch(10))
+    assert result.get_limiting_stage(11) == INITIAL_STAGE
+    assert result.get_limiting_stage(8) == 'second'
+    assert result.get_limiting_stage(9) == 'first'
+    assert result.get_limiting_stage(4) == 'second'
+    assert result.get_limiting_stage(3) is None
@@ -0,0 +1,209 @@
+"""Tests for the filters module."""
+import itertools
+import json
+import os
+
+import numpy as np
+import pytest
+
+pytest.importorskip('osgeo')
+
+from tools.data_preparation.filters import (  # noqa: E402
+    get_attribute_flag_mask_filter, get_bounding_box_filter,
+    get_bounding_box_mask_filter, get_data_flag_filter,
+    get_data_flag_mask_filter, get_flag_mask_filter, get_point_mask_filter,
+    get_unique_localities_filter, get_unique_localities_mask_filter)
+from tools.data_preparation.occurrence_flags import (  # noqa: E402
+    get_flag_vocabulary)
+from tools.data_preparation.point_batch import (  # noqa: E402
+    FlagVocabulary, Point, PointBatch)
+
+WRANGLER_DIR = os.path.join(
+    os.path.dirname(__file__), '..', '..', '..', '..', 'OCBILS',
+    'configuration', 'data_wranglers')
+# Flags of the test points, mixing known and unknown flags
+POINT_FLAGS = [
+    [], ['TAXON_MATCH_FUZZY'], ['ZERO_COORDINATE'],
+    ['TAXON_MATCH_FUZZY', 'ZERO_COORDINATE'], ['unknown_flag'],
+    ['geopoint_bounds', 'unknown_flag'], ['geopoint_bounds'],
+    ['rev_geocode_mismatch', 'geopoint_0_coord']]
+
+# Exact halves at one decimal place, and the points they round onto
+TIE_X = [0.5, 0.0, 1.5, 2.0, 2.5, 3.0, -0.5, -1.5, -2.0]
+
+
+# .............................................................................
+def _get_batch(x, y=None, precision=None):
+    if y is None:
+        y = np.zeros(len(x))
+    batch = PointBatch(['Species a'], np.zeros(len(x), dtype=np.int32), x, y)
+    return batch.with_precision(precision)
+
+
+# .............................................................................
+def test_bounding_box_mask_filter_matches_point_filter():
+    """The bounding box mask filter keeps points on the box edges."""
+    batch = _get_batch(
+        [-10.0, -5.0, 0.0, 5.0, 10.0, 0.0, 0.0],
+        [0.0, 0.0, 0.0, 2.0, 0.0, -2.5, 3.0])
+    bbox = (-5.0, -2.0, 5.0, 2.0)
+    mask = get_bounding_box_mask_filter(*bbox)(batch)
+    assert mask.tolist() == [False, True, True, True, False, False, False]
+    assert mask.tolist() == get_point_mask_filter(
+        get_bounding_box_filter(*bbox))(batch).tolist()
+
+
+# .............................................................................
+def test_data_flag_mask_filter_matches_point_filter():
+    """Points with any of the filter flags are removed."""
+    vocabulary = FlagVocabulary()
+    batch = PointBatch.from_points([
+        Point('Species a', 0.0, 0.0, flags) for flags in (
+            [], ['ok'], ['bad'], ['ok', 'worse'], ['unknown'])],
+        flag_vocabulary=vocabulary)
+    filter_flags = ['bad', 'worse', 'never_seen']
+    mask = get_data_flag_mask_filter(filter_flags, vocabulary)(batch)
+    assert mask.tolist() == [True, True, False, False, True]
+    assert mask.tolist() == get_point_mask_filter(
+        get_data_flag_filter(filter_flags))(batch).tolist()
+
+
+# .............................................................................
+def test_unique_localities_keeps_first_of_each():
+    """Only the first point at each locality is kept."""
+    batch = _get_batch([1.0, 2.0, 1.0, 2.0], [0.0, 0.0, 0.0, 1.0])
+    mask = get_unique_localities_mask_filter()(batch)
+    assert mask.tolist() == [True, True, False, True]
+
+
+# .............................................................................
+@pytest.mark.parametrize('precision', [None, 1])
+def test_unique_localities_rounds_half_to_even(precision):
+    """Exact halves round to the even value for float and fixed point."""
+    mask = get_unique_localities_mask_filter(decimal_precision=0)(
+        _get_batch(TIE_X, precision=precision))
+    # 0.5 -> 0, 1.5 -> 2, 2.5 -> 2, 3.0 -> 3, -0.5 -> 0, -1.5 -> -2
+    assert mask.tolist() == [
+        True, False, True, False, False, True, False, True, False]
+
+
+# .............................................................................
+def test_fixed_point_and_float_masks_match():
+    """Fixed point batches drop the same duplicates as float batches."""
+    rng = np.random.default_rng(42)
+    x = rng.integers(-40, 40, 500) / 20.0
+    y = rng.integers(-40, 40, 500) / 20.0
+    for decimal_precision in (None, 0, 1):
+        mask_filter = get_unique_localities_mask_filter(
+            decimal_precision=decimal_precision)
+        expected = mask_filter(_get_batch(x, y))
+        for precision in (2, 4):
+            assert np.array_equal(
+                mask_filter(_get_batch(x, y, precision=precision)), expected)
+
+
+# .............................................................................
+def test_unique_localities_point_filter():
+    """The point filter keeps the first point at each locality it sees."""
+    unique_filter = get_unique_localities_filter()
+    points = [
+        Point('Species a', x, y, [])
+        for x, y in [(1.0, 2.0), (1.0, 2.0), (2.0, 1.0), (-0.0, 0.0),
+                     (0.0, 0.0), (1.0, 2.0)]]
+    assert [unique_filter(point) for point in points] == [
+        True, False, True, True, False, False]
+    # A new filter does not remember the localities of another species
+    assert get_unique_localities_filter()(points[0])
+
+
+# .............................................................................
+@pytest.mark.parametrize('decimal_precision', [None, 0, 1, 2])
+def test_point_and_mask_filters_match(decimal_precision):
+    """The point and mask filters keep the same points."""
+    rng = np.random.default_rng(3)
+    x = rng.integers(-30, 30, 300) / 8.0
+    y = rng.integers(-30, 30, 300) / 8.0
+    batch = _get_batch(x, y)
+    unique_filter = get_unique_localities_filter(
+        decimal_precision=decimal_precision)
+    expected = [unique_filter(point) for point in batch.iter_points()]
+    mask = get_unique_localities_mask_filter(
+        decimal_precision=decimal_precision)(batch)
+    assert mask.tolist() == expected
+
+
+# .............................................................................
+def test_unique_localities_mask_filter_is_stateless():
+    """Each batch is judged on its own, as each species is separate."""
+    mask_filter = get_unique_localities_mask_filter()
+    batch = _get_batch([1.0, 1.0, 2.0])
+    assert mask_filter(batch).tolist() == [True, False, True]
+    assert mask_filter(batch).tolist() == [True, False, True]
+    assert mask_filter(_get_batch([])).tolist() == []
+
+
+# .............................................................................
+def _get_flag_batch(flag_vocabulary):
+    points = [
+        Point('Species a', 0.0, 0.0, flags) for flags in POINT_FLAGS]
+    return PointBatch.from_points(points, flag_vocabulary=flag_vocabulary)
+
+
+# .............................................................................
+def _get_flag_config(quantifier, operator, values):
+    return {
+        'wrangler_type': 'attribute_filter', 'attribute_name': 'issue',
+        'condition': {quantifier: {operator: values}}}
+
+
+# .............................................................................
+@pytest.mark.parametrize('quantifier, operator', list(itertools.product(
+    ['all', 'any'], ['in', 'not_in'])))
+@pytest.mark.parametrize('values', [
+    ['TAXON_MATCH_FUZZY'], ['ZERO_COORDINATE', 'geopoint_bounds'],
+    ['unknown_flag', 'geopoint_0_coord', 'rev_geocode_mismatch'],
+    ['never_seen_flag']])
+def test_attribute_flag_mask_filter(quantifier, operator, values):
+    """Flag conditions are evaluated as they are for each point's flags."""
+    flag_vocabulary = get_flag_vocabulary()
+    batch = _get_flag_batch(flag_vocabulary)
+    mask = get_attribute_flag_mask_filter(
+        _get_flag_config(quantifier, operator, values), flag_vocabulary)(
+            batch)
+    quantify = all if quantifier == 'all' else any
+    expected = [
+        quantify((flag in values) == (operator == 'in') for flag in flags)
+        for flags in POINT_FLAGS]
+    assert mask.tolist() == expected
+
+
+# .............................................................................
+@pytest.mark.parametrize('config', [
+    {'wrangler_type': 'accepted_name', 'attribute_name': 'issue'},
+    {'wrangler_type': 'attribute_filter', 'attribute_name': 'country'},
+    _get_flag_config('most', 'in', ['ZERO_COORDINATE']),
+    _get_flag_config('all', 'equals', ['ZERO_COORDINATE']),
+    {'wrangler_type': 'attribute_filter', 'attribute_name': 'issue',
+     'condition': {}}])
+def test_attribute_flag_mask_filter_unsupported(config):
+    """Configurations that are not flag conditions are rejected."""
+    with pytest.raises(ValueError):
+        get_attribute_flag_mask_filter(config, get_flag_vocabulary())
+
+
+# .............................................................................
+@pytest.mark.parametrize('config_filename', [
+    'gbif_flag_filter.json', 'idigbio_flag_filter.json'])
+def test_flag_filter_configurations(config_filename):
+    """The shipped flag filters match the data flag filter of their values."""
+    with open(os.path.join(WRANGLER_DIR, config_filename)) as in_json:
+        config = json.load(in_json)
+    flag_vocabulary = get_flag_vocabulary()
+    batch = _get_flag_batch(flag_vocabulary)
+    mask = get_flag_mask_filter(config, flag_vocabulary)(batch)
+    invalid_flags = config['condition']['all']['not_in']
+    assert mask.tolist() == get_flag_mask_filter(
+        invalid_flags, flag_vocabulary)(batch).tolist()
+    assert mask.tolist() == [
+        not set(flags) & set(invalid_flags) for flags in POINT_FLAGS]
+    assert not mask.all()
@@ -0,0 +1,37 @@
+"""Tests for the get data via APIs script."""
+import pytest
+
+pytest.importorskip('requests')
+pytest.importorskip('pykew')
+
+from tools import get_data_via_apis  # noqa: E402
+from tools.data_preparation.occurrence_store import (  # noqa: E402
+    OccurrenceStore, OccurrenceStoreWriter)
+
+
+# .............................................................................
+def test_api_points_are_stored(tmp_path, monkeypatch):
+    """GBIF and iDigBio records are added to an occurrence store."""
+    monkeypatch.setattr(
+        get_data_via_apis, 'get_points_from_gbif', lambda species_key: [
+            {'species': 'Aa bb', 'decimalLongitude': 1.0,
+             'decimalLatitude': 2.0, 'issues': ['ZERO_COORDINATE']},
+            {'species': 'Aa bb', 'decimalLongitude': 'bad',
+             'decimalLatitude': 2.0, 'issues': []}])
+    monkeypatch.setattr(
+        get_data_via_apis, 'get_points_from_idigbio', lambda species_key: [])
+    store_dir = str(tmp_path / 'store')
+    with OccurrenceStoreWriter(store_dir, append=True) as writer:
+        get_data_via_apis.get_gbif(
+            1, 'Aa bb', str(tmp_path), store_writer=writer)
+        get_data_via_apis.get_idigbio(
+            1, 'Aa bb', str(tmp_path), store_writer=writer)
+    store = OccurrenceStore(store_dir)
+    assert store.get_species('gbif') == ['Aa bb']
+    assert store.get_species('idigbio') == []
+    batch = store.get_points('gbif', 'Aa bb')
+    assert batch.get_coordinates()[0].tolist() == [1.0]
+    assert [point.flags for point in batch.iter_points()] == [
+        ['ZERO_COORDINATE']]
+    # No species files are written
+    assert sorted(path.name for path in tmp_path.iterdir()) == ['store']
@@ -0,0 +1,40 @@
+"""Tests for the occurrence flags module."""
+from tools.data_preparation.occurrence_flags import (
+    GBIF_ISSUES, IDIGBIO_FLAGS, KNOWN_FLAGS, get_flag_attribute_provider,
+    get_flag_vocabulary)
+from tools.data_preparation.point_batch import MAX_FLAGS
+
+
+# .............................................................................
+def test_known_flags_fit_with_room_to_spare():
+    """The known flags are unique and leave bits for unknown flags."""
+    assert len(set(KNOWN_FLAGS)) == len(KNOWN_FLAGS)
+    assert len(KNOWN_FLAGS) < MAX_FLAGS - 32
+
+
+# .............................................................................
+def test_flag_vocabularies_share_bits():
+    """Every vocabulary assigns the known flags the same fixed bits."""
+    first = get_flag_vocabulary()
+    # A flag seen first in one vocabulary does not move the known flags
+    assert first.get_bit('unknown_flag') == len(KNOWN_FLAGS)
+    second = get_flag_vocabulary()
+    for flag in ('ZERO_COORDINATE', 'POSSIBLY_ON_LOAN', 'geopoint_0_coord',
+                 'gbif_vernacular'):
+        assert first.get_bit(flag) == second.get_bit(flag)
+    assert second.get_bit(GBIF_ISSUES[0]) == 0
+    assert second.get_bit(IDIGBIO_FLAGS[0]) == len(GBIF_ISSUES)
+    assert second.get_bit('other_flag') == len(KNOWN_FLAGS)
+    words = first.encode(['COORDINATE_ROUNDED', 'rev_geocode_flip'])
+    assert sorted(second.decode(words)) == [
+        'COORDINATE_ROUNDED', 'rev_geocode_flip']
+
+
+# .............................................................................
+def test_flag_attribute_provider():
+    """Flag attributes are recognised for each provider."""
+    assert get_flag_attribute_provider('issue') == 'gbif'
+    assert get_flag_attribute_provider('issues') == 'gbif'
+    assert get_flag_attribute_provider('idigbio:flags') == 'idigbio'
+    assert get_flag_attribute_provider('flags') == 'idigbio'
+    assert get_flag_attribute_provider('basisOfRecord') is None
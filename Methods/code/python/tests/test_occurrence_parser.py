@@ -0,0 +1,81 @@
+"""Tests for the occurrence parser module."""
+from collections import Counter
+
+import pytest
+
+from tools.data_preparation.occurrence_parser import (
+    REJECT_COORDINATES, REJECT_FIELDS, REJECT_FLAGS, parse_flags,
+    parse_point_lines)
+from tools.data_preparation.point_batch import FlagVocabulary, MAX_FLAGS
+
+
+# .............................................................................
+@pytest.mark.parametrize('flags_text', [
+    '["a", "b"]', '"a,b"', '[a; b]', "['a', 'b']", 'a;b'])
+def test_parse_flags_formats(flags_text):
+    """Each flag format written by the download tools gives the tokens."""
+    assert parse_flags(flags_text) == ['a', 'b']
+
+
+# .............................................................................
+def test_parse_point_lines():
+    """Valid lines become points with their species and flags."""
+    lines = [
+        'Aa bb, 1.5, -2.25, ["ZERO_COORDINATE"]\n',
+        '\n',
+        'Cc dd, 3, 4, ""\n',
+        'Aa bb, 5.0, 6.0, "geopoint_bounds,ZERO_COORDINATE"\n']
+    rejected = Counter()
+    batch = parse_point_lines(lines, FlagVocabulary(), rejected=rejected)
+    assert sum(rejected.values()) == 0
+    points = list(batch.iter_points())
+    assert [point.species_name for point in points] == [
+        'Aa bb', 'Cc dd', 'Aa bb']
+    assert [(point.x, point.y) for point in points] == [
+        (1.5, -2.25), (3.0, 4.0), (5.0, 6.0)]
+    assert [sorted(point.flags) for point in points] == [
+        ['ZERO_COORDINATE'], [], ['ZERO_COORDINATE', 'geopoint_bounds']]
+
+
+# .............................................................................
+def test_lines_without_flags_field_are_rejected():
+    """Lines need all four fields, as the original per-line reader did."""
+    rejected = Counter()
+    batch = parse_point_lines(
+        ['Aa bb, 1.0, 2.0\n', 'Aa bb, 1.0\n', 'Aa bb, 1.0, 2.0, []\n'],
+        FlagVocabulary(), rejected=rejected)
+    assert len(batch) == 1
+    assert rejected[REJECT_FIELDS] == 2
+
+
+# .............................................................................
+@pytest.mark.parametrize('precision', [None, 4])
+def test_non_finite_coordinates_are_rejected(precision):
+    """Unparseable, infinite and NaN coordinates are bad coordinates."""
+    lines = [
+        'Aa bb, abc, 2.0, []\n',
+        'Aa bb, inf, 2.0, []\n',
+        'Aa bb, 1.0, -inf, []\n',
+        'Aa bb, nan, 2.0, []\n',
+        'Aa bb, 1.0, NaN, []\n',
+        'Aa bb, 1.0, 2.0, []\n']
+    rejected = Counter()
+    batch = parse_point_lines(
+        lines, FlagVocabulary(), rejected=rejected, precision=precision)
+    assert rejected[REJECT_COORDINATES] == 5
+    assert len(batch) == 1
+    assert batch.get_coordinates()[0].tolist() == [1.0]
+    assert batch.get_coordinates()[1].tolist() == [2.0]
+
+
+# .............................................................................
+def test_flags_that_do_not_fit_are_rejected():
+    """Lines with flags the vocabulary cannot hold are bad flags."""
+    vocabulary = FlagVocabulary(
+        ['flag_{}'.format(i) for i in range(MAX_FLAGS)])
+    rejected = Counter()
+    batch = parse_point_lines(
+        ['Aa bb, 1.0, 2.0, ["new_flag"]\n', 'Aa bb, 1.0, 2.0, ["flag_1"]\n'],
+        vocabulary, rejected=rejected)
+    assert rejected[REJECT_FLAGS] == 1
+    assert len(batch) == 1
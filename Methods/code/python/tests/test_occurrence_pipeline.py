@@ -0,0 +1,141 @@
+"""Tests for the occurrence pipeline module."""
+import os
+
+import pytest
+
+pytest.importorskip('osgeo')
+
+from tools.common.run_journal import get_journal_filename  # noqa: E402
+from tools.data_preparation import occurrence_pipeline  # noqa: E402
+from tools.data_preparation.occurrence_pipeline import (  # noqa: E402
+    create_species_csv, get_region_rasters)
+from tools.data_preparation.wgsrpd import get_wgsrpd_index  # noqa: E402
+
+NUM_SPECIES = 6
+
+
+# .............................................................................
+def _write_species(base_dir):
+    os.makedirs(os.path.join(base_dir, 'Aa'))
+    species_filename = os.path.join(base_dir, 'species.csv')
+    with open(species_filename, 'w') as species_out:
+        for i in range(NUM_SPECIES):
+            species = 'Aa s{}'.format(i)
+            species_out.write('{}, "{}"\n'.format(i, species))
+            filename = os.path.join(base_dir, 'Aa', '{}_gbif.csv'.format(
+                species))
+            with open(filename, 'w') as points_out:
+                for j in range(3 + i):
+                    points_out.write('{}, {}, {}, []\n'.format(
+                        species, float(j), float(i)))
+    return species_filename
+
+
+# .............................................................................
+def _run(base_dir, species_filename, out_filename, resume=False):
+    return create_species_csv(
+        base_dir, out_filename, species_filename, 4, (-10, -10, 10, 10), [],
+        [], resume=resume)
+
+
+# .............................................................................
+def test_resume_skips_finished_species(tmp_path):
+    """A resumed run skips journaled species and gives the same output."""
+    base_dir = str(tmp_path)
+    species_filename = _write_species(base_dir)
+    full_filename = os.path.join(base_dir, 'full.csv')
+    full_totals = _run(base_dir, species_filename, full_filename)
+    with open(full_filename) as full_in:
+        full_output = full_in.read()
+    with open(get_journal_filename(full_filename)) as journal_in:
+        journal_lines = journal_in.readlines()
+    assert len(journal_lines) == NUM_SPECIES
+
+    # An interrupted run: three species journaled, the fourth partly written
+    part_filename = os.path.join(base_dir, 'part.csv')
+    with open(get_journal_filename(part_filename), 'w') as journal_out:
+        journal_out.write(''.join(journal_lines[:3]))
+        journal_out.write(journal_lines[3][:10])
+    with open(part_filename, 'w') as part_out:
+        part_out.write(full_output)
+        part_out.write('partial line')
+    # Finished species are not read again
+    for i in range(3):
+        os.remove(os.path.join(base_dir, 'Aa', 'Aa s{}_gbif.csv'.format(i)))
+
+    part_totals = _run(base_dir, species_filename, part_filename, resume=True)
+    with open(part_filename) as part_in:
+        assert part_in.read() == full_output
+    assert part_totals.num_species == full_totals.num_species
+    assert part_totals.num_points == full_totals.num_points
+    assert part_totals.valid_species == full_totals.valid_species
+
+
+# .............................................................................
+def _write_duplicate_species(base_dir):
+    """Two species at the same localities, each listing one twice."""
+    os.makedirs(os.path.join(base_dir, 'Aa'))
+    species_filename = os.path.join(base_dir, 'species.csv')
+    with open(species_filename, 'w') as species_out:
+        for i, species in enumerate(['Aa dup', 'Aa twin']):
+            species_out.write('{}, "{}"\n'.format(i, species))
+            filename = os.path.join(base_dir, 'Aa', '{}_gbif.csv'.format(
+                species))
+            with open(filename, 'w') as points_out:
+                for x in [1.0, 2.0, 3.0, 4.0, 1.0, 2.04]:
+                    points_out.write('{}, {}, 0.0, []\n'.format(species, x))
+    return species_filename
+
+
+# .............................................................................
+@pytest.mark.parametrize(
+    'remove_duplicates, duplicate_precision, num_points',
+    [(True, None, 5), (True, 1, 4), (False, None, 6)])
+def test_duplicates_are_removed_per_species(tmp_path, remove_duplicates,
+                                            duplicate_precision, num_points):
+    """Repeated localities are dropped within a species, not across them."""
+    base_dir = str(tmp_path)
+    out_filename = os.path.join(base_dir, 'out.csv')
+    create_species_csv(
+        base_dir, out_filename, _write_duplicate_species(base_dir), 4,
+        (-10, -10, 10, 10), [], [], remove_duplicates=remove_duplicates,
+        duplicate_precision=duplicate_precision)
+    with open(out_filename) as out_in:
+        species = [line.split(',')[0] for line in out_in]
+    assert species == ['Aa dup'] * num_points + ['Aa twin'] * num_points
+
+
+# .............................................................................
+@pytest.mark.parametrize('backend, saved, num_loads', [
+    ('thread', False, 1), ('thread', True, 1), ('process', False, 1),
+    ('process', True, 0)])
+def test_regions_are_loaded_once(tmp_path, wgsrpd_dir, monkeypatch, backend,
+                                 saved, num_loads):
+    """Threads share the loaded regions, processes only build missing ones."""
+    base_dir = str(tmp_path)
+    species_filename = _write_duplicate_species(base_dir)
+    index_filename = os.path.join(base_dir, 'wgsrpd')
+    if saved:
+        get_region_rasters(
+            get_wgsrpd_index(wgsrpd_dir, index_filename), index_filename)
+    loads = []
+
+    def counted(function):
+        def wrapper(*args, **kwargs):
+            loads.append(function.__name__)
+            return function(*args, **kwargs)
+        return wrapper
+    monkeypatch.setattr(
+        occurrence_pipeline, 'get_wgsrpd_index', counted(get_wgsrpd_index))
+    monkeypatch.setattr(
+        occurrence_pipeline, 'get_region_rasters',
+        counted(get_region_rasters))
+    out_filename = os.path.join(base_dir, 'out.csv')
+    create_species_csv(
+        base_dir, out_filename, species_filename, 4, (-10, -10, 10, 10), [],
+        [], wgsrpd_dir=wgsrpd_dir, backend=backend, max_workers=2,
+        wgsrpd_index_filename=index_filename, use_region_raster=True)
+    assert sorted(loads) == [
+        'get_region_rasters', 'get_wgsrpd_index'] * num_loads
+    with open(out_filename) as out_in:
+        assert len(out_in.readlines()) == 10
@@ -0,0 +1,160 @@
+"""Tests for the occurrence store module."""
+import json
+import os
+
+import numpy as np
+import pytest
+
+from tools.data_preparation.occurrence_store import (
+    INDEX_FILENAME, OccurrenceStore, OccurrenceStoreWriter, STORE_VERSION)
+from tools.data_preparation.point_batch import (
+    FlagVocabulary, Point, PointBatch)
+
+
+# .............................................................................
+def _get_batch(species, xs, ys, flags):
+    vocabulary = FlagVocabulary(['ZERO_COORDINATE', 'geopoint_bounds'])
+    return PointBatch.from_points(
+        [Point(species, x, y, point_flags)
+         for x, y, point_flags in zip(xs, ys, flags)],
+        flag_vocabulary=vocabulary)
+
+
+# .............................................................................
+def _write_store(store_dir, precision=None):
+    with OccurrenceStoreWriter(store_dir, precision=precision) as writer:
+        writer.add_species('gbif', 'Aa bb', _get_batch(
+            'Aa bb', [1.25, -2.5], [3.125, 4.0],
+            [['ZERO_COORDINATE'], []]))
+        writer.add_species('idigbio', 'Aa bb', _get_batch(
+            'Aa bb', [10.0], [-10.0], [['geopoint_bounds']]))
+        writer.add_species('gbif', 'Cc dd', _get_batch(
+            'Cc dd', [0.5], [0.25], [[]]))
+    return OccurrenceStore(store_dir)
+
+
+# .............................................................................
+@pytest.mark.parametrize('precision', [None, 4])
+def test_points_round_trip(tmp_path, precision):
+    """Stored species points read back with their coordinates and flags."""
+    store = _write_store(str(tmp_path), precision=precision)
+    assert store.num_points == 4
+    assert sorted(store.get_species('gbif')) == ['Aa bb', 'Cc dd']
+    batch = store.get_points('gbif', 'Aa bb')
+    assert batch.precision == precision
+    assert batch.get_coordinates()[0].tolist() == [1.25, -2.5]
+    assert batch.get_coordinates()[1].tolist() == [3.125, 4.0]
+    assert [point.flags for point in batch.iter_points()] == [
+        ['ZERO_COORDINATE'], []]
+    idigbio_batch = store.get_points('idigbio', 'Aa bb')
+    assert [point.flags for point in idigbio_batch.iter_points()] == [
+        ['geopoint_bounds']]
+
+
+# .............................................................................
+def test_missing_species_is_empty(tmp_path):
+    """A species without stored points gives an empty batch."""
+    store = _write_store(str(tmp_path))
+    assert len(store.get_points('idigbio', 'Cc dd')) == 0
+    assert len(store.get_points('other', 'Aa bb')) == 0
+
+
+# .............................................................................
+def test_flags_are_remapped_to_a_vocabulary(tmp_path):
+    """Flags read with another vocabulary keep their values."""
+    store = _write_store(str(tmp_path))
+    vocabulary = FlagVocabulary(['geopoint_bounds'])
+    batch = store.get_points('gbif', 'Aa bb', flag_vocabulary=vocabulary)
+    assert batch.flag_vocabulary is vocabulary
+    assert [point.flags for point in batch.iter_points()] == [
+        ['ZERO_COORDINATE'], []]
+    assert not np.array_equal(
+        batch.flags, store.get_points('gbif', 'Aa bb').flags)
+
+
+# .............................................................................
+def test_species_added_twice(tmp_path):
+    """A provider species can only be added once."""
+    with OccurrenceStoreWriter(str(tmp_path)) as writer:
+        batch = _get_batch('Aa bb', [1.0], [1.0], [[]])
+        writer.add_species('gbif', 'Aa bb', batch)
+        with pytest.raises(ValueError):
+            writer.add_species('gbif', 'Aa bb', batch)
+
+
+# .............................................................................
+@pytest.mark.parametrize('version', [None, 1, STORE_VERSION + 1])
+def test_other_versions_are_rejected(tmp_path, version):
+    """Stores written in another format version are not read."""
+    _write_store(str(tmp_path))
+    index_filename = os.path.join(str(tmp_path), INDEX_FILENAME)
+    with open(index_filename) as idx_in:
+        index = json.load(idx_in)
+    if version is None:
+        del index['version']
+    else:
+        index['version'] = version
+    with open(index_filename, 'w') as idx_out:
+        json.dump(index, idx_out)
+    with pytest.raises(ValueError, match='format version'):
+        OccurrenceStore(str(tmp_path))
+
+
+# .............................................................................
+@pytest.mark.parametrize('precision', [None, 4])
+def test_append_adds_to_a_store(tmp_path, precision):
+    """Appending keeps the stored points and their precision."""
+    _write_store(str(tmp_path), precision=precision)
+    with OccurrenceStoreWriter(
+            str(tmp_path), precision=2, append=True) as writer:
+        assert writer.precision == precision
+        writer.add_species('idigbio', 'Cc dd', _get_batch(
+            'Cc dd', [7.5], [-7.5], [['ZERO_COORDINATE']]))
+        with pytest.raises(ValueError):
+            writer.add_species('gbif', 'Aa bb', _get_batch(
+                'Aa bb', [1.0], [1.0], [[]]))
+    store = OccurrenceStore(str(tmp_path))
+    assert store.num_points == 5
+    assert store.precision == precision
+    gbif_batch = store.get_points('gbif', 'Aa bb')
+    assert gbif_batch.get_coordinates()[0].tolist() == [1.25, -2.5]
+    idigbio_batch = store.get_points('idigbio', 'Cc dd')
+    assert idigbio_batch.get_coordinates()[0].tolist() == [7.5]
+    assert [point.flags for point in idigbio_batch.iter_points()] == [
+        ['ZERO_COORDINATE']]
+
+
+# .............................................................................
+def test_append_drops_unindexed_points(tmp_path):
+    """Points written after the index was saved are not kept."""
+    store_dir = str(tmp_path)
+    _write_store(store_dir)
+    writer = OccurrenceStoreWriter(store_dir, append=True)
+    writer.add_species('gbif', 'Ee ff', _get_batch(
+        'Ee ff', [2.0, 3.0], [2.0, 3.0], [[], []]))
+    # Stop without saving the index, as an interrupted download would
+    for col_file in (writer._x_file, writer._y_file, writer._flags_file):
+        col_file.close()
+    with OccurrenceStoreWriter(store_dir, append=True) as writer:
+        writer.add_species('gbif', 'Gg hh', _get_batch(
+            'Gg hh', [5.0], [6.0], [[]]))
+    store = OccurrenceStore(store_dir)
+    assert store.num_points == 5
+    assert store.get_species('gbif') == ['Aa bb', 'Cc dd', 'Gg hh']
+    assert store.x.shape == (5, )
+    batch = store.get_points('gbif', 'Gg hh')
+    assert batch.get_coordinates()[0].tolist() == [5.0]
+    assert batch.get_coordinates()[1].tolist() == [6.0]
+
+
+# .............................................................................
+def test_without_append_the_store_is_replaced(tmp_path):
+    """A writer that does not append starts a new store."""
+    _write_store(str(tmp_path))
+    with OccurrenceStoreWriter(str(tmp_path)) as writer:
+        writer.add_species('gbif', 'Ee ff', _get_batch(
+            'Ee ff', [2.0], [2.0], [[]]))
+    store = OccurrenceStore(str(tmp_path))
+    assert store.num_points == 1
+    assert store.get_species('gbif') == ['Ee ff']
+    assert store.get_species('idigbio') == []
@@ -0,0 +1,69 @@
+"""Tests for the parallel module."""
+import os
+import time
+
+import pytest
+
+from tools.common.parallel import map_in_order
+
+
+# .............................................................................
+def get_scaler(factor):
+    """Get a worker function that scales items, sleeping on small items."""
+    # .......................
+    def scale(item):
+        time.sleep(0.001 * (item % 3))
+        return item * factor
+    return scale
+
+
+# .............................................................................
+def get_pid_reporter():
+    """Get a worker function that reports the process it was built in."""
+    built_pid = os.getpid()
+
+    # .......................
+    def report(item):
+        return (item, built_pid)
+    return report
+
+
+# .............................................................................
+@pytest.mark.parametrize('backend', ['thread', 'process'])
+@pytest.mark.parametrize('chunk_size', [1, 7, 100])
+def test_results_are_in_item_order(backend, chunk_size):
+    """Results come back in item order for every backend and chunk size."""
+    results = list(map_in_order(
+        get_scaler, (3,), iter(range(50)), backend=backend, max_workers=3,
+        chunk_size=chunk_size))
+    assert results == [item * 3 for item in range(50)]
+
+
+# .............................................................................
+def test_factory_kwargs():
+    """Keyword arguments are passed to the factory."""
+    assert list(map_in_order(
+        get_scaler, (), [1, 2], factory_kwargs={'factor': 5})) == [5, 10]
+
+
+# .............................................................................
+def test_process_backend_builds_function_in_workers():
+    """The process backend runs the factory in the worker processes."""
+    results = list(map_in_order(
+        get_pid_reporter, (), range(20), backend='process', max_workers=2,
+        chunk_size=5))
+    assert [item for item, _ in results] == list(range(20))
+    assert os.getpid() not in {pid for _, pid in results}
+
+
+# .............................................................................
+def test_empty_items():
+    """No items give no results."""
+    assert list(map_in_order(get_scaler, (2,), [])) == []
+
+
+# .............................................................................
+def test_unknown_backend():
+    """An unknown backend raises a ValueError."""
+    with pytest.raises(ValueError):
+        list(map_in_order(get_scaler, (2,), [1], backend='cluster'))
@@ -0,0 +1,158 @@
+"""Tests for the point batch module."""
+import io
+import pickle
+
+import numpy as np
+import pytest
+
+from tools.data_preparation.point_batch import (
+    FLAG_WORDS, MAX_FLAGS, FlagVocabulary, Point, PointBatch,
+    SpeciesVocabulary, from_fixed_point, remap_flags, to_fixed_point)
+
+POINTS = [
+    Point('Species b', 1.5, -2.25, ['flag_a']),
+    Point('Species a', 3.0, 4.0, []),
+    Point('Species b', -7.125, 0.5, ['flag_b', 'flag_a']),
+    Point('Species a', 0.0, 1.0, ['flag_c']),
+]
+
+
+# .............................................................................
+def _as_tuples(batch):
+    return [
+        (point.species_name, point.x, point.y, sorted(point.flags))
+        for point in batch.iter_points()]
+
+
+# .............................................................................
+def test_flag_vocabulary_round_trip():
+    """Flags are encoded as bits, in any word, and decoded again."""
+    vocabulary = FlagVocabulary(['flag_{}'.format(i) for i in range(70)])
+    words = vocabulary.encode(['flag_1', 'flag_69', '', 'new_flag'])
+    assert len(words) == FLAG_WORDS
+    assert words[0] == 1 << 1
+    assert words[1] == (1 << 5) | (1 << 6)
+    assert sorted(vocabulary.decode(words)) == [
+        'flag_1', 'flag_69', 'new_flag']
+    assert vocabulary.get_bit('new_flag') == 70
+    assert vocabulary.encode('flag_0')[0] == 1
+    assert vocabulary.get_mask(['flag_2']).tolist() == [4, 0, 0, 0]
+    assert vocabulary.get_mask(None).tolist() == [0] * FLAG_WORDS
+
+
+# .............................................................................
+def test_flag_vocabulary_full():
+    """A vocabulary can not hold more flags than there are bits."""
+    vocabulary = FlagVocabulary([str(i) for i in range(MAX_FLAGS)])
+    with pytest.raises(ValueError):
+        vocabulary.get_bit('one_too_many')
+
+
+# .............................................................................
+def test_flag_vocabulary_pickles():
+    """A vocabulary keeps its bits when pickled for a worker."""
+    vocabulary = pickle.loads(pickle.dumps(FlagVocabulary(['a', 'b'])))
+    assert vocabulary.get_bit('b') == 1
+    assert vocabulary.get_bit('c') == 2
+
+
+# .............................................................................
+def test_remap_flags():
+    """Bitmasks are converted between vocabularies by flag value."""
+    from_vocabulary = FlagVocabulary(['a', 'b', 'c'])
+    flags = np.array(
+        [from_vocabulary.encode(['a', 'c']), from_vocabulary.encode(['b']),
+         from_vocabulary.encode(['a', 'c'])], dtype=np.uint64)
+    shared = FlagVocabulary(['a', 'b', 'c', 'd'])
+    assert remap_flags(flags, from_vocabulary, shared) is flags
+    to_vocabulary = FlagVocabulary(['c', 'b'])
+    remapped = remap_flags(flags, from_vocabulary, to_vocabulary)
+    assert [sorted(to_vocabulary.decode(row)) for row in remapped] == [
+        ['a', 'c'], ['b'], ['a', 'c']]
+
+
+# .............................................................................
+def test_species_vocabulary_ranks():
+    """Ranks give the sorted position of each species id."""
+    vocabulary = SpeciesVocabulary(['c', 'a', 'b'])
+    assert vocabulary.get_id('a') == 1
+    assert vocabulary.get_ranks().tolist() == [2, 0, 1]
+
+
+# .............................................................................
+def test_fixed_point_conversion():
+    """Coordinates are rounded, and NaN or huge values are clipped."""
+    values = to_fixed_point([1.25, -0.5, 179.99999995, np.nan, 1e12], 1)
+    assert values.dtype == np.int32
+    assert values[:3].tolist() == [12, -5, 1800]
+    assert values[3] == np.iinfo(np.int32).min
+    assert values[4] == np.iinfo(np.int32).max
+    assert from_fixed_point([12, -5], 1).tolist() == [1.2, -0.5]
+    with pytest.raises(ValueError):
+        to_fixed_point([1.0], 8)
+
+
+# .............................................................................
+def test_from_points_round_trip():
+    """Points put into a batch come back out unchanged."""
+    batch = PointBatch.from_points(POINTS, flag_vocabulary=FlagVocabulary())
+    assert len(batch) == 4
+    assert batch.species_names == ['Species b', 'Species a']
+    assert _as_tuples(batch) == [
+        (point.species_name, point.x, point.y, sorted(point.flags))
+        for point in POINTS]
+
+
+# .............................................................................
+def test_from_points_without_vocabulary_drops_flags():
+    """Batches without a flag vocabulary have no flags."""
+    batch = PointBatch.from_points(POINTS)
+    assert not batch.flags.any()
+    assert all(point.flags == [] for point in batch.iter_points())
+
+
+# .............................................................................
+def test_subset_and_sort_by_species():
+    """Subsets keep the species names, sorting by species is stable."""
+    batch = PointBatch.from_points(POINTS, flag_vocabulary=FlagVocabulary())
+    assert [point.x for point in batch.sort_by_species().iter_points()] == [
+        3.0, 0.0, 1.5, -7.125]
+    subset = batch.subset(batch.x > 0)
+    assert subset.species_names == batch.species_names
+    assert _as_tuples(subset) == [
+        ('Species b', 1.5, -2.25, ['flag_a']), ('Species a', 3.0, 4.0, [])]
+
+
+# .............................................................................
+def test_concatenate_merges_species_and_precision():
+    """Concatenated batches share species ids and coordinate precision."""
+    vocabulary = FlagVocabulary()
+    first = PointBatch.from_points(POINTS[:2], flag_vocabulary=vocabulary)
+    second = PointBatch.from_points(POINTS[2:], flag_vocabulary=vocabulary)
+    batch = PointBatch.concatenate([first, None, second])
+    assert batch.species_names == ['Species b', 'Species a']
+    assert _as_tuples(batch) == _as_tuples(
+        PointBatch.from_points(POINTS, flag_vocabulary=vocabulary))
+    fixed = PointBatch.concatenate([first, second], precision=2)
+    assert fixed.precision == 2
+    assert fixed.x.tolist() == [150, 300, -712, 0]
+    empty = PointBatch.concatenate([], precision=2)
+    assert len(empty) == 0
+    assert empty.x.dtype == np.int32
+
+
+# .............................................................................
+def test_with_precision_and_write_csv():
+    """Fixed point batches are written with exactly precision decimals."""
+    batch = PointBatch.from_points(POINTS[:2])
+    assert batch.with_precision(None) is batch
+    fixed = batch.with_precision(3)
+    assert fixed.get_coordinates()[0].tolist() == [1.5, 3.0]
+    out_file = io.StringIO()
+    fixed.write_csv(out_file)
+    assert out_file.getvalue() == (
+        'Species b, 1.500, -2.250\nSpecies a, 3.000, 4.000\n')
+    out_file = io.StringIO()
+    fixed.with_precision(None).write_csv(out_file)
+    assert out_file.getvalue() == (
+        'Species b, 1.5, -2.25\nSpecies a, 3.0, 4.0\n')
@@ -0,0 +1,106 @@
+"""Tests for the point in polygon module."""
+import numpy as np
+import pytest
+
+from tools.data_preparation import point_in_polygon
+from tools.data_preparation.point_in_polygon import (
+    get_geometry_rings, get_packed_ring_edges, get_ring_edges,
+    point_in_polygon_edges, points_in_polygon_edges)
+
+# A 10 x 10 square with a 4 x 4 hole, and a separate L shaped part
+SQUARE = [(0, 0), (10, 0), (10, 10), (0, 10), (0, 0)]
+HOLE = [(3, 3), (3, 7), (7, 7), (7, 3), (3, 3)]
+L_SHAPE = [(20, 0), (30, 0), (30, 4), (24, 4), (24, 10), (20, 10), (20, 0)]
+
+
+# .............................................................................
+def _get_rings(*rings):
+    return [np.array(ring, dtype=np.float64) for ring in rings]
+
+
+# .............................................................................
+def _expected_inside(xs, ys):
+    """Membership of the test polygon, for points not on an edge."""
+    in_square = (xs > 0) & (xs < 10) & (ys > 0) & (ys < 10)
+    in_hole = (xs > 3) & (xs < 7) & (ys > 3) & (ys < 7)
+    in_l_shape = (xs > 20) & (ys > 0) & (
+        ((xs < 30) & (ys < 4)) | ((xs < 24) & (ys < 10)))
+    return (in_square & ~in_hole) | in_l_shape
+
+
+# .............................................................................
+def _get_test_points():
+    # Half integers are never on an edge of the test polygon
+    rng = np.random.default_rng(1)
+    return (
+        rng.integers(-4, 70, 5000) / 2.0 + 0.25,
+        rng.integers(-4, 24, 5000) / 2.0 + 0.25)
+
+
+# .............................................................................
+def test_ring_edges_skip_horizontal_edges():
+    """Open rings are closed, horizontal edges and short rings dropped."""
+    edges = get_ring_edges(_get_rings(SQUARE[:-1], [(0, 0), (1, 1)]))
+    assert edges.tolist() == [[10, 0, 10, 0], [0, 10, 0, 0]]
+    assert get_ring_edges([]).shape == (0, 4)
+
+
+# .............................................................................
+def test_points_in_polygon_with_holes_and_parts():
+    """The even-odd rule handles holes and several parts."""
+    xs, ys = _get_test_points()
+    edges = get_ring_edges(_get_rings(SQUARE, HOLE, L_SHAPE))
+    expected = _expected_inside(xs, ys)
+    assert expected.any() and not expected.all()
+    assert points_in_polygon_edges(xs, ys, edges).tolist() == \
+        expected.tolist()
+    assert [point_in_polygon_edges(x, y, edges)
+            for x, y in zip(xs[:500], ys[:500])] == expected[:500].tolist()
+
+
+# .............................................................................
+def test_points_in_polygon_blocks(monkeypatch):
+    """Points are tested in blocks without changing the results."""
+    xs, ys = _get_test_points()
+    edges = get_ring_edges(_get_rings(SQUARE, HOLE, L_SHAPE))
+    expected = points_in_polygon_edges(xs, ys, edges)
+    monkeypatch.setattr(point_in_polygon, 'MAX_BLOCK_CELLS', 50)
+    assert points_in_polygon_edges(xs, ys, edges).tolist() == \
+        expected.tolist()
+
+
+# .............................................................................
+def test_points_in_empty_polygon():
+    """Nothing is inside a polygon without edges."""
+    edges = get_ring_edges([])
+    assert points_in_polygon_edges([1.0, 2.0], [1.0, 2.0], edges).tolist() \
+        == [False, False]
+    assert not point_in_polygon_edges(1.0, 1.0, edges)
+
+
+# .............................................................................
+def test_packed_ring_edges_match_ring_edges():
+    """Packed rings give the edges of each ring in order."""
+    rings = _get_rings(SQUARE, HOLE, L_SHAPE)
+    coords = np.concatenate(rings)
+    ring_offsets = np.cumsum([0] + [len(ring) for ring in rings])
+    edges, edge_offsets = get_packed_ring_edges(coords, ring_offsets)
+    for i, ring in enumerate(rings):
+        assert edges[edge_offsets[i]:edge_offsets[i + 1]].tolist() == \
+            get_ring_edges([ring]).tolist()
+    assert edge_offsets[-1] == len(edges) == len(get_ring_edges(rings))
+
+
+# .............................................................................
+def test_geometry_rings():
+    """Polygon rings are found in polygons, multipolygons and collections."""
+    ogr = pytest.importorskip('osgeo.ogr')
+    polygon = ogr.CreateGeometryFromWkt(
+        'POLYGON((0 0, 10 0, 10 10, 0 10, 0 0), (3 3, 3 7, 7 7, 7 3, 3 3))')
+    rings = get_geometry_rings(polygon)
+    assert [ring.tolist() for ring in rings] == [
+        [list(point) for point in SQUARE], [list(point) for point in HOLE]]
+    multipolygon = ogr.CreateGeometryFromWkt(
+        'MULTIPOLYGON(((0 0, 1 0, 1 1, 0 0)), ((5 5, 6 5, 6 6, 5 5)))')
+    assert len(get_geometry_rings(multipolygon)) == 2
+    assert get_geometry_rings(ogr.CreateGeometryFromWkt('POINT(1 1)')) == []
@@ -0,0 +1,83 @@
+"""Tests for the point reader module."""
+import gzip
+import json
+import zipfile
+
+import pytest
+
+pytest.importorskip('lmpy.point')
+
+from tools.data_preparation.point_reader import (  # noqa: E402
+    ArchivePointCsvReader, get_point_reader)
+
+ROWS = [
+    ('Species a', '1.5', '2.0'),
+    ('Species a', '', '3.0'),
+    ('Species a', '-1', '4'),
+    ('Species b', 'x', '1'),
+    ('Species b', '5', '6'),
+    ('Species a', '7', '8'),
+]
+
+
+# .............................................................................
+def _get_text(delimiter):
+    lines = [delimiter.join(('species', 'x', 'y'))]
+    lines.extend(delimiter.join(row) for row in ROWS)
+    return '\n'.join(lines) + '\n'
+
+
+# .............................................................................
+def _read_groups(reader):
+    with reader:
+        return [
+            [(point.species_name, point.x, point.y) for point in points]
+            for points in reader]
+
+
+EXPECTED_GROUPS = [
+    [('Species a', 1.5, 2.0), ('Species a', -1.0, 4.0)],
+    [('Species b', 5.0, 6.0)],
+    [('Species a', 7.0, 8.0)],
+]
+
+
+# .............................................................................
+@pytest.mark.parametrize('delimiter', ['\t', ','])
+def test_gzip_groups_consecutive_species(tmp_path, delimiter):
+    """Points are grouped by consecutive species, bad rows skipped."""
+    filename = str(tmp_path / 'points.csv.gz')
+    with gzip.open(filename, 'wt', encoding='utf-8') as out_file:
+        out_file.write(_get_text(delimiter))
+    reader = get_point_reader(filename, 'species', 'x', 'y')
+    assert isinstance(reader, ArchivePointCsvReader)
+    assert _read_groups(reader) == EXPECTED_GROUPS
+    assert reader.file is None
+
+
+# .............................................................................
+def test_zip_member_with_geopoint(tmp_path):
+    """Coordinates are read from a JSON geopoint in a zip member."""
+    lines = ['species\tgeopoint']
+    for species, x, y in ROWS:
+        try:
+            lines.append('{}\t{}'.format(species, json.dumps(
+                {'lon': float(x), 'lat': float(y)})))
+        except ValueError:
+            lines.append('{}\t'.format(species))
+    filename = str(tmp_path / 'download.zip')
+    with zipfile.ZipFile(filename, 'w') as zip_file:
+        zip_file.writestr('occurrence_raw.csv', '\n'.join(lines) + '\n')
+        zip_file.writestr('meta.xml', '')
+    reader = get_point_reader(
+        filename, 'species', 'lon', 'lat', geopoint='geopoint')
+    assert _read_groups(reader) == EXPECTED_GROUPS
+
+
+# .............................................................................
+def test_empty_archive_file(tmp_path):
+    """A file with only a header has no points."""
+    filename = str(tmp_path / 'points.gz')
+    with gzip.open(filename, 'wt', encoding='utf-8') as out_file:
+        out_file.write('species\tx\ty\n')
+    assert _read_groups(get_point_reader(filename, 'species', 'x', 'y')) == []
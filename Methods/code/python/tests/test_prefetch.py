@@ -0,0 +1,134 @@
+"""Tests for the prefetch module."""
+import threading
+import time
+
+from tools.common.prefetch import FilePrefetcher, open_prefetched
+
+FILE_SIZE = 100
+
+
+# .............................................................................
+class RecordingPrefetcher(FilePrefetcher):
+    """A prefetcher that records the items it has read files for."""
+    # ..........................
+    def __init__(self, *args, **kwargs):
+        FilePrefetcher.__init__(self, *args, **kwargs)
+        self.read = []
+        self.read_event = threading.Event()
+
+    # ..........................
+    def _read_files(self, filenames):
+        self.read.append(filenames[0])
+        self.read_event.set()
+        return FilePrefetcher._read_files(filenames)
+
+
+# .............................................................................
+def _write_files(tmp_path, num_items):
+    for i in range(num_items):
+        with open(str(tmp_path / '{}.txt'.format(i)), 'wb') as out_file:
+            out_file.write(str(i).encode('utf-8') * FILE_SIZE)
+
+
+# .............................................................................
+def _get_filenames(tmp_path):
+    def get_filenames(item):
+        return [
+            str(tmp_path / '{}.txt'.format(item)),
+            str(tmp_path / 'missing_{}.txt'.format(item))]
+    return get_filenames
+
+
+# .............................................................................
+def _wait_for_reads(prefetcher, num_reads, timeout=5.0):
+    """Wait for num_reads items to be read, then check for more reads."""
+    end_time = time.monotonic() + timeout
+    while len(prefetcher.read) < num_reads and time.monotonic() < end_time:
+        prefetcher.read_event.wait(0.05)
+        prefetcher.read_event.clear()
+    # Give the reader a chance to overrun the budget if it would
+    time.sleep(0.1)
+    return len(prefetcher.read)
+
+
+# .............................................................................
+def test_items_come_with_their_files(tmp_path):
+    """Every item is yielded in order with the bytes of its files."""
+    _write_files(tmp_path, 20)
+    get_filenames = _get_filenames(tmp_path)
+    results = list(FilePrefetcher(range(20), get_filenames, depth=3))
+    assert [item for item, _ in results] == list(range(20))
+    for item, files in results:
+        filename, missing_filename = get_filenames(item)
+        assert files[missing_filename] is None
+        assert open_prefetched(missing_filename, files=files) is None
+        assert open_prefetched(filename, files=files).read() == \
+            str(item) * FILE_SIZE
+
+
+# .............................................................................
+def test_open_prefetched_reads_other_files_from_disk(tmp_path):
+    """Files that were not prefetched are opened from disk."""
+    _write_files(tmp_path, 1)
+    filename = str(tmp_path / '0.txt')
+    with open_prefetched(filename, files={}) as in_file:
+        assert in_file.read() == '0' * FILE_SIZE
+    assert open_prefetched(str(tmp_path / 'none.txt')) is None
+
+
+# .............................................................................
+def test_budget_is_reserved_before_reading(tmp_path):
+    """Files are not read until their size fits in the byte budget."""
+    _write_files(tmp_path, 10)
+    prefetcher = RecordingPrefetcher(
+        range(10), _get_filenames(tmp_path), depth=10,
+        max_bytes=int(2.5 * FILE_SIZE), manual_release=True)
+    items = iter(prefetcher)
+    assert next(items)[0] == 0
+    # The first item is still held, so only one more fits
+    assert _wait_for_reads(prefetcher, 2) == 2
+    assert prefetcher.num_bytes == 2 * FILE_SIZE
+    # Finishing the first item makes room for the third
+    prefetcher.release()
+    assert _wait_for_reads(prefetcher, 3) == 3
+    assert prefetcher.num_bytes <= prefetcher.max_bytes
+    prefetcher.close()
+
+
+# .............................................................................
+def test_bytes_released_when_next_item_is_requested(tmp_path):
+    """Without manual release, an item is held until the next is requested."""
+    _write_files(tmp_path, 5)
+    prefetcher = RecordingPrefetcher(
+        range(5), _get_filenames(tmp_path), depth=5, max_bytes=FILE_SIZE)
+    items = iter(prefetcher)
+    next(items)
+    assert _wait_for_reads(prefetcher, 1) == 1
+    assert prefetcher.num_bytes == FILE_SIZE
+    next(items)
+    assert _wait_for_reads(prefetcher, 2) == 2
+    assert prefetcher.num_bytes == FILE_SIZE
+    prefetcher.close()
+
+
+# .............................................................................
+def test_waiting_consumer_is_not_blocked_by_budget(tmp_path):
+    """Items still held do not keep a waiting consumer from its next item."""
+    _write_files(tmp_path, 6)
+    prefetcher = FilePrefetcher(
+        range(6), _get_filenames(tmp_path), depth=2, max_bytes=FILE_SIZE,
+        manual_release=True)
+    assert [item for item, _ in prefetcher] == list(range(6))
+
+
+# .............................................................................
+def test_close_stops_reading(tmp_path):
+    """Closing the prefetcher stops the background reader."""
+    _write_files(tmp_path, 3)
+    prefetcher = FilePrefetcher(
+        range(3), _get_filenames(tmp_path), depth=1, max_bytes=FILE_SIZE,
+        manual_release=True)
+    items = iter(prefetcher)
+    next(items)
+    items.close()
+    assert not prefetcher._thread.is_alive()
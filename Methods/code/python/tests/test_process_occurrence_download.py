@@ -0,0 +1,138 @@
+"""Tests for the process occurrence download script."""
+from collections import Counter
+import json
+
+import pytest
+
+from tools.data_preparation.occurrence_parser import (
+    REJECT_COORDINATES, REJECT_FIELDS, REJECT_FLAGS)
+from tools.data_preparation.occurrence_store import OccurrenceStore
+from tools.data_preparation.point_batch import Point
+from tools.process_occurrence_download import (
+    get_download_getters, iter_download, iter_download_ranges,
+    iter_row_points, write_store)
+
+GBIF_NUM_FIELDS = 50
+IDIGBIO_NUM_FIELDS = 70
+
+
+# .............................................................................
+def _get_gbif_row(species, x, y, issues=''):
+    row = [''] * GBIF_NUM_FIELDS
+    row[9] = species
+    row[22] = x
+    row[21] = y
+    row[49] = issues
+    return row
+
+
+# .............................................................................
+def _get_idigbio_row(genus, species, geopoint, flags):
+    row = [''] * IDIGBIO_NUM_FIELDS
+    row[33] = genus
+    row[69] = species
+    row[35] = geopoint
+    row[31] = flags
+    return row
+
+
+# .............................................................................
+def test_gbif_rows():
+    """GBIF rows give points, and failing rows are counted by reason."""
+    getters = get_download_getters('gbif')
+    del getters['delimiter']
+    rows = [
+        _get_gbif_row('Aa bb', '1.5', '2.5', 'ZERO_COORDINATE;OTHER'),
+        _get_gbif_row('Aa bb', 'abc', '2.5'),
+        _get_gbif_row('Aa bb', '1.5', '2.5')[:30],
+        _get_gbif_row('Cc dd', '-3', '4')]
+    rejected = Counter()
+    points = list(iter_row_points(rows, rejected=rejected, **getters))
+    assert [(point.species_name, point.x, point.y) for point in points] == [
+        ('Aa bb', 1.5, 2.5), ('Cc dd', -3.0, 4.0)]
+    assert points[0].flags == 'ZERO_COORDINATE,OTHER'
+    assert rejected == {REJECT_COORDINATES: 1, REJECT_FIELDS: 1}
+
+
+# .............................................................................
+def test_idigbio_rows():
+    """iDigBio rows read the geopoint and flags from JSON fields."""
+    getters = get_download_getters('idigbio')
+    del getters['delimiter']
+    geopoint = json.dumps({'lon': 1.5, 'lat': -2.0})
+    rows = [
+        _get_idigbio_row('aa', 'bb', geopoint, '["geopoint_bounds"]'),
+        _get_idigbio_row('aa', 'bb', '{"lat": 1}', '[]'),
+        _get_idigbio_row('aa', 'bb', geopoint, '[not json'),
+        _get_idigbio_row('aa', 'bb', geopoint, '')]
+    rejected = Counter()
+    points = list(iter_row_points(rows, rejected=rejected, **getters))
+    assert [(point.species_name, point.x, point.y, point.flags)
+            for point in points] == [
+                ('Aa bb', 1.5, -2.0, ['geopoint_bounds']),
+                ('Aa bb', 1.5, -2.0, [])]
+    assert rejected == {REJECT_COORDINATES: 1, REJECT_FLAGS: 1}
+
+
+# .............................................................................
+def test_ranges_match_sequential_parse(tmp_path):
+    """Parsing in byte ranges gives the points and counts of one pass."""
+    filename = str(tmp_path / 'gbif.txt')
+    with open(filename, 'w') as out_file:
+        out_file.write('\t'.join(['header'] * GBIF_NUM_FIELDS) + '\n')
+        for i in range(300):
+            x = 'bad' if i % 37 == 0 else str(i / 10)
+            out_file.write('\t'.join(_get_gbif_row(
+                'Sp {}'.format(i % 7), x, str(-i), 'A;B')) + '\n')
+    rejected = Counter()
+    points = list(iter_download(filename, 'gbif', rejected=rejected))
+    range_rejected = Counter()
+    range_points = list(iter_download_ranges(
+        filename, 'gbif', max_workers=2, range_size=500,
+        rejected=range_rejected))
+    assert len(points) == 291
+    assert range_points == points
+    assert range_rejected == rejected == {REJECT_COORDINATES: 9}
+
+
+# .............................................................................
+def test_idigbio_ranges_are_refused(tmp_path):
+    """Comma delimited downloads are not split into byte ranges."""
+    filename = str(tmp_path / 'idigbio.csv')
+    with open(filename, 'w') as out_file:
+        out_file.write('header\n')
+    with pytest.raises(ValueError):
+        list(iter_download_ranges(filename, 'idigbio'))
+
+
+# .............................................................................
+def test_write_store(tmp_path):
+    """Download points are added to a store for each provider."""
+    store_dir = str(tmp_path)
+    write_store(
+        [Point('Aa bb', 1.0, 2.0, 'ZERO_COORDINATE,COUNTRY_MISMATCH'),
+         Point('Aa bb', 3.0, 4.0, ''),
+         Point('Cc dd', 5.0, 6.0, [])],
+        store_dir, 'gbif')
+    write_store(
+        [Point('Aa bb', 7.0, 8.0, ['geopoint_bounds'])], store_dir, 'idigbio')
+    store = OccurrenceStore(store_dir)
+    assert store.num_points == 4
+    assert store.get_species('gbif') == ['Aa bb', 'Cc dd']
+    batch = store.get_points('gbif', 'Aa bb')
+    assert batch.get_coordinates()[0].tolist() == [1.0, 3.0]
+    assert [sorted(point.flags) for point in batch.iter_points()] == [
+        ['COUNTRY_MISMATCH', 'ZERO_COORDINATE'], []]
+    batch = store.get_points('idigbio', 'Aa bb')
+    assert [point.flags for point in batch.iter_points()] == [
+        ['geopoint_bounds']]
+
+
+# .............................................................................
+def test_write_store_needs_sorted_points(tmp_path):
+    """The points of a species must be contiguous."""
+    with pytest.raises(ValueError):
+        write_store(
+            [Point('Aa bb', 1.0, 2.0, ''), Point('Cc dd', 5.0, 6.0, ''),
+             Point('Aa bb', 3.0, 4.0, '')],
+            str(tmp_path), 'gbif')
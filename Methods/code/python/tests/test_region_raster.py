@@ -0,0 +1,141 @@
+"""Tests for the region raster module."""
+import json
+import os
+
+import numpy as np
+import pytest
+
+pytest.importorskip('osgeo')
+
+from tools.data_preparation.filters import (  # noqa: E402
+    get_region_raster_mask_filter, get_tdwg_region_index_mask_filter)
+from tools.data_preparation.point_batch import PointBatch  # noqa: E402
+from tools.data_preparation.region_raster import (  # noqa: E402
+    BOUNDARY, NO_REGION, RASTER_LEVELS, RegionRaster, get_region_raster)
+from tools.data_preparation.wgsrpd import (  # noqa: E402
+    build_wgsrpd_index, get_wgsrpd_catalog)
+
+EXTENT = (-5.0, -5.0, 45.0, 25.0)
+
+
+# .............................................................................
+@pytest.fixture(scope='module')
+def region_index(wgsrpd_dir):
+    return build_wgsrpd_index(get_wgsrpd_catalog(wgsrpd_dir))
+
+
+# .............................................................................
+def _get_points():
+    """Random points, points on region and grid lines, and invalid points."""
+    rng = np.random.default_rng(9)
+    line_values = np.arange(-6, 46, 0.5)
+    xs = np.concatenate((
+        rng.uniform(-8, 48, 3000), line_values, np.full(len(line_values), 10),
+        [np.nan, 1.0, 50.0]))
+    ys = np.concatenate((
+        rng.uniform(-8, 28, 3000), np.full(len(line_values), 10.0),
+        np.linspace(-6, 26, len(line_values)), [1.0, np.inf, 10.0]))
+    return xs, ys
+
+
+# .............................................................................
+def _get_index_codes(region_index, level, xs, ys):
+    """Get the region codes of each point at a level from the index."""
+    codes = [set() for _ in range(len(xs))]
+    offsets, identifiers = region_index.search_many(xs, ys)
+    for i in range(len(xs)):
+        for identifier in identifiers[offsets[i]:offsets[i + 1]]:
+            att_dict = region_index.att_lookup[identifier]
+            if att_dict['level'] == level:
+                codes[i].add(att_dict['code'])
+    return codes
+
+
+# .............................................................................
+@pytest.mark.parametrize('level', RASTER_LEVELS)
+@pytest.mark.parametrize('resolution', [0.5, 1.0, 3.7])
+def test_lookup_matches_region_index(region_index, level, resolution):
+    """Raster lookups give the same region as exact index lookups."""
+    xs, ys = _get_points()
+    region_raster = RegionRaster(
+        region_index, level, resolution=resolution, extent=EXTENT)
+    grid_values = set(np.unique(region_raster.grid).tolist())
+    assert NO_REGION in grid_values and BOUNDARY in grid_values
+    index_codes = _get_index_codes(region_index, level, xs, ys)
+    assert any(len(codes) > 1 for codes in index_codes)
+    for value, codes in zip(region_raster.lookup(xs, ys), index_codes):
+        if value == NO_REGION:
+            assert not codes
+        else:
+            # Points on a shared edge get one of the regions
+            assert region_raster.codes[value] in codes
+
+
+# .............................................................................
+@pytest.mark.parametrize('level', RASTER_LEVELS)
+@pytest.mark.parametrize('resolution', [0.5, 1.0, 3.7])
+def test_within_matches_region_index(region_index, level, resolution):
+    """Points are within the regions the exact index lookups find."""
+    xs, ys = _get_points()
+    region_raster = RegionRaster(
+        region_index, level, resolution=resolution, extent=EXTENT)
+    index_codes = _get_index_codes(region_index, level, xs, ys)
+    for codes in ([region_raster.codes[0]], region_raster.codes[1:], []):
+        assert region_raster.within(
+            xs, ys, region_raster.get_region_ids(codes)).tolist() == [
+                bool(point_codes & set(codes)) for point_codes in index_codes]
+
+
+# .............................................................................
+def test_save_and_load(region_index, tmp_path):
+    """A saved raster is loaded instead of being built again."""
+    filename = str(tmp_path / 'raster.npz')
+    built = get_region_raster(region_index, 3, filename=filename)
+    assert os.path.exists(filename)
+    loaded = get_region_raster(None, 3, filename=filename)
+    assert loaded.codes == built.codes
+    assert loaded.resolution == built.resolution
+    assert np.array_equal(loaded.grid, built.grid)
+    loaded.region_index = region_index
+    xs, ys = _get_points()
+    assert loaded.lookup(xs, ys).tolist() == built.lookup(xs, ys).tolist()
+
+
+# .............................................................................
+def test_other_versions_are_rebuilt(region_index, tmp_path):
+    """Rasters saved in another format version are built again."""
+    filename = str(tmp_path / 'raster.npz')
+    built = get_region_raster(region_index, 3, filename=filename)
+    with np.load(filename) as raster_data:
+        grid = raster_data['grid']
+        meta = json.loads(str(raster_data['meta']))
+    del meta['version']
+    with open(filename, 'wb') as raster_out:
+        np.savez(raster_out, grid=np.zeros_like(grid), meta=json.dumps(meta))
+    with pytest.raises(ValueError, match='format version'):
+        RegionRaster.load_from_file(filename, region_index)
+    rebuilt = get_region_raster(region_index, 3, filename=filename)
+    assert np.array_equal(rebuilt.grid, built.grid)
+    assert np.array_equal(
+        RegionRaster.load_from_file(filename, region_index).grid, built.grid)
+
+
+# .............................................................................
+@pytest.mark.parametrize('regions', [
+    [(3, 'CCC')], [(4, 'AAA-XX'), (3, 'DDD')], [(2, 10), (4, 'BBB-OO')]])
+def test_raster_filter_matches_index_filter(region_index, regions):
+    """The raster filter allows the same points as the index filter."""
+    localities = [
+        {'tdwgLevel': level, 'tdwgCode': code} for level, code in regions]
+    region_rasters = {
+        level: RegionRaster(
+            region_index, level, resolution=1.0, extent=EXTENT)
+        for level in RASTER_LEVELS}
+    xs, ys = _get_points()
+    batch = PointBatch(['Species a'], np.zeros(len(xs)), xs, ys)
+    expected = get_tdwg_region_index_mask_filter(
+        localities, region_index)(batch)
+    assert expected.any()
+    mask = get_region_raster_mask_filter(
+        localities, region_rasters, region_index)(batch)
+    assert mask.tolist() == expected.tolist()
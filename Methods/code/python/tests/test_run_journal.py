@@ -0,0 +1,94 @@
+"""Tests for the run journal module."""
+import json
+import os
+
+from tools.common import run_journal
+from tools.common.run_journal import RunJournal
+
+
+# .............................................................................
+def _write_run(journal_filename, out_filename, species_names):
+    journal = RunJournal(journal_filename, checkpoint_interval=0)
+    with open(out_filename, 'w') as out_file, journal:
+        journal.open(out_file)
+        for species in species_names:
+            out_file.write('{}\n'.format(species))
+            journal.record(species, out_file.tell(), 1, {'bbox': 0})
+
+
+# .............................................................................
+def test_load_ignores_partial_last_line(tmp_path):
+    """A record without its newline is dropped, as if never written."""
+    journal_filename = str(tmp_path / 'out.csv.journal')
+    out_filename = str(tmp_path / 'out.csv')
+    _write_run(journal_filename, out_filename, ['a', 'b', 'c'])
+    with open(journal_filename, 'rb') as journal_in:
+        data = journal_in.read()
+    # Cut the last record just before its newline, still valid JSON
+    with open(journal_filename, 'wb') as journal_out:
+        journal_out.write(data[:-1])
+    records = RunJournal(journal_filename).load(out_filename)
+    assert [record['species'] for record in records] == ['a', 'b']
+
+
+# .............................................................................
+def test_load_ignores_records_past_output(tmp_path):
+    """Records with offsets beyond the output file are dropped."""
+    journal_filename = str(tmp_path / 'out.csv.journal')
+    out_filename = str(tmp_path / 'out.csv')
+    _write_run(journal_filename, out_filename, ['a', 'b', 'c'])
+    os.truncate(out_filename, 4)
+    records = RunJournal(journal_filename).load(out_filename)
+    assert [record['species'] for record in records] == ['a', 'b']
+
+
+# .............................................................................
+def test_resume_appends_after_valid_records(tmp_path):
+    """Resuming keeps the valid records in place and appends after them."""
+    journal_filename = str(tmp_path / 'out.csv.journal')
+    out_filename = str(tmp_path / 'out.csv')
+    _write_run(journal_filename, out_filename, ['a', 'b'])
+    with open(journal_filename, 'rb') as journal_in:
+        valid = journal_in.read()
+    with open(journal_filename, 'ab') as journal_out:
+        journal_out.write(b'{"species": "c", "off')
+
+    journal = RunJournal(journal_filename, checkpoint_interval=0)
+    assert len(journal.load(out_filename)) == 2
+    with open(out_filename, 'a') as out_file, journal:
+        journal.open(out_file, resume=True)
+        out_file.write('c\n')
+        journal.record('c', out_file.tell(), 1, {})
+    with open(journal_filename, 'rb') as journal_in:
+        data = journal_in.read()
+    assert data.startswith(valid)
+    assert json.loads(data[len(valid):])['species'] == 'c'
+
+
+# .............................................................................
+def test_new_run_starts_empty_journal(tmp_path):
+    """Opening without resume drops any earlier records."""
+    journal_filename = str(tmp_path / 'out.csv.journal')
+    out_filename = str(tmp_path / 'out.csv')
+    _write_run(journal_filename, out_filename, ['a', 'b'])
+    _write_run(journal_filename, out_filename, ['c'])
+    records = RunJournal(journal_filename).load(out_filename)
+    assert [record['species'] for record in records] == ['c']
+
+
+# .............................................................................
+def test_records_wait_for_checkpoint(tmp_path, monkeypatch):
+    """Records are written at checkpoints, after the output is synced."""
+    synced = []
+    monkeypatch.setattr(run_journal.os, 'fsync', synced.append)
+    journal_filename = str(tmp_path / 'out.csv.journal')
+    journal = RunJournal(journal_filename, checkpoint_interval=3600)
+    with open(str(tmp_path / 'out.csv'), 'w') as out_file, journal:
+        journal.open(out_file)
+        out_file.write('a\n')
+        journal.record('a', out_file.tell(), 1, {})
+        assert os.path.getsize(journal_filename) == 0
+        assert synced == []
+        journal.checkpoint()
+        assert synced == [out_file.fileno(), journal._file.fileno()]
+        assert os.path.getsize(journal_filename) > 0
@@ -0,0 +1,357 @@
+"""Tests for the spatial index module."""
+from concurrent.futures import ThreadPoolExecutor
+import json
+import os
+import pickle
+
+import numpy as np
+import pytest
+
+pytest.importorskip('osgeo')
+
+from osgeo import ogr  # noqa: E402
+
+from tools.data_preparation.spatial_index import (  # noqa: E402
+    GRID_ENGINE, INDEX_VERSION, META_EXTENSION, RTREE_ENGINE, SpatialIndex,
+    quadtree_index)
+
+TRIANGLE_WKT = 'POLYGON((0 0, 10 0, 0 10, 0 0))'
+
+
+# .............................................................................
+def _get_square(min_x, min_y, size):
+    return ogr.CreateGeometryFromWkt(
+        'POLYGON(({0} {1}, {2} {1}, {2} {3}, {0} {3}, {0} {1}))'.format(
+            min_x, min_y, min_x + size, min_y + size))
+
+
+# .............................................................................
+def _get_index(**kwargs):
+    index = SpatialIndex(**kwargs)
+    index.add_feature(1, _get_square(0, 0, 10), {'name': 'a'})
+    index.add_feature(2, _get_square(5, 5, 10), {'name': 'b'})
+    return index
+
+
+# .............................................................................
+def test_search_many_matches_search():
+    """search_many finds the same features as search for each point."""
+    index = _get_index()
+    xs = np.array([1.0, 7.0, 12.0, 20.0, 10.0])
+    ys = np.array([1.0, 7.0, 12.0, 20.0, 10.0])
+    offsets, identifiers = index.search_many(xs, ys)
+    assert identifiers.dtype == np.int64
+    for i, (x, y) in enumerate(zip(xs, ys)):
+        assert sorted(identifiers[offsets[i]:offsets[i + 1]].tolist()) == \
+            sorted(index.search(x, y).keys())
+
+
+# .............................................................................
+def test_search_many_skips_non_finite_points():
+    """Points with NaN or infinite coordinates are not in any feature."""
+    offsets, _ = _get_index().search_many(
+        [np.nan, 1.0, np.inf, 1.0], [1.0, np.nan, 1.0, 1.0])
+    assert offsets.tolist() == [0, 0, 0, 0, 1]
+
+
+# .............................................................................
+def test_search_many_without_hits_keeps_identifier_dtype():
+    """Empty results have the dtype of the identifiers, not float64."""
+    for index in (_get_index(), SpatialIndex()):
+        offsets, identifiers = index.search_many([50.0, 60.0], [50.0, 60.0])
+        assert offsets.tolist() == [0, 0, 0]
+        assert len(identifiers) == 0
+        assert identifiers.dtype == np.int64
+
+
+# .............................................................................
+def test_quadtree_keeps_partial_cells_when_depth_runs_out():
+    """A partial cell larger than min_size is a leaf at depth 0."""
+    triangle = ogr.CreateGeometryFromWkt(TRIANGLE_WKT)
+    cells = quadtree_index(triangle, (0, 0, 10, 10), 0.0001, 0)
+    assert len(cells) == 1
+    bbox, cell = cells[0]
+    assert bbox == (0, 0, 10, 10)
+    assert cell is not True
+    assert cell.Area() == pytest.approx(50.0)
+
+
+# .............................................................................
+def test_search_finds_points_in_partial_leaves_at_depth_limit():
+    """Points in cells left partial by the depth limit are still found."""
+    index = SpatialIndex()
+    index.min_size = 0.0001
+    index.depth_left = 1
+    index.add_feature(1, ogr.CreateGeometryFromWkt(TRIANGLE_WKT), {})
+    assert any(cell is not True for _, _, cell in index.iter_cells())
+    xs = np.array([1.0, 4.0, 6.0, 2.0, 9.0])
+    ys = np.array([1.0, 4.0, 3.0, 7.0, 9.0])
+    offsets, _ = index.search_many(xs, ys)
+    assert np.diff(offsets).tolist() == [1, 1, 1, 1, 0]
+    assert [bool(index.search(x, y)) for x, y in zip(xs, ys)] == [
+        True, True, True, True, False]
+
+
+# .............................................................................
+def _get_many_features_index(**kwargs):
+    index = SpatialIndex(**kwargs)
+    index.depth_left = 4
+    for i in range(6):
+        for j in range(6):
+            index.add_feature(
+                10 * i + j, ogr.CreateGeometryFromWkt(
+                    'POLYGON(({0} {1}, {2} {1}, {0} {3}, {0} {1}))'.format(
+                        3 * i, 3 * j, 3 * i + 2.5, 3 * j + 2.5)), {})
+    return index
+
+
+# .............................................................................
+def test_bulk_load_matches_incremental_inserts():
+    """A bulk loaded rtree finds the same features as incremental inserts."""
+    rng = np.random.default_rng(7)
+    xs = rng.uniform(-1, 19, 2000)
+    ys = rng.uniform(-1, 19, 2000)
+    incremental = _get_many_features_index()
+    bulk = _get_many_features_index(bulk_load=True)
+    expected_offsets, expected_ids = incremental.search_many(xs, ys)
+    offsets, identifiers = bulk.search_many(xs, ys)
+    assert offsets.tolist() == expected_offsets.tolist()
+    assert identifiers.tolist() == expected_ids.tolist()
+    assert expected_offsets[-1] > 0
+
+
+# .............................................................................
+def test_bulk_load_defers_rtree_until_build():
+    """Cells are collected by add_feature and packed in one bulk load."""
+    index = _get_many_features_index(bulk_load=True)
+    assert len(index.cell_rows) == 0
+    assert len(index.index) == 0
+    stats = index.build()
+    num_cells = index.get_cell_stats()['num_cells']
+    assert len(index.index) == num_cells
+    assert stats['num_cells'] == num_cells
+    assert stats['build_seconds'] >= 0
+    incremental_stats = _get_many_features_index().get_rtree_stats()
+    assert incremental_stats['num_cells'] == num_cells
+    assert stats['num_leaves'] <= incremental_stats['num_leaves']
+    assert stats['node_fill'] >= incremental_stats['node_fill']
+
+
+# .............................................................................
+def test_incremental_inserts_wait_for_a_search():
+    """Cells of added features are packed and inserted once, when searched."""
+    index = _get_many_features_index()
+    assert len(index.cell_rows) == 0
+    assert len(index.index) == 0
+    assert index.search(1.0, 1.0) == {0: {}}
+    num_cells = len(index.cell_rows)
+    assert len(index.index) == num_cells > 0
+    index.add_feature(100, _get_square(1, 1, 20), {})
+    index.add_feature(101, _get_square(30, 30, 1), {})
+    assert len(index.cell_rows) == num_cells
+    assert sorted(index.search(1.2, 1.0)) == [0, 100]
+    assert index.search(30.5, 30.5) == {101: {}}
+    assert len(index.index) == len(index.cell_rows) > num_cells
+
+
+# .............................................................................
+def test_bulk_load_rebuilds_after_more_features():
+    """Features added after a build are packed in by the next search."""
+    index = SpatialIndex(bulk_load=True)
+    assert index.build()['num_cells'] == 0
+    index.add_feature(1, _get_square(0, 0, 10), {})
+    assert index.search_many([5.0], [5.0])[1].tolist() == [1]
+    index.add_feature(2, _get_square(20, 20, 10), {})
+    offsets, identifiers = index.search_many([5.0, 25.0], [5.0, 25.0])
+    assert offsets.tolist() == [0, 1, 2]
+    assert identifiers.tolist() == [1, 2]
+
+
+# .............................................................................
+@pytest.mark.parametrize('in_memory', [True, False])
+def test_save_and_load(tmp_path, in_memory):
+    """A saved index loads with the same cells, attributes and results."""
+    base_filename = str(tmp_path / 'index')
+    index = _get_index(base_filename=base_filename, max_leaf_vertices=8)
+    index.save()
+    loaded = SpatialIndex.load_from_file(base_filename, in_memory=in_memory)
+    assert loaded.max_leaf_vertices == 8
+    assert dict(loaded.att_lookup) == {1: {'name': 'a'}, 2: {'name': 'b'}}
+    assert list(loaded.iter_cells()) == list(index.iter_cells())
+    xs = np.array([1.0, 7.0, 12.0, 20.0])
+    offsets, identifiers = loaded.search_many(xs, xs)
+    expected_offsets, expected_ids = index.search_many(xs, xs)
+    assert offsets.tolist() == expected_offsets.tolist()
+    assert identifiers.tolist() == expected_ids.tolist()
+
+
+# .............................................................................
+@pytest.mark.parametrize('version', [None, 5, INDEX_VERSION + 1])
+def test_load_other_versions_fails(tmp_path, version):
+    """Indexes saved in another format version must be rebuilt."""
+    base_filename = str(tmp_path / 'index')
+    _get_index().save(base_filename)
+    meta_filename = base_filename + META_EXTENSION
+    with open(meta_filename) as meta_in:
+        meta = json.load(meta_in)
+    if version is None:
+        del meta['version']
+    else:
+        meta['version'] = version
+    with open(meta_filename, 'w') as meta_out:
+        json.dump(meta, meta_out)
+    with pytest.raises(ValueError, match='Rebuild the index'):
+        SpatialIndex.load_from_file(base_filename)
+
+
+# .............................................................................
+def _get_test_points():
+    """Random points plus points on grid lines, edges and outside."""
+    rng = np.random.default_rng(11)
+    xs = np.concatenate((
+        rng.uniform(-2, 20, 1500), np.arange(-1, 19, 0.5), [np.nan, 1.0]))
+    ys = np.concatenate((
+        rng.uniform(-2, 20, 1500), np.arange(-1, 19, 0.5)[::-1],
+        [1.0, np.inf]))
+    return xs, ys
+
+
+# .............................................................................
+@pytest.mark.parametrize('grid_resolution', [0.5, 1.0, 7.3])
+def test_grid_engine_matches_rtree(grid_resolution):
+    """The grid engine finds the same features as the rtree engine."""
+    xs, ys = _get_test_points()
+    rtree_index = _get_many_features_index(bulk_load=True)
+    rtree_index.add_feature(100, _get_square(2, 2, 12), {})
+    grid_index = _get_many_features_index(
+        engine=GRID_ENGINE, grid_resolution=grid_resolution)
+    grid_index.add_feature(100, _get_square(2, 2, 12), {})
+    expected_offsets, expected_ids = rtree_index.search_many(xs, ys)
+    offsets, identifiers = grid_index.search_many(xs, ys)
+    assert offsets.tolist() == expected_offsets.tolist()
+    assert identifiers.tolist() == expected_ids.tolist()
+    for x, y in list(zip(xs, ys))[::25]:
+        assert grid_index.search(x, y) == rtree_index.search(x, y)
+
+
+# .............................................................................
+def test_saved_engine_can_be_switched(tmp_path):
+    """An index saved with one engine can be searched with the other."""
+    xs, ys = _get_test_points()
+    expected = None
+    for saved_engine in (RTREE_ENGINE, GRID_ENGINE):
+        base_filename = str(tmp_path / saved_engine)
+        _get_index(engine=saved_engine, grid_resolution=2.0).save(
+            base_filename)
+        for engine in (None, RTREE_ENGINE, GRID_ENGINE):
+            loaded = SpatialIndex.load_from_file(base_filename, engine=engine)
+            assert loaded.engine == (engine or saved_engine)
+            assert loaded.grid_resolution == 2.0
+            offsets, identifiers = loaded.search_many(xs, ys)
+            if expected is None:
+                expected = (offsets.tolist(), identifiers.tolist())
+            assert (offsets.tolist(), identifiers.tolist()) == expected
+
+
+# .............................................................................
+@pytest.mark.parametrize(
+    'key', ['engine', 'grid_resolution', 'max_leaf_vertices'])
+def test_load_requires_settings(tmp_path, key):
+    """Every setting is part of the index format, none are defaulted."""
+    base_filename = str(tmp_path / 'index')
+    _get_index().save(base_filename)
+    meta_filename = base_filename + META_EXTENSION
+    with open(meta_filename) as meta_in:
+        meta = json.load(meta_in)
+    del meta[key]
+    with open(meta_filename, 'w') as meta_out:
+        json.dump(meta, meta_out)
+    with pytest.raises(KeyError):
+        SpatialIndex.load_from_file(base_filename)
+
+
+# .............................................................................
+def test_save_requires_filename():
+    """An index created without a base filename must be given one."""
+    with pytest.raises(ValueError):
+        _get_index().save()
+
+
+# .............................................................................
+@pytest.mark.parametrize(
+    'engine, extensions', [
+        (RTREE_ENGINE, ['.dat', '.geom', '.idx', '.json']),
+        (GRID_ENGINE, ['.geom', '.json'])])
+def test_save_writes_files(tmp_path, engine, extensions):
+    """Only the rtree engine writes a disk-backed rtree."""
+    _get_index(engine=engine).save(str(tmp_path / 'index'))
+    assert sorted(
+        os.path.splitext(filename)[1]
+        for filename in os.listdir(str(tmp_path))) == extensions
+
+
+# .............................................................................
+def test_saved_attributes(tmp_path):
+    """Attribute dictionaries of any schema and plain values are kept."""
+    base_filename = str(tmp_path / 'index')
+    attributes = {
+        'a': {'name': 'a', 'level': 3},
+        'b': {'code': 'B'},
+        'c': 7,
+        'd': ['x', 'y'],
+        'e': None
+    }
+    index = SpatialIndex(base_filename)
+    for i, (identifier, att_dict) in enumerate(attributes.items()):
+        index.add_feature(identifier, _get_square(2 * i, 0, 1), att_dict)
+    with pytest.raises(ValueError):
+        index.add_feature('a', _get_square(0, 0, 1), {})
+    index.save()
+    loaded = SpatialIndex.load_from_file(base_filename)
+    assert dict(loaded.att_lookup) == attributes
+    assert loaded.att_lookup.get_column('level') == [3, None, None, None, None]
+    assert loaded.search(2.5, 0.5) == {'b': {'code': 'B'}}
+    assert loaded.search(4.5, 0.5) == {'c': 7}
+
+
+# .............................................................................
+def test_loaded_index_can_grow(tmp_path):
+    """Features added to a loaded index are searched with the saved ones."""
+    base_filename = str(tmp_path / 'index')
+    _get_index().save(base_filename)
+    loaded = SpatialIndex.load_from_file(base_filename)
+    loaded.add_feature(3, _get_square(20, 20, 5), {'name': 'c'})
+    offsets, identifiers = loaded.search_many([1.0, 22.0], [1.0, 22.0])
+    assert offsets.tolist() == [0, 1, 2]
+    assert identifiers.tolist() == [1, 3]
+
+
+# .............................................................................
+def test_loaded_index_is_thread_safe(tmp_path):
+    """A loaded index can be shared by threads searching at once."""
+    base_filename = str(tmp_path / 'index')
+    _get_many_features_index().save(base_filename)
+    loaded = SpatialIndex.load_from_file(base_filename, in_memory=False)
+    xs, ys = _get_test_points()
+    expected = loaded.search_many(xs, ys)[1].tolist()
+    expected_single = [loaded.search(x, y) for x, y in zip(xs, ys)]
+
+    def search_all(_):
+        return (
+            loaded.search_many(xs, ys)[1].tolist(),
+            [loaded.search(x, y) for x, y in zip(xs, ys)])
+    with ThreadPoolExecutor(4) as executor:
+        for identifiers, hits in executor.map(search_all, range(8)):
+            assert identifiers == expected
+            assert hits == expected_single
+
+
+# .............................................................................
+def test_pickled_index_matches():
+    """An unpickled index rebuilds its engine and gives the same results."""
+    xs, ys = _get_test_points()
+    for engine in (RTREE_ENGINE, GRID_ENGINE):
+        index = _get_many_features_index(engine=engine)
+        unpickled = pickle.loads(pickle.dumps(index))
+        assert unpickled.search_many(xs, ys)[1].tolist() == \
+            index.search_many(xs, ys)[1].tolist()
@@ -0,0 +1,144 @@
+"""Tests for the WGSRPD region catalog module."""
+import os
+
+import numpy as np
+import pytest
+
+pytest.importorskip('osgeo')
+
+from tools.data_preparation.filters import (  # noqa: E402
+    get_tdwg_locality_filter, get_tdwg_locality_mask_filter,
+    get_tdwg_region_index_filter, get_tdwg_region_index_mask_filter)
+from tools.data_preparation.point_batch import (  # noqa: E402
+    Point, PointBatch)
+from tools.data_preparation.spatial_index import (  # noqa: E402
+    GRID_ENGINE, META_EXTENSION, RTREE_ENGINE)
+from tools.data_preparation.wgsrpd import (  # noqa: E402
+    WgsrpdCatalog, build_wgsrpd_index, get_wgsrpd_catalog, get_wgsrpd_index)
+
+
+# .............................................................................
+def _get_localities(*regions):
+    return [
+        {'tdwgLevel': level, 'tdwgCode': code} for level, code in regions]
+
+
+# .............................................................................
+def _get_points():
+    rng = np.random.default_rng(5)
+    return rng.uniform(-2, 42, 3000), rng.uniform(-2, 22, 3000)
+
+
+# .............................................................................
+def _get_hits(catalog, regions, xs, ys):
+    """Test each point against the region geometries directly."""
+    from osgeo import ogr
+
+    hits = []
+    geometries = catalog.get_locality_geometries(_get_localities(*regions))
+    for x, y in zip(xs, ys):
+        point = ogr.CreateGeometryFromWkt('POINT({} {})'.format(x, y))
+        hits.append(any(geom.Contains(point) for geom in geometries))
+    return hits
+
+
+# .............................................................................
+def _get_hit_ids(region_index, xs, ys):
+    offsets, identifiers = region_index.search_many(xs, ys)
+    return [
+        sorted(identifiers[start:end].tolist())
+        for start, end in zip(offsets[:-1], offsets[1:])]
+
+
+# .............................................................................
+def test_catalog_loads_every_level(wgsrpd_dir, wgsrpd_features):
+    """Each region is keyed by level and code string, with all features."""
+    catalog = WgsrpdCatalog(wgsrpd_dir)
+    assert sorted(catalog.geometries) == sorted(
+        set((level, str(code)) for level, features in wgsrpd_features.items()
+            for code, _ in features))
+    assert len(catalog.get_geometries(3, 'CCC')) == 2
+    assert len(catalog.get_geometries('1', 2)) == 1
+    assert catalog.get_geometries(3, 'ZZZ') == []
+    assert catalog.get_geometries(4, 'AAA-OO')[0].Area() == \
+        pytest.approx(50.0)
+    assert catalog.attributes[(3, 'BBB')]['NAME'] == 'Region BBB'
+    assert len(catalog.get_locality_geometries(
+        _get_localities((3, 'CCC'), (2, 10), (4, 'NONE')))) == 3
+
+
+# .............................................................................
+def test_catalog_is_shared(wgsrpd_dir):
+    """The shapefiles of a directory are only read once per process."""
+    assert get_wgsrpd_catalog(wgsrpd_dir) is get_wgsrpd_catalog(wgsrpd_dir)
+
+
+# .............................................................................
+def test_build_index_levels(wgsrpd_dir, wgsrpd_features):
+    """The index holds one feature per region geometry of the levels."""
+    catalog = get_wgsrpd_catalog(wgsrpd_dir)
+    region_index = build_wgsrpd_index(catalog, levels=(3, 4))
+    regions = sorted(
+        (att['level'], att['code'])
+        for att in dict(region_index.att_lookup).values())
+    assert regions == sorted(
+        (level, code) for level in (3, 4)
+        for code, _ in wgsrpd_features[level])
+    offsets, identifiers = region_index.search_many([15.0, 30.0], [5.0, 15.5])
+    assert sorted(
+        region_index.att_lookup[identifier]['code']
+        for identifier in identifiers[offsets[0]:offsets[1]]) == [
+            'BBB', 'BBB-OO']
+    assert [region_index.att_lookup[identifier]['code'] for identifier in
+            identifiers[offsets[1]:offsets[2]]] == ['DDD']
+
+
+# .............................................................................
+@pytest.mark.parametrize('engine', [RTREE_ENGINE, GRID_ENGINE])
+def test_get_index_builds_once(wgsrpd_dir, tmp_path, engine):
+    """The index is built and saved by the first call, then loaded."""
+    base_filename = str(tmp_path / 'wgsrpd')
+    xs, ys = _get_points()
+    built = get_wgsrpd_index(wgsrpd_dir, base_filename, engine=engine)
+    assert os.path.exists(base_filename + META_EXTENSION)
+    loaded = get_wgsrpd_index('no such directory', base_filename)
+    assert loaded.engine == engine
+    assert _get_hit_ids(loaded, xs, ys) == _get_hit_ids(built, xs, ys)
+
+
+# .............................................................................
+@pytest.mark.parametrize('regions', [
+    [(3, 'CCC')], [(4, 'AAA-XX'), (1, 2)], [(3, 'DDD'), (2, 10)], []])
+def test_locality_filters_match_geometries(wgsrpd_dir, regions):
+    """The locality filters allow the points inside the region geometries."""
+    xs, ys = _get_points()
+    expected = _get_hits(get_wgsrpd_catalog(wgsrpd_dir), regions, xs, ys)
+    localities = _get_localities(*regions)
+    batch = PointBatch(['Species a'], np.zeros(len(xs)), xs, ys)
+    mask = get_tdwg_locality_mask_filter(localities, wgsrpd_dir=wgsrpd_dir)(
+        batch)
+    assert mask.tolist() == expected
+    point_filter = get_tdwg_locality_filter(
+        localities, wgsrpd_dir=wgsrpd_dir)
+    assert [point_filter(Point('Species a', x, y, []))
+            for x, y in zip(xs, ys)] == expected
+
+
+# .............................................................................
+@pytest.mark.parametrize('regions', [
+    [(3, 'CCC')], [(4, 'AAA-XX'), (1, 2)], [(3, 'DDD'), (2, 10)], []])
+def test_region_index_filters_match_geometries(wgsrpd_dir, tmp_path,
+                                               regions):
+    """Filters using a saved region index allow the same points."""
+    xs, ys = _get_points()
+    expected = _get_hits(get_wgsrpd_catalog(wgsrpd_dir), regions, xs, ys)
+    base_filename = str(tmp_path / 'wgsrpd')
+    get_wgsrpd_index(wgsrpd_dir, base_filename)
+    region_index = get_wgsrpd_index(wgsrpd_dir, base_filename)
+    localities = _get_localities(*regions)
+    batch = PointBatch(['Species a'], np.zeros(len(xs)), xs, ys)
+    mask = get_tdwg_region_index_mask_filter(localities, region_index)(batch)
+    assert mask.tolist() == expected
+    point_filter = get_tdwg_region_index_filter(localities, region_index)
+    assert [point_filter(Point('Species a', x, y, []))
+            for x, y in zip(xs, ys)] == expected
@@ -0,0 +1,114 @@
+"""Tests for the writer pool module."""
+import os
+import random
+
+import pytest
+
+from tools.common.writer_pool import WriterPool
+
+
+# .............................................................................
+def _read_files(out_dir):
+    contents = {}
+    for filename in os.listdir(out_dir):
+        with open(os.path.join(out_dir, filename)) as in_file:
+            contents[filename] = in_file.read()
+    return contents
+
+
+# .............................................................................
+def _get_writes(num_writes, num_keys, seed=0):
+    rng = random.Random(seed)
+    return [
+        ('k{}'.format(rng.randrange(num_keys)), 'line {}\n'.format(i))
+        for i in range(num_writes)]
+
+
+# .............................................................................
+def _get_expected(writes, header=''):
+    expected = {}
+    for key, text in writes:
+        expected.setdefault('{}.txt'.format(key), header)
+        expected['{}.txt'.format(key)] += text
+    return expected
+
+
+# .............................................................................
+@pytest.mark.parametrize('max_open, buffer_size, max_buffered', [
+    (1, 10, 25), (3, 50, 100), (100, 1000000, 1000000)])
+def test_output_matches_direct_writes(tmp_path, max_open, buffer_size,
+                                      max_buffered):
+    """Files hold every write in order whatever the limits are."""
+    out_dir = str(tmp_path)
+    writes = _get_writes(2000, 40)
+    with WriterPool(
+            lambda key: os.path.join(out_dir, '{}.txt'.format(key)),
+            header='h\n', max_open=max_open, buffer_size=buffer_size,
+            max_buffered=max_buffered) as pool:
+        for key, text in writes:
+            pool.write(key, text)
+            assert len(pool._handles) <= max_open
+            assert pool.total_buffered <= max_buffered
+    assert _read_files(out_dir) == _get_expected(writes, header='h\n')
+
+
+# .............................................................................
+def test_flushed_buckets_release_buffers(tmp_path):
+    """Flushing removes a bucket's buffer and keeps the size heap small."""
+    out_dir = str(tmp_path)
+    writes = _get_writes(20000, 500)
+    with WriterPool(
+            lambda key: os.path.join(out_dir, '{}.txt'.format(key)),
+            max_open=4, buffer_size=200, max_buffered=2000) as pool:
+        for key, text in writes:
+            pool.write(key, text)
+            assert len(pool._size_heap) <= 2 * len(pool._buffer_sizes) + 1025
+        assert sum(pool._buffer_sizes.values()) == pool.total_buffered
+        pool.flush_all()
+        assert pool._buffers == {}
+        assert pool.total_buffered == 0
+    assert _read_files(out_dir) == _get_expected(writes)
+
+
+# .............................................................................
+def test_largest_buffer_is_flushed_first(tmp_path):
+    """Going over max_buffered writes out the largest buffer."""
+    out_dir = str(tmp_path)
+    with WriterPool(
+            lambda key: os.path.join(out_dir, key), buffer_size=1000,
+            max_buffered=20) as pool:
+        pool.write('small', 'abc')
+        pool.write('big', 'abcdefghij')
+        pool.write('small', 'abc')
+        pool.write('other', 'abcdef')
+        assert 'big' not in pool._buffers
+        assert pool._buffer_sizes == {'small': 6, 'other': 6}
+
+
+# .............................................................................
+def test_sorted_keys_close_finished_buckets(tmp_path):
+    """With sorted keys, a bucket is written and closed at the next key."""
+    out_dir = str(tmp_path)
+    writes = sorted(_get_writes(500, 30))
+    with WriterPool(
+            lambda key: os.path.join(out_dir, '{}.txt'.format(key)),
+            sorted_keys=True) as pool:
+        for key, text in writes:
+            pool.write(key, text)
+            assert set(pool._buffers) <= {key}
+            assert set(pool._handles) <= {key}
+        # A key coming back is appended to, not truncated
+        pool.write('k0', 'again\n')
+    expected = _get_expected(writes + [('k0', 'again\n')])
+    assert _read_files(out_dir) == expected
+    assert pool.num_opens == 31
+
+
+# .............................................................................
+def test_created_buckets_get_files(tmp_path):
+    """Registered buckets without data still get a file with the header."""
+    out_dir = str(tmp_path)
+    with WriterPool(
+            lambda key: os.path.join(out_dir, key), header='h\n') as pool:
+        pool.create('empty')
+    assert _read_files(out_dir) == {'empty': 'h\n'}
@@ -1,21 +1,35 @@
-"""Build a spatial index for searching"""
+"""Build a spatial index for searching
+
+The saved index can be loaded with SpatialIndex.load_from_file and searched a
+point at a time with search or for arrays of points with search_many.
+"""
 import argparse
 
 from osgeo import ogr
 
-from lmpy.spatial import SpatialIndex
+from tools.data_preparation.spatial_index import (
+    DEFAULT_GRID_RESOLUTION, DEFAULT_MAX_LEAF_VERTICES, INDEX_ENGINES,
+    RTREE_ENGINE, SpatialIndex)
 
 
 # ............................................................................
-def build_index(base_index_filename, shapefiles):
+def build_index(base_index_filename, shapefiles, max_leaf_vertices=None,
+                engine=RTREE_ENGINE, grid_resolution=DEFAULT_GRID_RESOLUTION):
     """Build a spatial index and save to files.
 
     Args:
         base_index_filename (str): Base file location for index files.
         shapefiles (list of str): A list of shapefile filenames to use for
             index.
+        max_leaf_vertices (int): If provided, choose the quadtree settings of
+            each feature to keep at most this many vertices per leaf.
+        engine (str): Find cells with an rtree or a uniform grid.
+        grid_resolution (float): The grid cell size of the grid engine.
     """
-    index = SpatialIndex(base_index_filename)
+    index = SpatialIndex(
+        base_index_filename, bulk_load=True,
+        max_leaf_vertices=max_leaf_vertices, engine=engine,
+        grid_resolution=grid_resolution)
     # Loop through shapefiles and add features
     i = 0
     for shapefile_filename in shapefiles:
@@ -33,6 +47,28 @@ def build_index(base_index_filename, shapefiles):
             index.add_feature(i, feature.geometry(), feat_atts)
             i += 1
         layer = dataset = None
+    # Pack the rtree in one bulk load, or bucket the cells on the grid
+    stats = index.build()
+    if engine == RTREE_ENGINE:
+        print(
+            'Packed {} cells into {} leaves in {:.2f} seconds, {:.0%} node '
+            'fill'.format(
+                stats['num_cells'], stats['num_leaves'],
+                stats['build_seconds'], stats['node_fill']))
+    else:
+        print(
+            'Bucketed {} cells into {} of {} grid cells in {:.2f} seconds, '
+            '{:.1f} cells per bucket, at most {}'.format(
+                stats['num_cells'], stats['occupied_buckets'],
+                stats['num_buckets'], stats['build_seconds'],
+                stats['mean_bucket_cells'], stats['max_bucket_cells']))
+    cell_stats = index.get_cell_stats()
+    print(
+        '{} quadtree cells, {:.0%} full, {:.1f} vertices per partial cell, '
+        '{:.1f} MB of cell geometry'.format(
+            cell_stats['num_cells'], cell_stats['full_cell_ratio'],
+            cell_stats['mean_leaf_vertices'],
+            cell_stats['memory_bytes'] / 1024 / 1024))
     index.save()
 
 
@@ -40,13 +76,30 @@ def build_index(base_index_filename, shapefiles):
 def main():
     """Main method for script."""
     parser = argparse.ArgumentParser()
+    parser.add_argument(
+        '-v', '--max_leaf_vertices', type=int, nargs='?',
+        const=DEFAULT_MAX_LEAF_VERTICES,
+        help='Choose the quadtree depth of each feature to keep at most this '
+        'many vertices per leaf (default {} if given without a '
+        'value).'.format(DEFAULT_MAX_LEAF_VERTICES))
+    parser.add_argument(
+        '-e', '--engine', choices=INDEX_ENGINES, default=RTREE_ENGINE,
+        help='Find cells with an rtree or by bucketing them on a uniform '
+        'grid.')
+    parser.add_argument(
+        '-g', '--grid_resolution', type=float,
+        default=DEFAULT_GRID_RESOLUTION,
+        help='Grid cell size of the grid engine.')
     parser.add_argument(
         'base_filename', type=str, help='Base filename for index data files')
     parser.add_argument(
         'shapefile', type=str, nargs='+',
         help='Shapefile to add to index')
     args = parser.parse_args()
-    build_index(args.base_filename, args.shapefile)
+    build_index(
+        args.base_filename, args.shapefile,
+        max_leaf_vertices=args.max_leaf_vertices, engine=args.engine,
+        grid_resolution=args.grid_resolution)
 
 
 # ............................................................................
@@ -0,0 +1,34 @@
+"""Convert per-species occurrence files to a consolidated occurrence store.
+
+Reads every {genus}/{species}_gbif.csv and {genus}/{species}_idigbio.csv file
+under a base directory and writes them to a single occurrence store that
+create_occurrence_csv.py can read with --store_dir.
+"""
+import argparse
+
+from tools.data_preparation.occurrence_pipeline import convert_to_store
+
+
+# .............................................................................
+def main():
+    """Main method for script."""
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        '-p', '--precision', type=int,
+        help='Store coordinates as int32 fixed point values with this many '
+        'decimal places instead of float64.')
+    parser.add_argument(
+        'base_dir', type=str,
+        help='Base data directory containing genus directories.')
+    parser.add_argument(
+        'store_dir', type=str, help='Directory to write the store to.')
+    args = parser.parse_args()
+
+    store = convert_to_store(
+        args.base_dir, args.store_dir, precision=args.precision)
+    print('Wrote {} points to {}'.format(store.num_points, args.store_dir))
+
+
+# .............................................................................
+if __name__ == '__main__':
+    main()
@@ -1,86 +1,98 @@
-"""Process an occurrence download and write out species data."""
-import argparse
-import os
-
-from lmpy.data_preparation.occurrence_transformation import (
-    convert_gbif_download, convert_idigbio_download)
-
-
-# .............................................................................
-def get_species_filename(species_name, base_dir, service_suffix):
-    """Get the file name for the species data / service combination.
-
-    Args:
-        species_name (str): The name of the species.
-        base_dir (str): The base directory to write points.
-        service_suffix (str): The service suffix for the data files.
-    """
-    temp = species_name.replace('_', ' ').split(' ')
-    genus = temp[0]
-    escaped_species = '{} {}'.format(genus, temp[1])
-    genus_dir = os.path.join(base_dir, genus)
-    species_filename = os.path.join(
-        genus_dir, '{}{}.csv'.format(escaped_species, service_suffix))
-    if not os.path.exists(genus_dir):
-        os.mkdir(genus_dir)
-    return species_filename
-
-
-# .............................................................................
-def write_points(points, base_dir, service_suffix):
-    """Write the sorted points into separate directories and files.
-
-    Args:
-        points (list of Point): A list of points sorted by species name.
-        base_dir (str): The base directory to write points.
-        service_suffix (str): The service suffix for the data files.
-    """
-    current_species = None
-    out_file = None
-    for point in points:
-        if point.species_name != current_species:
-            if out_file:
-                out_file.close()
-            current_species = point.species_name
-            out_file = open(
-                get_species_filename(
-                    current_species, base_dir, service_suffix), 'w')
-        if point.flags:
-            flags = ','.join(point.flags)
-        else:
-            flags = ''
-        out_file.write(
-            '{}, {}, {}, "{}"\n'.format(
-                point.species_name, point.x, point.y, flags))
-    if out_file:
-        out_file.close()
-
-
-# .............................................................................
-def main():
-    """Main method for script."""
-    parser = argparse.ArgumentParser()
-    parser.add_argument(
-        'provider', type=str, choices=('idigbio', 'gbif'),
-        help='The data provider service that created the download.')
-    parser.add_argument(
-        'filename', type=str, help='The downloaded occurrence data file.')
-    parser.add_argument(
-        'base_dir', type=str, help='The base directory to write data')
-    args = parser.parse_args()
-    print('Getting points...')
-    if args.provider == 'idigbio':
-        points = convert_idigbio_download(args.filename)
-        service_suffix = '_idigbio'
-    else:
-        points = convert_gbif_download(args.filename)
-        service_suffix = '_gbif'
-    print('Sorting points...')
-    points.sort()
-    print('Writing points...')
-    write_points(points, args.base_dir, service_suffix)
-
-
-# .............................................................................
-if __name__ == '__main__':
-    main()
+"""Process an occurrence download and write out species data."""
+import argparse
+import os
+
+from lmpy.data_preparation.occurrence_transformation import (
+    convert_gbif_download, convert_idigbio_download)
+
+from tools.common.writer_pool import DEFAULT_MAX_OPEN, WriterPool
+
+
+# .............................................................................
+def get_species_filename(species_name, base_dir, service_suffix):
+    """Get the file name for the species data / service combination.
+
+    Args:
+        species_name (str): The name of the species.
+        base_dir (str): The base directory to write points.
+        service_suffix (str): The service suffix for the data files.
+    """
+    temp = species_name.replace('_', ' ').split(' ')
+    genus = temp[0]
+    escaped_species = '{} {}'.format(genus, temp[1])
+    genus_dir = os.path.join(base_dir, genus)
+    species_filename = os.path.join(
+        genus_dir, '{}{}.csv'.format(escaped_species, service_suffix))
+    if not os.path.exists(genus_dir):
+        os.mkdir(genus_dir)
+    return species_filename
+
+
+# .............................................................................
+def write_points(points, base_dir, service_suffix, max_open=DEFAULT_MAX_OPEN,
+                 sorted_points=False):
+    """Write the points into separate directories and files for each species.
+
+    Species files are written through a WriterPool, so the points of a
+    species do not need to be contiguous, although sorted points need the
+    fewest file reopens.  With sorted_points, each species file is written
+    and closed as soon as the next species starts.
+
+    Args:
+        points (iterable of Point): Points, usually sorted by species name.
+        base_dir (str): The base directory to write points.
+        service_suffix (str): The service suffix for the data files.
+        max_open (int): The maximum number of species files open at once.
+        sorted_points (bool): The points are sorted by species name.
+    """
+    species_filenames = {}
+    with WriterPool(
+            lambda filename: filename, max_open=max_open,
+            sorted_keys=sorted_points) as pool:
+        for point in points:
+            if point.species_name not in species_filenames:
+                species_filenames[point.species_name] = get_species_filename(
+                    point.species_name, base_dir, service_suffix)
+            if point.flags:
+                flags = ','.join(point.flags)
+            else:
+                flags = ''
+            pool.write(
+                species_filenames[point.species_name],
+                '{}, {}, {}, "{}"\n'.format(
+                    point.species_name, point.x, point.y, flags))
+
+
+# .............................................................................
+def main():
+    """Main method for script."""
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        '-o', '--max_open', type=int, default=DEFAULT_MAX_OPEN,
+        help='Maximum number of species files open at once.')
+    parser.add_argument(
+        'provider', type=str, choices=('idigbio', 'gbif'),
+        help='The data provider service that created the download.')
+    parser.add_argument(
+        'filename', type=str, help='The downloaded occurrence data file.')
+    parser.add_argument(
+        'base_dir', type=str, help='The base directory to write data')
+    args = parser.parse_args()
+    print('Getting points...')
+    if args.provider == 'idigbio':
+        points = convert_idigbio_download(args.filename)
+        service_suffix = '_idigbio'
+    else:
+        points = convert_gbif_download(args.filename)
+        service_suffix = '_gbif'
+    print('Sorting points...')
+    points.sort()
+    print('Writing points...')
+    write_points(
+        points, args.base_dir, service_suffix, max_open=args.max_open,
+        sorted_points=True)
+
+
+# .............................................................................
+if __name__ == '__main__':
+    main()
@@ -5,10 +5,12 @@ Multiple input files -> one output file
 import argparse
 import json
 
-from lmpy.point import PointCsvReader, PointCsvWriter
+from lmpy.point import PointCsvWriter
 from lmpy.data_preparation.occurrence_transformation import wrangle_points
 from lmpy.data_wrangling.occurrence.factory import wrangler_factory
 
+from tools.data_preparation.point_reader import get_point_reader
+
 
 # .............................................................................
 def main():
@@ -24,13 +26,13 @@ def main():
     parser.add_argument('y_field', type=str, help='Field in CSV for Y coordinate')
     parser.add_argument(
         'in_filename', type=str, action='append',
-        help='Input CSV file location')
+        help='Input CSV file location, may be a zip or gzip archive')
     args = parser.parse_args()
 
     # Initialize point readers
     readers = []
     for filename in args.in_filename:
-        point_reader = PointCsvReader(
+        point_reader = get_point_reader(
             filename, args.species_field, args.x_field, args.y_field,
             geopoint=args.geopoint)
         point_reader.open()
@@ -5,10 +5,12 @@ Sort a single file based on a group field
 import argparse
 import json
 
-from lmpy.point import PointCsvReader, PointCsvWriter
+from lmpy.point import PointCsvWriter
 from lmpy.data_preparation.occurrence_transformation import sort_points
 from lmpy.data_wrangling.occurrence.factory import wrangler_factory
 
+from tools.data_preparation.point_reader import get_point_reader
+
 
 # .............................................................................
 def main():
@@ -18,7 +20,7 @@ def main():
         '-f', '--filter_config', type=argparse.FileType('r'), action='append',
         help='Data wrangler configuration filename.')
     parser.add_argument('in_filename', type=str,
-        help='Input CSV file location')
+        help='Input CSV file location, may be a zip or gzip archive')
     parser.add_argument('out_filename', type=str, help='Output file location')
     parser.add_argument('species_field', type=str,
         help='Field in CSV for species name')
@@ -34,7 +36,7 @@ def main():
         wranglers = [wrangler_factory(json.load(config)) for config in args.filter_config]
 
     # Initialize point reader
-    with PointCsvReader(
+    with get_point_reader(
             args.in_filename, args.species_field, args.x_field, args.y_field
             ) as reader:
         # Open point writer
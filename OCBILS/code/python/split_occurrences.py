@@ -1,13 +1,48 @@
 """Split occurrence records based on a field"""
 import argparse
+import csv
+import io
 import json
 
-from lmpy.point import PointCsvReader, PointCsvWriter
 from lmpy.data_preparation.occurrence_transformation import split_points
 from lmpy.data_wrangling.occurrence.factory import wrangler_factory
 
+from tools.common.writer_pool import (
+    DEFAULT_BUFFER_SIZE, DEFAULT_MAX_OPEN, WriterPool)
+from tools.data_preparation.point_reader import get_point_reader
+
 
 CHARACTER_SET = list('abcdefghijklmnopqrstuvwxyz')
+OUT_FIELDS = ['species_name', 'x', 'y']
+
+
+# .............................................................................
+class PooledPointWriter:
+    """Write points to one file of a WriterPool, like a PointCsvWriter."""
+    # ..........................
+    def __init__(self, pool, key, fields):
+        """Constructor.
+
+        Args:
+            pool (WriterPool): The pool managing the output files.
+            key (str): The bucket key of the output file in the pool.
+            fields (list of str): The point attributes to write.
+        """
+        self.pool = pool
+        self.key = key
+        self.fields = fields
+        pool.create(key)
+
+    # ..........................
+    def write_points(self, points):
+        """Write a point or list of points."""
+        if not isinstance(points, (list, tuple)):
+            points = [points]
+        text = io.StringIO()
+        writer = csv.writer(text, lineterminator='\n')
+        for point in points:
+            writer.writerow([getattr(point, fld) for fld in self.fields])
+        self.pool.write(self.key, text.getvalue())
 
 
 # .............................................................................
@@ -29,6 +64,12 @@ def main():
     parser.add_argument(
         '-f', '--filter_config', type=argparse.FileType('r'), action='append',
         help='Data wrangler configuration filename.')
+    parser.add_argument(
+        '-o', '--max_open', type=int, default=DEFAULT_MAX_OPEN,
+        help='Maximum number of output files open at once.')
+    parser.add_argument(
+        '-b', '--buffer_size', type=int, default=DEFAULT_BUFFER_SIZE,
+        help='Characters buffered for an output file before it is written.')
     parser.add_argument('base_out_filename', type=str, help='Output file location')
     parser.add_argument('species_field', type=str, help='Field in CSV for species name')
     parser.add_argument('x_field', type=str, help='Field in CSV for X coordinate')
@@ -38,13 +79,13 @@ def main():
     parser.add_argument('group_attribute', type=str)
     parser.add_argument(
         'in_filename', type=str, nargs='+',
-        help='Input CSV file location')
+        help='Input CSV file location, may be a zip or gzip archive')
     args = parser.parse_args()
 
     # Initialize point readers
     readers = []
     for filename in args.in_filename:
-        point_reader = PointCsvReader(
+        point_reader = get_point_reader(
             filename, args.species_field, args.x_field, args.y_field)
         point_reader.open()
         readers.append(point_reader)
@@ -54,18 +95,18 @@ def main():
     if args.filter_config:
         wranglers = [wrangler_factory(json.load(config)) for config in args.filter_config]
 
-    writers = {}
-    for combo in get_all_combos(CHARACTER_SET, args.group_size):
-        out_filename = '{}{}.csv'.format(args.base_out_filename, combo)
-        writers[combo] = PointCsvWriter(
-            out_filename, ['species_name', 'x', 'y'])
-        writers[combo].open()
-    # Split the occurrence data files
-    split_points(
-        readers, writers, args.group_attribute, args.group_size,
-        args.group_position, wranglers=wranglers)
-    for writer in writers.values():
-        writer.close()
+    # Output files share a pool of handles instead of all being open at once
+    with WriterPool(
+            lambda combo: '{}{}.csv'.format(args.base_out_filename, combo),
+            header='{}\n'.format(','.join(OUT_FIELDS)),
+            max_open=args.max_open, buffer_size=args.buffer_size) as pool:
+        writers = {}
+        for combo in get_all_combos(CHARACTER_SET, args.group_size):
+            writers[combo] = PooledPointWriter(pool, combo, OUT_FIELDS)
+        # Split the occurrence data files
+        split_points(
+            readers, writers, args.group_attribute, args.group_size,
+            args.group_position, wranglers=wranglers)
 
     # Close readers
     for point_reader in readers: